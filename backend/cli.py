@@ -0,0 +1,225 @@
+"""
+Command line entry point for running Hisab in production.
+
+    python cli.py serve --workers 4 --db-connection-budget 40
+    python cli.py bench --url http://localhost:8000 --concurrency 32 --duration 20
+    python cli.py bench-statements --iterations 2000
+    python cli.py bench-import --expenses 20000
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+# mysql-connector refuses pools larger than this (pooling.CNX_POOL_MAXSIZE)
+MAX_POOL_SIZE_PER_WORKER = 32
+
+cli = typer.Typer(help="Hisab API server commands.")
+
+
+def pool_size_per_worker(db_connection_budget: int, workers: int) -> int:
+    """Split the total DB connection budget evenly across workers."""
+    size = db_connection_budget // workers
+    if size < 1:
+        raise typer.BadParameter(
+            f"A budget of {db_connection_budget} connections cannot cover {workers} workers"
+        )
+    return min(size, MAX_POOL_SIZE_PER_WORKER)
+
+
+@cli.command()
+def serve(
+    host: str = typer.Option("0.0.0.0", help="Address to bind."),
+    port: int = typer.Option(8000, help="Port to bind."),
+    workers: int = typer.Option(
+        os.cpu_count() or 1, envvar="WEB_CONCURRENCY", help="Number of worker processes."
+    ),
+    db_connection_budget: int = typer.Option(
+        40, envvar="DB_CONNECTION_BUDGET",
+        help="Total MySQL connections all workers may hold; each worker gets an equal share.",
+    ),
+    graceful_timeout: int = typer.Option(
+        30, envvar="GRACEFUL_TIMEOUT_SECONDS",
+        help="Seconds to let in-flight requests finish after SIGTERM before closing.",
+    ),
+):
+    """Run the API with several worker processes, each with its own DB pool."""
+    import uvicorn
+
+    pool_size = pool_size_per_worker(db_connection_budget, workers)
+    # Workers inherit the environment; each creates its pool on startup
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    typer.echo(f"Starting {workers} worker(s) with a DB pool of {pool_size} connection(s) each")
+
+    uvicorn.run(
+        "server:app",
+        host=host,
+        port=port,
+        workers=workers,
+        app_dir=str(BACKEND_DIR),
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+
+
+@cli.command()
+def bench(
+    url: str = typer.Option("http://localhost:8000", help="Base URL of a running server."),
+    path: str = typer.Option("/api/groups/", help="Path to request."),
+    token: Optional[str] = typer.Option(None, envvar="HISAB_BENCH_TOKEN", help="Bearer token for authenticated paths."),
+    concurrency: int = typer.Option(32, help="Number of concurrent clients."),
+    duration: float = typer.Option(20.0, help="Seconds to run."),
+):
+    """Measure throughput and latency of one endpoint on a running server."""
+    import requests
+
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    deadline = time.monotonic() + duration
+    latencies: List[float] = []
+    errors: List[int] = []
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = session.get(url + path, headers=headers, timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(1)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    if not latencies:
+        typer.echo(f"No successful requests ({len(errors)} errors)")
+        raise typer.Exit(1)
+    cuts = statistics.quantiles(latencies, n=100)
+    typer.echo(f"{len(latencies)} ok, {len(errors)} errors in {elapsed:.1f}s")
+    typer.echo(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    typer.echo(f"latency ms: p50 {cuts[49] * 1000:.1f}  p95 {cuts[94] * 1000:.1f}  p99 {cuts[98] * 1000:.1f}")
+
+
+@cli.command("bench-statements")
+def bench_statements(
+    iterations: int = typer.Option(2000, help="Executions per statement and protocol."),
+):
+    """Compare the hot prepared statements with the text protocol on the configured database."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    server.init_db_pool()
+    connection = server.db_pool.get_connection()
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT g.id as group_id, g.settlement_cycle, u.id as user_id, u.email
+            FROM groups g
+            INNER JOIN group_members gm ON gm.group_id = g.id AND gm.is_active = TRUE
+            INNER JOIN users u ON u.id = gm.user_id
+            WHERE g.deleted_at IS NULL
+            ORDER BY g.data_version DESC
+            LIMIT 1
+        """)
+        sample = cursor.fetchone()
+        cursor.close()
+        if not sample:
+            typer.echo("The database has no groups to benchmark against")
+            raise typer.Exit(1)
+
+        group_id, cycle = sample["group_id"], sample["settlement_cycle"]
+        statement_params = {
+            server.USER_BY_EMAIL: (sample["email"],),
+            server.USER_GROUP_IDS: (sample["user_id"],),
+            server.CYCLE_MEMBER_TOTALS: (group_id, group_id, cycle, group_id, cycle, group_id),
+            server.CYCLE_SETTLEMENTS: (group_id, cycle),
+        }
+        registry = server.prepared_statements
+        for name, params in statement_params.items():
+            micros = {}
+            for protocol, enabled in (("text", False), ("prepared", True)):
+                registry.enabled = enabled
+                registry.execute(connection, name, params)  # prepare / warm the buffer pool
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    registry.execute(connection, name, params)
+                micros[protocol] = (time.perf_counter() - started) / iterations * 1e6
+            typer.echo(
+                f"{name:<22} text {micros['text']:8.1f} us   prepared {micros['prepared']:8.1f} us   "
+                f"({micros['text'] / micros['prepared']:.2f}x)"
+            )
+    finally:
+        connection.close()
+
+
+@cli.command("bench-import")
+def bench_import(
+    expenses: int = typer.Option(20000, help="Expenses to import."),
+    members: int = typer.Option(6, help="Members each expense is split between."),
+):
+    """Measure bulk expense import throughput (expenses/s) on the configured database."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    server.init_db_pool()
+    connection = server.db_pool.get_connection()
+    cursor = connection.cursor(dictionary=True)
+    group_id = None
+    try:
+        cursor.execute("SELECT id, email, full_name as name FROM users ORDER BY id LIMIT %s", (members,))
+        users = [server.User(**row) for row in cursor.fetchall()]
+        if len(users) < 2:
+            typer.echo("The database needs at least two users to benchmark against")
+            raise typer.Exit(1)
+        group = server.create_group(
+            server.GroupCreate(name="Import benchmark", member_ids=[user.id for user in users[1:]]),
+            current_user=users[0], db_conn=connection
+        )
+        group_id = group["id"]
+
+        rows = [
+            {
+                "description": f"Imported expense {n}", "amount": round(5 + (n % 400) * 0.37, 2),
+                "paid_by_user_id": users[n % len(users)].id, "split_type": "equal",
+                "splits": {user.id: 0 for user in users},
+            }
+            for n in range(expenses)
+        ]
+        # One request may import at most MAX_BATCH_EXPENSES rows
+        created = 0
+        started = time.perf_counter()
+        for start in range(0, len(rows), server.MAX_BATCH_EXPENSES):
+            batch = rows[start:start + server.MAX_BATCH_EXPENSES]
+            created += server.import_expenses_into_group(connection, group_id, users[0], batch, all_or_nothing=True)["created"]
+        elapsed = time.perf_counter() - started
+        typer.echo(
+            f"{created} expenses ({created * len(users)} splits) in {elapsed:.2f}s: "
+            f"{created / elapsed:,.0f} expenses/s"
+        )
+    finally:
+        if group_id is not None:
+            cursor.execute("DELETE FROM `groups` WHERE id = %s", (group_id,))
+            connection.commit()
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    cli()
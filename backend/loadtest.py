@@ -0,0 +1,381 @@
+"""
+Load-test harness: seed a local database with a realistic dataset, then replay
+a mix of API calls against a running server and report latency per route.
+
+    python loadtest.py seed --users 2000
+    python cli.py serve --workers 4
+    python loadtest.py run --url http://localhost:8000 --clients 50 --duration 60
+
+Seed only a scratch database. Raise RATE_LIMIT_IP_PER_SECOND / RATE_LIMIT_IP_BURST
+on the server first, since every virtual client comes from the same address.
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+# Relative weight of each client action in the replayed mix
+DEFAULT_MIX = {
+    "bootstrap": 25,
+    "group_balances": 20,
+    "pairwise_balances": 8,
+    "sync_changes": 22,
+    "create_expense": 15,
+    "record_settlement": 5,
+    "search": 3,
+    "login": 5,
+}
+
+# Words used by seeded expense descriptions; with a handful of words most hits tie on score
+SEARCH_TERMS = ["groceries", "dinner", "taxi", "rent", "tickets", "coffee"]
+
+loadtest = typer.Typer(help="Seed a load-test dataset and drive a running Hisab server.")
+
+
+def long_tail_size(rng: random.Random, minimum: int, maximum: int, alpha: float) -> int:
+    """Pareto-distributed size: mostly small, occasionally large."""
+    return min(maximum, minimum - 1 + int(rng.paretovariate(alpha)))
+
+
+@loadtest.command()
+def seed(
+    users: int = typer.Option(1000, help="Number of users to create."),
+    groups_per_user: float = typer.Option(0.3, help="Groups created per user."),
+    max_cycles: int = typer.Option(4, help="Most settlement cycles a group has (the last one is open)."),
+    prefix: str = typer.Option("load", help="Email prefix; users are <prefix><n>@example.com."),
+    password: str = typer.Option("loadtest", help="Password of every seeded user."),
+    random_seed: int = typer.Option(42, "--seed", help="Random seed; the same seed gives the same dataset."),
+    rollups: bool = typer.Option(True, help="Rebuild spending rollups for the seeded groups."),
+):
+    """Generate users, friendships, groups, expenses and settlements into the configured MySQL database."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    rng = random.Random(random_seed)
+    server.init_db_pool()
+    connection = server.db_pool.get_connection()
+    cursor = connection.cursor()
+    started = time.monotonic()
+    try:
+        # Users, all sharing one bcrypt hash (hashing per user would dominate the run)
+        hashed_password = server.get_password_hash(password)
+        user_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO users (email, hashed_password, full_name) VALUES ",
+            "(%s, %s, %s)",
+            [(f"{prefix}{n}@example.com", hashed_password, f"{prefix.title()} User {n}") for n in range(users)]
+        )
+        # A few users are far more social than the rest
+        popularity = [rng.paretovariate(1.2) for _ in user_ids]
+
+        friend_rows = set()
+        for user_id in user_ids:
+            for friend_id in rng.choices(user_ids, weights=popularity, k=long_tail_size(rng, 1, 200, 1.5)):
+                if friend_id != user_id:
+                    friend_rows.add((user_id, friend_id))
+                    friend_rows.add((friend_id, user_id))
+        server.insert_rows_chunked(
+            cursor, "INSERT INTO user_friends (user_id, friend_id) VALUES ", "(%s, %s)", sorted(friend_rows)
+        )
+        connection.commit()
+
+        totals = {"groups": 0, "expenses": 0, "settlements": 0}
+        now = datetime.utcnow()
+        group_ids = []
+        for n in range(max(1, int(users * groups_per_user))):
+            members = set()
+            size = long_tail_size(rng, 2, 60, 1.3)
+            while len(members) < min(size, len(user_ids)):
+                members.update(rng.choices(user_ids, weights=popularity, k=size - len(members)))
+            members = sorted(members)
+            cycles = rng.randint(1, max_cycles)
+            cursor.execute(
+                "INSERT INTO `groups` (name, created_by, currency, settlement_cycle) VALUES (%s, %s, 'USD', %s)",
+                (f"{prefix.title()} Group {n}", members[0], cycles)
+            )
+            group_id = cursor.lastrowid
+            group_ids.append(group_id)
+            server.insert_rows_chunked(
+                cursor, "INSERT INTO group_members (group_id, user_id) VALUES ", "(%s, %s)",
+                [(group_id, user_id) for user_id in members]
+            )
+
+            # Expense volume is heavily skewed: most groups are quiet, a few are very busy
+            expenses_per_cycle = min(3000, max(1, int(rng.lognormvariate(2.5, 1.2))))
+            for cycle in range(1, cycles + 1):
+                cycle_start = now - timedelta(days=30 * (cycles - cycle + 1))
+                expense_rows = []
+                for _ in range(expenses_per_cycle):
+                    expense_rows.append((
+                        rng.choice(["Groceries", "Dinner", "Taxi", "Rent", "Tickets", "Coffee"]),
+                        round(rng.lognormvariate(3.3, 0.9), 2), rng.choice(members), group_id,
+                        cycle_start + timedelta(minutes=rng.randint(0, 30 * 24 * 60)), cycle,
+                        rng.choice(["Food", "Travel", "Home", None])
+                    ))
+                expense_ids = server.insert_rows_chunked(
+                    cursor,
+                    "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, settlement_cycle, category) VALUES ",
+                    "(%s, %s, %s, %s, %s, %s, %s)",
+                    expense_rows
+                )
+                balances = {user_id: 0.0 for user_id in members}
+                split_rows = []
+                for expense_id, row in zip(expense_ids, expense_rows):
+                    participants = rng.sample(members, rng.randint(2, len(members)))
+                    share = round(row[1] / len(participants), 2)
+                    balances[row[2]] += row[1]
+                    for user_id in participants:
+                        split_rows.append((expense_id, user_id, share))
+                        balances[user_id] -= share
+                server.insert_rows_chunked(
+                    cursor, "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES ", "(%s, %s, %s)", split_rows
+                )
+
+                # Closed cycles are settled with the suggested plan, so they net to zero
+                if cycle < cycles:
+                    plan = server.calculate_settlements([
+                        server.Balance(user_id=user_id, user_name="", balance=balance)
+                        for user_id, balance in balances.items()
+                    ])
+                    settled_at = cycle_start + timedelta(days=30)
+                    server.insert_rows_chunked(
+                        cursor,
+                        "INSERT INTO settlements (group_id, payer_id, payee_id, amount, settlement_date, settlement_type, settlement_cycle) VALUES ",
+                        "(%s, %s, %s, %s, %s, 'simplified', %s)",
+                        [(group_id, item["from_user_id"], item["to_user_id"], item["amount"], settled_at, cycle)
+                         for item in plan]
+                    )
+                    totals["settlements"] += len(plan)
+                totals["expenses"] += len(expense_rows)
+            totals["groups"] += 1
+            connection.commit()
+
+        if rollups:
+            for group_id in group_ids:
+                server.rebuild_expense_rollups(connection, group_id)
+
+        cursor.execute("ANALYZE TABLE users, user_friends, `groups`, group_members, expenses, expense_splits, settlements")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+    typer.echo(
+        f"Seeded {len(user_ids)} users, {len(friend_rows) // 2} friendships, {totals['groups']} groups, "
+        f"{totals['expenses']} expenses and {totals['settlements']} settlements in {time.monotonic() - started:.1f}s"
+    )
+
+
+class VirtualClient:
+    """One simulated app user: logs in, reads its home screen and writes now and then."""
+
+    def __init__(self, http, email: str, password: str, rng: random.Random, record):
+        self.http = http
+        self.email = email
+        self.password = password
+        self.rng = rng
+        self.record = record
+        self.headers: Dict[str, str] = {}
+        self.user_id: Optional[int] = None
+        self.groups: List[Dict[str, Any]] = []
+        self.last_sync: Optional[str] = None
+
+    async def call(self, route: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, path, headers=self.headers, **kwargs)
+            status_code = response.status_code
+        except Exception:
+            response, status_code = None, 0
+        self.record(route, status_code, time.perf_counter() - started)
+        return response if response is not None and status_code < 400 else None
+
+    async def login(self) -> bool:
+        self.headers = {}
+        response = await self.call(
+            "login", "POST", "/api/token", data={"username": self.email, "password": self.password}
+        )
+        if response is None:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return True
+
+    async def bootstrap(self) -> None:
+        response = await self.call("bootstrap", "GET", "/api/bootstrap")
+        if response is not None:
+            payload = response.json()
+            self.user_id = payload["user"]["id"]
+            self.groups = payload["groups"]
+
+    def pick_group(self) -> Optional[Dict[str, Any]]:
+        return self.rng.choice(self.groups) if self.groups else None
+
+    async def group_balances(self) -> None:
+        group = self.pick_group()
+        if group:
+            await self.call("group_balances", "GET", f"/api/groups/{group['id']}/balances")
+
+    async def pairwise_balances(self) -> None:
+        group = self.pick_group()
+        if group:
+            await self.call("pairwise_balances", "GET", f"/api/groups/{group['id']}/pairwise-balances")
+
+    async def sync_changes(self) -> None:
+        params = {"since": self.last_sync} if self.last_sync else {}
+        response = await self.call("sync_changes", "GET", "/api/sync/changes", params=params)
+        if response is not None:
+            self.last_sync = response.json().get("server_time")
+
+    async def create_expense(self) -> None:
+        group = self.pick_group()
+        if not group or self.user_id is None:
+            return
+        members = [member["id"] for member in group["members"]]
+        participants = self.rng.sample(members, self.rng.randint(min(2, len(members)), len(members)))
+        await self.call("create_expense", "POST", "/api/expenses/", json={
+            "description": "Load test expense",
+            "amount": round(self.rng.lognormvariate(3.3, 0.9), 2),
+            "group_id": group["id"],
+            "paid_by_user_id": self.user_id,
+            "split_type": "equal",
+            "splits": {str(user_id): 0 for user_id in participants},
+        })
+
+    async def record_settlement(self) -> None:
+        group = self.pick_group()
+        if not group:
+            return
+        # Reported on its own, so group_balances keeps the weight the mix gives it
+        response = await self.call("settlement_balances", "GET", f"/api/groups/{group['id']}/balances")
+        if response is None:
+            return
+        suggested = response.json()["settlements"]
+        if not suggested:
+            return
+        payment = self.rng.choice(suggested)
+        await self.call("record_settlement", "POST", "/api/settlements/", json={
+            "group_id": group["id"],
+            "payer_id": payment["from_user_id"],
+            "payee_id": payment["to_user_id"],
+            "amount": payment["amount"],
+            "settlement_type": "simplified",
+        })
+
+    async def search(self) -> None:
+        params = {"q": self.rng.choice(SEARCH_TERMS), "limit": 20}
+        response = await self.call("search", "GET", "/api/search", params=params)
+        # Some users look past the first page
+        next_cursor = response.json()["next_cursor"] if response is not None else None
+        if next_cursor and self.rng.random() < 0.3:
+            params["cursor"] = next_cursor
+            await self.call("search", "GET", "/api/search", params=params)
+
+    async def run(self, deadline: float, mix: Dict[str, int], think_time: float) -> None:
+        if not await self.login():
+            return
+        await self.bootstrap()
+        actions, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            action = self.rng.choices(actions, weights=weights)[0]
+            if action == "login":
+                await self.login()
+            else:
+                await getattr(self, action)()
+            if think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / think_time))
+
+
+def summarize(samples: Dict[str, List[tuple]], elapsed: float) -> List[Dict[str, Any]]:
+    """Per-route request counts, error counts, throughput and latency percentiles."""
+    report = []
+    for route in sorted(samples):
+        latencies = sorted(latency for status_code, latency in samples[route] if 0 < status_code < 400)
+        errors: Dict[str, int] = {}
+        for status_code, _ in samples[route]:
+            if not 0 < status_code < 400:
+                errors[str(status_code or "network")] = errors.get(str(status_code or "network"), 0) + 1
+        row = {"route": route, "ok": len(latencies), "errors": errors, "req_per_s": len(latencies) / elapsed}
+        if len(latencies) >= 2:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            row.update(p50_ms=cuts[49] * 1000, p95_ms=cuts[94] * 1000, p99_ms=cuts[98] * 1000)
+        elif latencies:
+            row.update(p50_ms=latencies[0] * 1000, p95_ms=latencies[0] * 1000, p99_ms=latencies[0] * 1000)
+        report.append(row)
+    return report
+
+
+@loadtest.command()
+def run(
+    url: str = typer.Option("http://localhost:8000", help="Base URL of a running server."),
+    clients: int = typer.Option(50, help="Number of concurrent virtual users."),
+    duration: float = typer.Option(60.0, help="Seconds to run."),
+    users: int = typer.Option(1000, help="How many seeded users the clients log in as."),
+    prefix: str = typer.Option("load", help="Email prefix used when seeding."),
+    password: str = typer.Option("loadtest", help="Password used when seeding."),
+    think_time: float = typer.Option(0.0, help="Mean pause between a client's requests, in seconds."),
+    mix: Optional[str] = typer.Option(
+        None, help='Action weights as JSON, e.g. \'{"bootstrap": 50, "create_expense": 10}\'.'
+    ),
+    random_seed: int = typer.Option(7, "--seed", help="Random seed for users and actions."),
+    json_out: Optional[Path] = typer.Option(None, help="Also write the report to this JSON file."),
+):
+    """Replay a realistic mix of API calls and report throughput and latency per route."""
+    import httpx
+
+    weights = json.loads(mix) if mix else DEFAULT_MIX
+    unknown = set(weights) - set(DEFAULT_MIX)
+    if unknown:
+        raise typer.BadParameter(f"Unknown actions {sorted(unknown)}; choose from {sorted(DEFAULT_MIX)}")
+
+    rng = random.Random(random_seed)
+    samples: Dict[str, List[tuple]] = {}
+
+    def record(route: str, status_code: int, latency: float) -> None:
+        samples.setdefault(route, []).append((status_code, latency))
+
+    async def drive() -> float:
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as http:
+            started = time.monotonic()
+            deadline = started + duration
+            virtual_clients = [
+                VirtualClient(http, f"{prefix}{rng.randrange(users)}@example.com", password,
+                              random.Random(rng.random()), record)
+                for _ in range(clients)
+            ]
+            await asyncio.gather(*(client.run(deadline, weights, think_time) for client in virtual_clients))
+            return time.monotonic() - started
+
+    elapsed = asyncio.run(drive())
+    report = summarize(samples, elapsed)
+    if not report:
+        typer.echo("No requests were made")
+        raise typer.Exit(1)
+
+    total_ok = sum(row["ok"] for row in report)
+    typer.echo(f"{total_ok} ok requests in {elapsed:.1f}s ({total_ok / elapsed:.1f} req/s) from {clients} clients")
+    typer.echo(f"{'route':<20}{'ok':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  errors")
+    for row in report:
+        percentiles = "".join(
+            f"{row[key]:>9.1f}" if key in row else f"{'-':>9}" for key in ("p50_ms", "p95_ms", "p99_ms")
+        )
+        errors = ", ".join(f"{code}: {count}" for code, count in sorted(row["errors"].items())) or "-"
+        typer.echo(f"{row['route']:<20}{row['ok']:>8}{row['req_per_s']:>9.1f}{percentiles}  {errors}")
+
+    if json_out:
+        json_out.write_text(json.dumps({
+            "url": url, "clients": clients, "duration_s": elapsed, "mix": weights, "routes": report
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    loadtest()
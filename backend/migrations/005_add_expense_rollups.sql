@@ -0,0 +1,23 @@
+-- Migration: Add expense_rollups for spending analytics
+-- One row per (group, month, category, member) holding what the member paid and
+-- their share of the group's expenses in that month. The API keeps it up to date
+-- when expenses are written; POST /api/groups/{id}/stats/rebuild backfills a group.
+-- Uncategorized expenses are stored with category ''.
+
+CREATE TABLE IF NOT EXISTS expense_rollups (
+    group_id INT NOT NULL,
+    month DATE NOT NULL COMMENT 'First day of the calendar month',
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    user_id INT NOT NULL,
+    paid_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    share_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    expenses_paid INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (group_id, month, category, user_id),
+    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_rollup_user_month (user_id, month)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Index the detail tables for the partial-month queries
+ALTER TABLE expenses ADD INDEX idx_group_expense_date (group_id, expense_date);
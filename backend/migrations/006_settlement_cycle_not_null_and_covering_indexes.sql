@@ -0,0 +1,35 @@
+-- Migration: Make settlement_cycle NOT NULL and add cycle-aware covering indexes
+-- Queries used to filter on COALESCE(settlement_cycle, 1) = ?, which cannot use an
+-- index. With the column backfilled and NOT NULL they filter on settlement_cycle
+-- directly, so balance/settlement queries only read the current cycle's rows.
+
+-- Backfill NULL cycles (keep updated_at unchanged so sync clients don't refetch)
+UPDATE groups SET settlement_cycle = 1, updated_at = updated_at WHERE settlement_cycle IS NULL;
+UPDATE expenses SET settlement_cycle = 1, updated_at = updated_at WHERE settlement_cycle IS NULL;
+UPDATE settlements SET settlement_cycle = 1, updated_at = updated_at WHERE settlement_cycle IS NULL;
+
+ALTER TABLE groups
+MODIFY COLUMN settlement_cycle INT NOT NULL DEFAULT 1
+COMMENT 'Current settlement cycle. Increments when group is fully settled.';
+
+-- Expenses: (group_id, settlement_cycle, paid_by, amount) covers the per-payer totals.
+-- It replaces the (group_id, settlement_cycle) index added in 004.
+ALTER TABLE expenses
+MODIFY COLUMN settlement_cycle INT NOT NULL DEFAULT 1
+COMMENT 'Settlement cycle this expense belongs to.',
+ADD INDEX idx_expenses_cycle_payer (group_id, settlement_cycle, paid_by, amount),
+DROP INDEX idx_settlement_cycle;
+
+-- Expense splits: (expense_id, user_id, amount) covers the per-member owed totals
+ALTER TABLE expense_splits
+ADD INDEX idx_splits_expense_user (expense_id, user_id, amount);
+
+-- Settlements: (group_id, settlement_cycle) extended with the columns the balance
+-- queries read, so applying a cycle's settlements is an index-only lookup
+ALTER TABLE settlements
+MODIFY COLUMN settlement_cycle INT NOT NULL DEFAULT 1
+COMMENT 'Settlement cycle this settlement belongs to.',
+ADD INDEX idx_settlements_cycle (group_id, settlement_cycle, payer_id, payee_id, amount),
+DROP INDEX idx_settlement_cycle;
+
+ANALYZE TABLE expenses, expense_splits, settlements;
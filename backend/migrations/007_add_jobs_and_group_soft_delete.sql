@@ -0,0 +1,29 @@
+-- Migration: Add the background jobs table and soft deletion of groups
+-- Deleting a group now marks it deleted right away and queues a 'delete_group'
+-- job that purges its history in small batches (see the job runner in server.py).
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    payload TEXT,
+    status ENUM('queued', 'running', 'succeeded', 'failed') NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    progress TEXT COMMENT 'JSON checkpoint saved by the handler between batches',
+    result TEXT,
+    last_error TEXT,
+    created_by INT NULL,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(100) NULL COMMENT 'host:pid of the worker holding the lease',
+    locked_until TIMESTAMP NULL DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX idx_jobs_claim (status, run_after),
+    INDEX idx_jobs_lease (status, locked_until)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Groups pending purge keep their row until the job finishes
+ALTER TABLE groups
+ADD COLUMN deleted_at TIMESTAMP NULL DEFAULT NULL
+COMMENT 'Set when the group is deleted; the row is removed by the purge job.';
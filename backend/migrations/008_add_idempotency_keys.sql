@@ -0,0 +1,22 @@
+-- Migration: Add idempotency keys for expense and settlement creation
+-- Clients send an Idempotency-Key header; the first response is stored here and
+-- replayed for retries with the same key. Expired rows are purged by the job runner.
+-- Offline sync pushes claim each mutation's client_id as a key too; key_scope keeps
+-- those ('sync') apart from Idempotency-Key headers ('header'), so a header value
+-- can never collide with a mutation id.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    key_scope VARCHAR(20) NOT NULL DEFAULT 'header',
+    idempotency_key VARCHAR(255) NOT NULL,
+    endpoint VARCHAR(50) NOT NULL,
+    request_hash CHAR(64) NOT NULL COMMENT 'SHA-256 of the request body, to reject key reuse with a different payload',
+    response_code SMALLINT NULL COMMENT 'NULL until the original request commits',
+    response_body MEDIUMTEXT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE KEY uniq_idempotency_user_scope_key (user_id, key_scope, idempotency_key),
+    INDEX idx_idempotency_expires (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
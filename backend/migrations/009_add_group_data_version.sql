@@ -0,0 +1,7 @@
+-- Migration: Add a per-group data version for result caching
+-- Every write that changes a group's balances bumps data_version in the same
+-- transaction; cached balance payloads are keyed by it (see server.py).
+
+ALTER TABLE groups
+ADD COLUMN data_version INT NOT NULL DEFAULT 0
+COMMENT 'Incremented on every change to the group''s expenses, settlements or members.';
@@ -0,0 +1,9 @@
+-- Migration: Add full-text indexes for GET /api/search
+-- Requires InnoDB FULLTEXT support (MySQL 5.6+ / MariaDB 10.0.5+). Building the
+-- first FULLTEXT index on a table rebuilds it, so run this off-peak on large databases.
+
+ALTER TABLE expenses
+ADD FULLTEXT INDEX ft_expenses_text (description, notes);
+
+ALTER TABLE settlements
+ADD FULLTEXT INDEX ft_settlements_notes (notes);
@@ -0,0 +1,27 @@
+-- Migration: Add per-cycle summaries and archive tables for closed settlement cycles
+-- When a settlement cycle closes, its member totals, final settlements and counts are
+-- stored in cycle_snapshots; GET /api/groups/{id}/cycles is served from them.
+-- With CYCLE_ARCHIVE_ENABLED=true an 'archive_cycle' job later moves the cycle's
+-- expenses, splits and settlements into the *_archive tables (same columns and
+-- indexes, keyed on group_id + settlement_cycle), so current-cycle queries only
+-- scan active rows.
+
+CREATE TABLE IF NOT EXISTS cycle_snapshots (
+    group_id INT NOT NULL,
+    settlement_cycle INT NOT NULL,
+    closed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expense_count INT NOT NULL DEFAULT 0,
+    expense_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    settlement_count INT NOT NULL DEFAULT 0,
+    settlement_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    member_totals MEDIUMTEXT NOT NULL COMMENT 'JSON list of what each member paid, owed, settled and received',
+    settlements MEDIUMTEXT NOT NULL COMMENT 'JSON list of the settlements recorded in the cycle',
+    archived_at TIMESTAMP NULL DEFAULT NULL COMMENT 'Set once the cycle''s detail rows were moved to the archive tables',
+    PRIMARY KEY (group_id, settlement_cycle),
+    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Archive tables mirror the detail tables; rows keep their original ids
+CREATE TABLE IF NOT EXISTS expenses_archive LIKE expenses;
+CREATE TABLE IF NOT EXISTS expense_splits_archive LIKE expense_splits;
+CREATE TABLE IF NOT EXISTS settlements_archive LIKE settlements;
@@ -1,16 +1,39 @@
 import os
+import re
+import csv
+import base64
+import io
+import json
 import mysql.connector
 from mysql.connector import pooling
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Callable, Tuple
+from datetime import date, datetime, timedelta
 import uuid
+import hashlib
+import ipaddress
 import logging
+import socket
+import math
+import random
+import functools
+import threading
+import time
+import asyncio
+import contextvars
+import sqlite3
+from urllib.parse import parse_qs
+import weakref
 from pathlib import Path
+from collections import OrderedDict
 import bcrypt
 from jose import JWTError, jwt
 
@@ -27,25 +50,83 @@ ALGORITHM = "HS256"
 # For web apps with shared computers, consider implementing a shorter session with refresh tokens
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 365  # 1 year
 
+# Bulk write settings
+# Large imports are written with multi-row INSERTs of at most BATCH_INSERT_CHUNK_SIZE rows
+MAX_BATCH_EXPENSES = int(os.environ.get("MAX_BATCH_EXPENSES", "5000"))
+BATCH_INSERT_CHUNK_SIZE = int(os.environ.get("BATCH_INSERT_CHUNK_SIZE", "500"))
+
+# Offline mutations the mobile app may upload in one POST /api/sync/push
+MAX_SYNC_PUSH_MUTATIONS = int(os.environ.get("MAX_SYNC_PUSH_MUTATIONS", "500"))
+
+# Users one POST /api/groups/{id}/members:bulk may name
+MAX_BULK_MEMBERS = int(os.environ.get("MAX_BULK_MEMBERS", "5000"))
+
+# Idempotency-Key records are kept this long before cleanup
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+
+# Full-text search: InnoDB ignores words shorter than innodb_ft_min_token_size (3)
+SEARCH_MIN_TOKEN_LENGTH = int(os.environ.get("SEARCH_MIN_TOKEN_LENGTH", "3"))
+SEARCH_MAX_RESULTS = 50
+
+# Ledger exports stream rows from the server in batches of this size
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "500"))
+
 # Database connection pool
 # NOTE: Under load, a small pool can lead to request hangs (waiting for a free connection),
 # which makes the frontend look like it has "no data".
 # We also set conservative timeouts so the API fails fast instead of wedging.
-try:
-    db_pool = pooling.MySQLConnectionPool(
-        pool_name="splitwise_pool",
-        pool_size=int(os.environ.get("DB_POOL_SIZE", "10")),
-        pool_reset_session=True,
-        host=os.environ['DB_HOST'],
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        connection_timeout=int(os.environ.get("DB_CONNECTION_TIMEOUT", "10")),
-    )
-    logging.info("Successfully created MySQL connection pool.")
-except mysql.connector.Error as err:
-    logging.error(f"Error creating connection pool: {err}")
-    exit()
+# The pool is created on startup rather than at import so that each worker process
+# (see cli.py) opens its own connections after it has been started.
+db_pool = None
+
+class SessionKeepingPool(pooling.MySQLConnectionPool):
+    """
+    Pool that keeps each connection's session across checkouts, so server-side
+    prepared statements survive (see PreparedStatementRegistry). Instead of a
+    session reset, any open transaction is rolled back when a connection is returned.
+    """
+
+    def add_connection(self, cnx=None):
+        if cnx is not None:
+            try:
+                if cnx.is_connected() and cnx.in_transaction:
+                    cnx.rollback()
+            except mysql.connector.Error:
+                # A broken connection is reconnected on its next checkout
+                pass
+        super().add_connection(cnx)
+
+def init_db_pool():
+    """Create this process's connection pool (idempotent)."""
+    global db_pool
+    if db_pool is not None:
+        return db_pool
+    try:
+        db_pool = SessionKeepingPool(
+            pool_name="splitwise_pool",
+            pool_size=int(os.environ.get("DB_POOL_SIZE", "10")),
+            pool_reset_session=False,
+            host=os.environ['DB_HOST'],
+            user=os.environ['DB_USER'],
+            password=os.environ['DB_PASSWORD'],
+            database=os.environ['DB_NAME'],
+            connection_timeout=int(os.environ.get("DB_CONNECTION_TIMEOUT", "10")),
+        )
+        logging.info("Successfully created MySQL connection pool.")
+    except mysql.connector.Error as err:
+        logging.error(f"Error creating connection pool: {err}")
+        raise
+    return db_pool
+
+def close_db_pool():
+    """Close the idle connections in the pool; checked-out ones close when returned."""
+    global db_pool
+    if db_pool is None:
+        return
+    # MySQLConnectionPool has no public close; this closes every queued connection
+    db_pool._remove_connections()
+    db_pool = None
+    logging.info("Closed MySQL connection pool.")
 
 # FastAPI app and router
 app = FastAPI(title="Hisab - Group Accounts Manager API")
@@ -59,18 +140,210 @@ def get_db_connection():
     Important: if the pool is exhausted or the DB is unreachable, we should fail fast
     (raise) rather than hanging and making the entire API appear down.
     """
-    connection = None
+    deadline = current_deadline.get()
+    connection = checkout_db_connection(deadline)
     try:
-        connection = db_pool.get_connection()
         yield connection
+    finally:
+        release_db_connection(connection, deadline)
+
+def checkout_db_connection(deadline: Optional["RequestDeadline"]):
+    """
+    Check a connection out of the pool for a request: fail fast with 503 while the
+    breaker is open or the pool is exhausted, and apply the request's deadline to
+    the session. Hand it back with release_db_connection.
+    """
+    if db_pool is None:
+        # Still connecting during startup (see run_warmup)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database is not available yet, please retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    if deadline is not None and deadline.remaining() <= 0:
+        raise deadline_exceeded_error(deadline)
+    if not db_breaker.allow():
+        # Fail fast instead of every request waiting out a connection timeout
+        raise database_unavailable_error()
+    try:
+        connection = db_pool.get_connection()
+    except mysql.connector.errors.PoolError:
+        metrics.increment("db_pool_exhausted")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    except mysql.connector.Error:
+        db_breaker.record_failure()
+        raise database_unavailable_error()
+    db_breaker.record_success()
+    if deadline is not None:
+        try:
+            apply_session_deadline(connection, deadline)
+        except BaseException:
+            release_db_connection(connection, deadline)
+            raise
+    return connection
+
+def release_db_connection(connection, deadline: Optional["RequestDeadline"]) -> None:
+    """Clear the request's deadline from the session and return the connection to the pool."""
+    try:
+        if deadline is not None and getattr(connection, "is_connected", lambda: False)():
+            clear_session_deadline(connection, deadline)
+    except Exception:
+        # Never let cleanup errors hide the real exception
+        pass
     finally:
         try:
-            if connection is not None and getattr(connection, "is_connected", lambda: False)():
-                connection.close()
+            # Always hand the connection back, even if resetting its session failed
+            connection.close()
         except Exception:
-            # Never let cleanup errors hide the real exception
             pass
 
+# --- Metrics ---
+
+class MetricsRegistry:
+    """Process-local counters and gauges, exposed at GET /api/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def register_gauge(self, name: str, read: Callable[[], Any]) -> None:
+        """Register a function that reports a current value when metrics are read."""
+        self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "counters": dict(sorted(counters.items())),
+            "gauges": {name: read() for name, read in sorted(self._gauges.items())},
+        }
+
+metrics = MetricsRegistry()
+
+# --- Prepared Statements ---
+# The hottest read queries run as server-side prepared statements: each is prepared
+# once per pooled connection and reused across requests. MySQL drops prepared
+# statements when a connection reconnects, so the registry tracks each raw
+# connection's connection_id and prepares again when it changes.
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get("PREPARED_STATEMENTS_ENABLED", "true").lower() == "true"
+
+ER_UNKNOWN_STMT_HANDLER = 1243
+
+class PreparedStatementRegistry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.statements: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # raw connection -> (connection_id, {statement name: prepared cursor})
+        self._cursors: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def register(self, name: str, sql: str) -> str:
+        self.statements[name] = sql
+        return name
+
+    def _prepared_cursor(self, db_conn, name: str):
+        raw = getattr(db_conn, "_cnx", db_conn)  # unwrap PooledMySQLConnection
+        connection_id = raw.connection_id
+        with self._lock:
+            entry = self._cursors.get(raw)
+            if entry is None or entry[0] != connection_id:
+                entry = (connection_id, {})
+                self._cursors[raw] = entry
+            cursor = entry[1].get(name)
+        if cursor is None:
+            cursor = raw.cursor(prepared=True)
+            with self._lock:
+                entry[1][name] = cursor
+            metrics.increment(f"prepared_statements.{name}.prepares")
+        return cursor
+
+    def _forget(self, db_conn, name: str) -> None:
+        raw = getattr(db_conn, "_cnx", db_conn)
+        with self._lock:
+            entry = self._cursors.get(raw)
+            if entry is not None:
+                entry[1].pop(name, None)
+
+    def execute(self, db_conn, name: str, params: tuple) -> List[Dict[str, Any]]:
+        """Run a registered statement on db_conn and return its rows as dicts."""
+        sql = self.statements[name]
+        metrics.increment(f"prepared_statements.{name}.executions")
+        if not self.enabled:
+            cursor = db_conn.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+        for attempt in range(2):
+            cursor = self._prepared_cursor(db_conn, name)
+            try:
+                cursor.execute(sql, params)
+                columns = cursor.column_names
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except mysql.connector.Error as err:
+                # Statement handle lost (e.g. server-side reconnect): prepare again once
+                self._forget(db_conn, name)
+                if err.errno != ER_UNKNOWN_STMT_HANDLER or attempt:
+                    raise
+        return []
+
+prepared_statements = PreparedStatementRegistry(PREPARED_STATEMENTS_ENABLED)
+
+USER_BY_EMAIL = prepared_statements.register(
+    "user_by_email",
+    "SELECT * FROM users WHERE email = %s"
+)
+USER_GROUP_IDS = prepared_statements.register(
+    "user_group_ids",
+    "SELECT group_id FROM group_members WHERE user_id = %s AND is_active = TRUE"
+)
+CYCLE_MEMBER_TOTALS = prepared_statements.register(
+    "cycle_member_totals",
+    """
+    SELECT
+        u.id as user_id,
+        u.full_name as user_name,
+        COALESCE(paid.total_paid, 0) as total_paid,
+        COALESCE(owed.total_owed, 0) as total_owed
+    FROM users u
+    INNER JOIN group_members gm ON u.id = gm.user_id AND gm.group_id = %s AND gm.is_active = TRUE
+    LEFT JOIN (
+        SELECT paid_by as user_id, SUM(amount) as total_paid
+        FROM expenses
+        WHERE group_id = %s AND settlement_cycle = %s
+        GROUP BY paid_by
+    ) paid ON paid.user_id = u.id
+    LEFT JOIN (
+        SELECT es.user_id, SUM(es.amount) as total_owed
+        FROM expense_splits es
+        INNER JOIN expenses e ON es.expense_id = e.id
+        WHERE e.group_id = %s AND e.settlement_cycle = %s
+        GROUP BY es.user_id
+    ) owed ON owed.user_id = u.id
+    WHERE gm.group_id = %s AND gm.is_active = TRUE
+    """
+)
+CYCLE_SETTLEMENTS = prepared_statements.register(
+    "cycle_settlements",
+    """
+    SELECT payer_id, payee_id, amount
+    FROM settlements
+    WHERE group_id = %s AND settlement_cycle = %s
+    """
+)
+
 # --- Security and Authentication ---
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
@@ -142,6 +415,7 @@ class ExpenseBase(BaseModel):
     amount: float
     group_id: Optional[int] = None
     paid_by_user_id: int
+    category: Optional[str] = None
 
 class ExpenseCreate(ExpenseBase):
     # 'equal', 'exact', 'percentage'
@@ -153,6 +427,16 @@ class Expense(ExpenseBase):
     id: int
     expense_date: datetime
 
+class ExpenseBatchItem(BaseModel):
+    # One row of a bulk import; the group comes from the URL
+    description: str
+    amount: float
+    paid_by_user_id: int
+    split_type: str
+    splits: Dict[int, float]
+    expense_date: Optional[datetime] = None
+    category: Optional[str] = None
+
 # Balance Models
 class Balance(BaseModel):
     user_id: int
@@ -178,15 +462,205 @@ class Settlement(SettlementCreate):
     id: int
     settlement_date: datetime
 
+class SettlementBatchItem(BaseModel):
+    payer_id: int
+    payee_id: int
+    amount: float
+    notes: Optional[str] = None
+
+class SettlementBatchCreate(BaseModel):
+    # Either an explicit list of payments, or apply_suggested to record the
+    # current simplified plan from calculate_settlements
+    settlements: List[SettlementBatchItem] = []
+    apply_suggested: bool = False
+    settlement_type: Optional[str] = 'simplified'
+    notes: Optional[str] = None
+
+class GroupMembersBulk(BaseModel):
+    # 'add' and 'remove' change the listed users; 'replace' makes the list the
+    # full member set (the caller always stays a member)
+    action: str
+    user_ids: List[int]
+
+# Offline sync models
+class SyncMutation(BaseModel):
+    # Generated by the client; a retried upload with the same id is not applied twice
+    client_id: str = Field(..., min_length=1, max_length=200)
+    type: str  # 'create_expense' or 'record_settlement'
+    data: Dict[str, Any]  # ExpenseCreate or SettlementCreate fields
+
+class SyncPush(BaseModel):
+    mutations: List[SyncMutation]
+    since: Optional[str] = None  # The client's sync cursor, as passed to /sync/changes
+
 # --- Database CRUD Functions ---
 
 def get_user_by_email(db_conn, email: str):
     """Fetches a user by their email address."""
-    cursor = db_conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = cursor.fetchone()
-    cursor.close()
-    return user
+    rows = prepared_statements.execute(db_conn, USER_BY_EMAIL, (email,))
+    return rows[0] if rows else None
+
+INSERT_TABLE_RE = re.compile(r"^\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+
+# Session auto_increment_increment by connection id, read once per session.
+# Bounded, since reconnects and pool rebuilds bring new connection ids.
+AUTO_INCREMENT_STEP_CACHE_SIZE = 1024
+_auto_increment_steps: "OrderedDict[int, int]" = OrderedDict()
+_auto_increment_steps_lock = threading.Lock()
+
+def auto_increment_step(cursor) -> int:
+    """The session's auto_increment_increment, queried on a connection's first use only."""
+    connection_id = cursor._connection.connection_id
+    with _auto_increment_steps_lock:
+        step = _auto_increment_steps.get(connection_id)
+    if step is not None:
+        return step
+    cursor.execute("SELECT @@SESSION.auto_increment_increment AS step")
+    result = cursor.fetchone()
+    step = int(result['step'] if isinstance(result, dict) else result[0])
+    with _auto_increment_steps_lock:
+        _auto_increment_steps[connection_id] = step
+        while len(_auto_increment_steps) > AUTO_INCREMENT_STEP_CACHE_SIZE:
+            _auto_increment_steps.popitem(last=False)
+    return step
+
+def insert_rows_chunked(cursor, insert_sql: str, row_placeholder: str, rows: List[tuple], chunk_size: int = BATCH_INSERT_CHUNK_SIZE,
+                        owner: Optional[Tuple[str, Any]] = None) -> List[int]:
+    """
+    Insert rows using multi-row INSERT statements of at most chunk_size rows.
+    Returns the auto-increment id assigned to each row, in order.
+
+    With innodb_autoinc_lock_mode=2 (the MySQL 8 default) a multi-row INSERT is
+    not guaranteed one contiguous block of ids: concurrent inserts into the same
+    table can interleave. Callers writing a shared table pass owner, a
+    (column, value) pair such as ("group_id", group_id) whose writes they hold
+    serialized, and each chunk's ids are then read back: the owner's rows from
+    the chunk's first id (lastrowid) on are exactly the chunk, or the insert fails.
+    Without owner the ids are derived from lastrowid and the session's
+    auto_increment_increment, which is only safe while nothing else inserts
+    into the table (seeding and other single-writer loads).
+    """
+    if not rows:
+        return []
+    if owner is not None:
+        table = INSERT_TABLE_RE.match(insert_sql).group(1)
+        owner_column, owner_value = owner
+    else:
+        step = auto_increment_step(cursor)
+    row_ids = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        params = [value for row in chunk for value in row]
+        cursor.execute(insert_sql + ", ".join([row_placeholder] * len(chunk)), params)
+        first_id = cursor.lastrowid
+        if owner is None:
+            row_ids.extend(range(first_id, first_id + len(chunk) * step, step))
+            continue
+        if len(chunk) == 1:
+            row_ids.append(first_id)
+            continue
+        cursor.execute(
+            f"SELECT id FROM {table} WHERE {owner_column} = %s AND id >= %s ORDER BY id",
+            (owner_value, first_id)
+        )
+        chunk_ids = [row['id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+        if len(chunk_ids) != len(chunk):
+            raise RuntimeError(
+                f"Expected {len(chunk)} new {table} rows for {owner_column}={owner_value} from id {first_id}, found {len(chunk_ids)}"
+            )
+        row_ids.extend(chunk_ids)
+    return row_ids
+
+def upsert_rows_chunked(cursor, insert_sql: str, row_placeholder: str, rows: List[tuple], update_sql: str, chunk_size: int = BATCH_INSERT_CHUNK_SIZE) -> None:
+    """Multi-row INSERT ... ON DUPLICATE KEY UPDATE in chunks of at most chunk_size rows."""
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        params = [value for row in chunk for value in row]
+        cursor.execute(insert_sql + ", ".join([row_placeholder] * len(chunk)) + " ON DUPLICATE KEY UPDATE " + update_sql, params)
+
+# Closed cycles can be moved to the *_archive tables (see archive_closed_cycle).
+# Reads over a group's whole history run their select once per table set and
+# combine the results with UNION ALL, so each branch still uses its own indexes.
+HISTORY_TABLE_SETS = (
+    {"expenses": "expenses", "expense_splits": "expense_splits", "settlements": "settlements"},
+    {"expenses": "expenses_archive", "expense_splits": "expense_splits_archive", "settlements": "settlements_archive"},
+)
+
+def history_union(select_sql: str, **fields) -> str:
+    """
+    select_sql over the active and the archive tables, joined with UNION ALL.
+    Tables are written {expenses}, {expense_splits} and {settlements}; the
+    select's parameters must be passed once per entry of HISTORY_TABLE_SETS.
+    """
+    return "\nUNION ALL\n".join(select_sql.format(**tables, **fields) for tables in HISTORY_TABLE_SETS)
+
+def begin_idempotent_request(cursor, user_id: int, idempotency_key: Optional[str], endpoint: str, payload: Any,
+                             key_scope: str = 'header') -> Optional[JSONResponse]:
+    """
+    Claim an Idempotency-Key as the first write of the caller's transaction.
+    Keys are unique per user within key_scope ('header' for the Idempotency-Key
+    header, 'sync' for offline mutation ids).
+
+    Returns None when this request should do the work, or the stored response when
+    the key was already used for the same request. A concurrent request with the
+    same key blocks on the unique index until the first one commits (and then
+    replays its response) or rolls back (and then does the work itself).
+    """
+    if not idempotency_key:
+        return None
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters")
+
+    request_hash = hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode('utf-8')).hexdigest()
+    insert_sql = """
+        INSERT INTO idempotency_keys (user_id, key_scope, idempotency_key, endpoint, request_hash, expires_at)
+        VALUES (%s, %s, %s, %s, %s, NOW() + INTERVAL %s HOUR)
+    """
+    insert_params = (user_id, key_scope, idempotency_key, endpoint, request_hash, IDEMPOTENCY_TTL_HOURS)
+    try:
+        cursor.execute(insert_sql, insert_params)
+        return None
+    except mysql.connector.IntegrityError as err:
+        if err.errno != 1062:  # ER_DUP_ENTRY
+            raise
+
+    # Locking read: sees the latest committed row even if this transaction's
+    # snapshot predates it
+    cursor.execute("""
+        SELECT endpoint, request_hash, response_code, response_body, expires_at < NOW() as expired
+        FROM idempotency_keys
+        WHERE user_id = %s AND key_scope = %s AND idempotency_key = %s
+        LOCK IN SHARE MODE
+    """, (user_id, key_scope, idempotency_key))
+    stored = cursor.fetchone()
+    if stored is None or stored['expired']:
+        # Expired (or just cleaned up): the key can be used again
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE user_id = %s AND key_scope = %s AND idempotency_key = %s",
+            (user_id, key_scope, idempotency_key)
+        )
+        cursor.execute(insert_sql, insert_params)
+        return None
+    if stored['endpoint'] != endpoint or stored['request_hash'] != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if stored['response_code'] is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    return JSONResponse(
+        status_code=stored['response_code'],
+        content=json.loads(stored['response_body']),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def complete_idempotent_request(cursor, user_id: int, idempotency_key: Optional[str], status_code: int, body: Any,
+                                key_scope: str = 'header') -> None:
+    """Store the response for a claimed Idempotency-Key, in the same transaction as the work."""
+    if not idempotency_key:
+        return
+    cursor.execute("""
+        UPDATE idempotency_keys SET response_code = %s, response_body = %s
+        WHERE user_id = %s AND key_scope = %s AND idempotency_key = %s
+    """, (status_code, json.dumps(jsonable_encoder(body)), user_id, key_scope, idempotency_key))
 
 def create_db_user(db_conn, user: UserCreate):
     """Creates a new user in the database."""
@@ -203,7 +677,7 @@ def create_db_user(db_conn, user: UserCreate):
         return {"id": user_id, **user.dict()}
     except mysql.connector.Error as err:
         cursor.close()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db_conn = Depends(get_db_connection)):
     """Decodes token to get current user."""
@@ -227,6 +701,345 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db_conn = Depend
     # Map database field names to model field names
     return User(id=user['id'], email=user['email'], name=user['full_name'])
 
+# --- Group Membership ---
+
+# How long a user's cached group-id set is trusted before it is reloaded
+MEMBERSHIP_CACHE_TTL_SECONDS = float(os.environ.get("MEMBERSHIP_CACHE_TTL_SECONDS", "60"))
+MEMBERSHIP_CACHE_MAX_USERS = int(os.environ.get("MEMBERSHIP_CACHE_MAX_USERS", "50000"))
+
+class MembershipIndex:
+    """
+    Per-process cache of each user's active group ids, used for authorization.
+
+    A group missing from a cached set is re-checked against the database once
+    before access is denied, so members added by another worker are let in
+    right away. Removals made by this process invalidate the affected entries;
+    removals made by other workers take effect within the TTL.
+
+    Every invalidation bumps a generation: per user for invalidate(), and for
+    everyone for invalidate_group() (which cannot know whose load is in flight).
+    A load whose database read started before a later invalidation is not
+    stored, so it cannot bring back access that was just revoked.
+    """
+
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # Generation counter, and the generation at which each user was last invalidated
+        self._generation = 0
+        self._invalidated_at: "OrderedDict[int, int]" = OrderedDict()
+        # Invalidations that may concern any user: invalidate_group(), clear() and
+        # per-user generations dropped to keep _invalidated_at bounded
+        self._all_invalidated_at = 0
+
+    def generation(self) -> int:
+        """Take before reading memberships from the database; pass to prime()."""
+        with self._lock:
+            return self._generation
+
+    def _bump(self) -> int:
+        self._generation += 1
+        return self._generation
+
+    def _changed_since(self, user_id: int, generation: int) -> bool:
+        return max(self._all_invalidated_at, self._invalidated_at.get(user_id, 0)) > generation
+
+    def _store(self, user_id: int, group_ids: frozenset, now: float) -> None:
+        self._entries[user_id] = (now, group_ids)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def _load(self, db_conn, user_id: int) -> frozenset:
+        generation = self.generation()
+        rows = prepared_statements.execute(db_conn, USER_GROUP_IDS, (user_id,))
+        group_ids = frozenset(row['group_id'] for row in rows)
+        with self._lock:
+            if self._changed_since(user_id, generation):
+                metrics.increment("membership_cache.stale_load")
+            else:
+                self._store(user_id, group_ids, time.monotonic())
+        return group_ids
+
+    def _cached(self, user_id: int) -> Optional[frozenset]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def group_ids(self, db_conn, user_id: int) -> frozenset:
+        """The user's active group ids, from cache when fresh."""
+        group_ids = self._cached(user_id)
+        if group_ids is not None:
+            metrics.increment("membership_cache.hit")
+            return group_ids
+        metrics.increment("membership_cache.miss")
+        return self._load(db_conn, user_id)
+
+    def is_member(self, db_conn, user_id: int, group_id: int) -> bool:
+        group_ids = self._cached(user_id)
+        if group_ids is not None and group_id in group_ids:
+            metrics.increment("membership_cache.hit")
+            return True
+        metrics.increment("membership_cache.miss")
+        return group_id in self._load(db_conn, user_id)
+
+    def invalidate(self, user_ids) -> None:
+        with self._lock:
+            generation = self._bump()
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._invalidated_at[user_id] = generation
+                self._invalidated_at.move_to_end(user_id)
+            while len(self._invalidated_at) > self.max_users:
+                # Forgetting a user's generation makes every older load count as stale
+                _, dropped = self._invalidated_at.popitem(last=False)
+                self._all_invalidated_at = max(self._all_invalidated_at, dropped)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._invalidated_at.clear()
+            self._all_invalidated_at = self._bump()
+
+    def prime(self, group_ids_by_user: Dict[int, set], generation: Optional[int] = None) -> None:
+        """
+        Load complete group-id sets for several users at once (startup warm-up).
+        generation is generation() from before the sets were read; users
+        invalidated since then are skipped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for user_id, group_ids in group_ids_by_user.items():
+                if generation is not None and self._changed_since(user_id, generation):
+                    continue
+                self._store(user_id, frozenset(group_ids), now)
+
+    def invalidate_group(self, group_id: int) -> None:
+        """Drop every cached user whose set includes group_id."""
+        with self._lock:
+            self._all_invalidated_at = self._bump()
+            stale = [user_id for user_id, (_, group_ids) in self._entries.items() if group_id in group_ids]
+            for user_id in stale:
+                del self._entries[user_id]
+
+membership_index = MembershipIndex(MEMBERSHIP_CACHE_TTL_SECONDS, MEMBERSHIP_CACHE_MAX_USERS)
+
+def _membership_hit_rate():
+    snapshot = metrics.snapshot()["counters"]
+    hits = snapshot.get("membership_cache.hit", 0)
+    total = hits + snapshot.get("membership_cache.miss", 0)
+    return round(hits / total, 4) if total else None
+
+metrics.register_gauge("membership_cache_hit_rate", _membership_hit_rate)
+
+def require_group_member(db_conn, user_id: int, group_id: int) -> None:
+    """Raise 403 unless the user is an active member of the group."""
+    if not membership_index.is_member(db_conn, user_id, group_id):
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+
+# --- Result Cache ---
+# Computed group payloads (balances, pairwise balances) are cached under keys that
+# include the group's data_version. Every mutation of a group bumps its version in
+# the same transaction, so stale entries are never read again and age out of the LRU.
+
+RESULT_CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_URL = os.environ.get("RESULT_CACHE_URL", "redis://localhost:6379/0")
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600"))
+
+class InProcessResultCache:
+    """LRU of serialized payloads, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous)
+            self._entries[key] = value
+            self.size_bytes += len(value)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+
+class RedisResultCache:
+    """
+    Shared cache for all workers and hosts. Any server speaking the Redis protocol
+    works (e.g. a local redis-server or fakeredis in development).
+    """
+
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get(key)
+        except Exception:
+            logging.exception("Result cache read failed")
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        try:
+            self.client.set(key, value, ex=self.ttl_seconds)
+        except Exception:
+            logging.exception("Result cache write failed")
+
+def create_result_cache():
+    if RESULT_CACHE_BACKEND == "redis":
+        try:
+            return RedisResultCache(RESULT_CACHE_URL, RESULT_CACHE_TTL_SECONDS)
+        except ImportError:
+            logging.warning("RESULT_CACHE_BACKEND=redis but the redis package is not installed; using the in-process cache")
+    return InProcessResultCache(RESULT_CACHE_MAX_BYTES)
+
+result_cache = create_result_cache()
+
+def result_cache_key(endpoint: str, group_id: int, cycle: int, version: int) -> str:
+    return f"hisab:{endpoint}:{group_id}:{cycle}:{version}"
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time. Callers that ask for a key while it is
+    being computed wait for that run and share its result. Failures are not
+    shared: the leader may have failed on its own deadline or a client
+    disconnect, so one of the waiting callers takes over and computes again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, dict] = {}
+
+    def do(self, key: str, compute: Callable[[], Any]) -> Any:
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = {"done": threading.Event(), "ok": False, "result": None}
+            if leader:
+                break
+            metrics.increment("single_flight.coalesced")
+            deadline = current_deadline.get()
+            if not call["done"].wait(timeout=deadline.remaining() if deadline is not None else None):
+                raise deadline_exceeded_error(deadline)
+            if call["ok"]:
+                return call["result"]
+            metrics.increment("single_flight.takeover")
+        try:
+            call["result"] = compute()
+            call["ok"] = True
+            return call["result"]
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+result_flights = SingleFlight()
+
+def cached_result(key: str, compute: Callable[[], Any]) -> Any:
+    """
+    Return the cached payload for key, computing and storing it on a miss.
+    Concurrent misses for the same key share one computation; callers must have
+    checked access to the group before calling.
+    """
+    cached = result_cache.get(key)
+    if cached is not None:
+        metrics.increment("result_cache.hit")
+        return json.loads(cached)
+
+    def compute_and_store():
+        metrics.increment("result_cache.miss")
+        payload = jsonable_encoder(compute())
+        result_cache.set(key, json.dumps(payload).encode('utf-8'))
+        return payload
+
+    return result_flights.do(key, compute_and_store)
+
+def bump_group_version(cursor, group_id: int) -> None:
+    """Mark a group's cached results stale; call inside the mutating transaction."""
+    cursor.execute("UPDATE groups SET data_version = data_version + 1 WHERE id = %s", (group_id,))
+
+# --- Group Write Coordination ---
+# Writes that depend on a group's balances, cycle or settlement method lock the
+# group row first, so writes to one group run one at a time while unrelated
+# groups proceed in parallel. They run in READ COMMITTED so that, once the lock
+# is held, every read sees the writes committed before it.
+
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+WRITE_RETRY_ATTEMPTS = int(os.environ.get("WRITE_RETRY_ATTEMPTS", "3"))
+
+def is_lock_conflict(err: mysql.connector.Error) -> bool:
+    return err.errno in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT)
+
+def begin_group_write(db_conn) -> None:
+    """Start a fresh READ COMMITTED transaction, dropping the snapshot taken during authentication."""
+    if db_conn.in_transaction:
+        db_conn.rollback()
+    db_conn.start_transaction(isolation_level='READ COMMITTED')
+
+def lock_group_for_write(cursor, group_id: int) -> Dict[str, Any]:
+    """Lock the group row until commit and return its current state; 404 if it doesn't exist."""
+    cursor.execute("""
+        SELECT id, settlement_method, settlement_cycle, data_version
+        FROM groups WHERE id = %s AND deleted_at IS NULL
+        FOR UPDATE
+    """, (group_id,))
+    group_row = cursor.fetchone()
+    if not group_row:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group_row
+
+def retry_on_lock_conflict(func):
+    """
+    Re-run a write when MySQL reports a deadlock or lock wait timeout. The
+    function must roll back and re-raise those errors; after the last attempt
+    the client gets a 503 to retry later.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        db_conn = kwargs['db_conn'] if 'db_conn' in kwargs else args[0]
+        for attempt in range(1, WRITE_RETRY_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except mysql.connector.Error as err:
+                if not is_lock_conflict(err):
+                    raise
+                db_conn.rollback()
+                metrics.increment(f"write_lock_conflicts.{err.errno}")
+                deadline = current_deadline.get()
+                if deadline is not None and deadline.remaining() <= 0:
+                    raise deadline_exceeded_error(deadline)
+                if attempt == WRITE_RETRY_ATTEMPTS:
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="The group is busy, please retry",
+                        headers={"Retry-After": "1"},
+                    )
+                time.sleep(random.uniform(0.01, 0.05) * attempt)
+    return wrapper
+
 # --- API Endpoints ---
 
 @api_router.get("/health")
@@ -296,6 +1109,14 @@ def update_user_profile(update_data: Dict[str, str], current_user: User = Depend
         # Execute update
         query = f"UPDATE users SET {', '.join(updates)} WHERE id = %s"
         cursor.execute(query, params)
+        if 'name' in update_data and update_data['name']:
+            # Cached balances include member names
+            cursor.execute("""
+                UPDATE groups g
+                INNER JOIN group_members gm ON g.id = gm.group_id
+                SET g.data_version = g.data_version + 1
+                WHERE gm.user_id = %s AND gm.is_active = TRUE
+            """, (current_user.id,))
         db_conn.commit()
         
         # Fetch updated user
@@ -306,7 +1127,7 @@ def update_user_profile(update_data: Dict[str, str], current_user: User = Depend
         
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
     finally:
         cursor.close()
 
@@ -361,25 +1182,132 @@ def add_friend(friend_email: Dict[str, str], current_user: User = Depends(get_cu
         
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
     finally:
         cursor.close()
 
+def fetch_friends(cursor, user_id: int) -> List[User]:
+    cursor.execute("""
+        SELECT u.id, u.email, u.full_name as name
+        FROM users u
+        INNER JOIN user_friends uf ON u.id = uf.friend_id
+        WHERE uf.user_id = %s
+        ORDER BY u.full_name
+    """, (user_id,))
+    
+    friends = cursor.fetchall()
+    return [User(**friend) for friend in friends]
+
 @api_router.get("/friends/", response_model=List[User])
 def get_friends(current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
     """Get list of user's friends."""
     cursor = db_conn.cursor(dictionary=True)
     try:
+        return fetch_friends(cursor, current_user.id)
+    finally:
+        cursor.close()
+
+@api_router.get("/friends/balances", response_model=Dict[str, Any])
+def get_friend_balances(current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """
+    Net position with each friend (and anyone else sharing a group) across all
+    of the user's groups, current settlement cycle only.
+
+    Balances are pairwise: shares of expenses one of the two paid for the other,
+    adjusted by settlements between the two. Positive means they owe you.
+    Answered with one aggregate query each for expenses and settlements, scoped
+    to the user's groups, plus name lookups.
+    """
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        user_id = current_user.id
+
+        # Expense shares between the user and each counterparty, per group
+        cursor.execute("""
+            SELECT e.group_id,
+                   CASE WHEN e.paid_by = %s THEN es.user_id ELSE e.paid_by END as counterparty_id,
+                   SUM(CASE WHEN e.paid_by = %s THEN es.amount ELSE -es.amount END) as net
+            FROM group_members gm
+            INNER JOIN groups g ON g.id = gm.group_id
+            INNER JOIN expenses e ON e.group_id = g.id AND e.settlement_cycle = g.settlement_cycle
+            INNER JOIN expense_splits es ON es.expense_id = e.id
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+              AND ((e.paid_by = %s AND es.user_id != %s) OR (es.user_id = %s AND e.paid_by != %s))
+            GROUP BY e.group_id, counterparty_id
+        """, (user_id, user_id, user_id, user_id, user_id, user_id, user_id))
+        pair_rows = cursor.fetchall()
+
+        # Settlements between the user and each counterparty, per group
+        cursor.execute("""
+            SELECT s.group_id,
+                   CASE WHEN s.payer_id = %s THEN s.payee_id ELSE s.payer_id END as counterparty_id,
+                   SUM(CASE WHEN s.payer_id = %s THEN s.amount ELSE -s.amount END) as net
+            FROM group_members gm
+            INNER JOIN groups g ON g.id = gm.group_id
+            INNER JOIN settlements s ON s.group_id = g.id AND s.settlement_cycle = g.settlement_cycle
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+              AND (s.payer_id = %s OR s.payee_id = %s)
+            GROUP BY s.group_id, counterparty_id
+        """, (user_id, user_id, user_id, user_id, user_id))
+        pair_rows += cursor.fetchall()
+
+        # counterparty -> group -> net (in cents to avoid float drift)
+        per_group: Dict[int, Dict[int, int]] = {}
+        for row in pair_rows:
+            groups_for_counterparty = per_group.setdefault(row['counterparty_id'], {})
+            cents = int(round(float(row['net']) * 100))
+            groups_for_counterparty[row['group_id']] = groups_for_counterparty.get(row['group_id'], 0) + cents
+
         cursor.execute("""
             SELECT u.id, u.email, u.full_name as name
             FROM users u
             INNER JOIN user_friends uf ON u.id = uf.friend_id
             WHERE uf.user_id = %s
-            ORDER BY u.full_name
-        """, (current_user.id,))
-        
-        friends = cursor.fetchall()
-        return [User(**friend) for friend in friends]
+        """, (user_id,))
+        people = {row['id']: row for row in cursor.fetchall()}
+        friend_ids = set(people)
+
+        others = [uid for uid in per_group if uid not in people]
+        group_ids = sorted({gid for groups_for_counterparty in per_group.values() for gid in groups_for_counterparty})
+        group_names = {}
+        if others:
+            placeholders = ','.join(['%s'] * len(others))
+            cursor.execute(f"SELECT id, email, full_name as name FROM users WHERE id IN ({placeholders})", others)
+            people.update({row['id']: row for row in cursor.fetchall()})
+        if group_ids:
+            placeholders = ','.join(['%s'] * len(group_ids))
+            cursor.execute(f"SELECT id, name FROM groups WHERE id IN ({placeholders})", group_ids)
+            group_names = {row['id']: row['name'] for row in cursor.fetchall()}
+
+        balances = []
+        total_owed_to_you = 0
+        total_you_owe = 0
+        for counterparty_id, person in people.items():
+            groups_for_counterparty = per_group.get(counterparty_id, {})
+            net_cents = sum(groups_for_counterparty.values())
+            if net_cents > 0:
+                total_owed_to_you += net_cents
+            else:
+                total_you_owe -= net_cents
+            balances.append({
+                "user_id": counterparty_id,
+                "user_name": person['name'],
+                "email": person['email'],
+                "is_friend": counterparty_id in friend_ids,
+                "net_balance": net_cents / 100,
+                "groups": [
+                    {"group_id": gid, "group_name": group_names.get(gid), "balance": cents / 100}
+                    for gid, cents in sorted(groups_for_counterparty.items())
+                    if cents != 0
+                ],
+            })
+
+        balances.sort(key=lambda b: (-abs(b['net_balance']), b['user_name']))
+        return {
+            "balances": balances,
+            "total_owed_to_you": total_owed_to_you / 100,
+            "total_you_owe": total_you_owe / 100,
+        }
     finally:
         cursor.close()
 
@@ -405,6 +1333,7 @@ def create_group(group: GroupCreate, current_user: User = Depends(get_current_us
             member_data
         )
         db_conn.commit()
+        membership_index.invalidate(group.member_ids)
         
         # Fetch created group details to return
         # This part is simplified; a real app would fetch member details
@@ -412,116 +1341,338 @@ def create_group(group: GroupCreate, current_user: User = Depends(get_current_us
         return created_group
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
     finally:
         cursor.close()
 
+def compute_expense_splits(split_type: str, amount: float, splits: Dict[int, float]) -> List[tuple]:
+    """
+    Calculate the (user_id, amount) rows owed for an expense.
+    Raises HTTPException(400) if the split definition is invalid.
+    """
+    split_rows = []
+    if split_type == 'equal':
+        # For equal split, the splits dict contains user_ids with amounts
+        num_participants = len(splits)
+        if num_participants == 0:
+            raise HTTPException(status_code=400, detail="No participants for equal split.")
+        split_amount = round(amount / num_participants, 2)
+        for user_id in splits:
+            split_rows.append((user_id, split_amount))
+
+    elif split_type == 'exact':
+        # For exact split, amounts are specified directly
+        total = sum(splits.values())
+        if abs(total - amount) > 0.01: # Tolerance for float precision
+            raise HTTPException(status_code=400, detail="Exact split amounts do not sum to total expense.")
+        for user_id, split_amount in splits.items():
+            split_rows.append((user_id, split_amount))
+
+    elif split_type == 'percentage':
+        # For percentage split, splits dict contains user_ids with percentage values
+        total_percentage = sum(splits.values())
+        if abs(total_percentage - 100.0) > 0.1: # Tolerance for float precision
+            raise HTTPException(status_code=400, detail=f"Percentage split must total 100%, got {total_percentage}%")
+        for user_id, percentage in splits.items():
+            split_rows.append((user_id, round((amount * percentage) / 100.0, 2)))
+
+    else:
+        raise HTTPException(status_code=400, detail="Invalid split type specified. Must be 'equal', 'exact', or 'percentage'.")
+
+    return split_rows
+
+def insert_expense(cursor, expense: ExpenseCreate, split_rows: List[tuple], settlement_cycle: int) -> Expense:
+    """Write an expense, its splits and its rollups; the caller holds the group lock."""
+    # 1. Create the main expense record with settlement_cycle
+    expense_date = datetime.utcnow()
+    category = (expense.category or '').strip() or None
+    cursor.execute(
+        "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, settlement_cycle, category) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        (expense.description, expense.amount, expense.paid_by_user_id, expense.group_id, expense_date, settlement_cycle, category)
+    )
+    expense_id = cursor.lastrowid
+
+    # 2. Insert splits
+    cursor.executemany(
+        "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES (%s, %s, %s)",
+        [(expense_id, user_id, amount) for user_id, amount in split_rows]
+    )
+
+    # 3. Keep the spending rollups in step
+    record_expense_rollups(cursor, expense.group_id, [(expense_date, category, expense.paid_by_user_id, expense.amount, split_rows)])
+
+    return Expense(id=expense_id, expense_date=expense_date, **{**expense.dict(), "category": category})
+
 @api_router.post("/expenses/", response_model=Expense, status_code=status.HTTP_201_CREATED)
-def create_expense(expense: ExpenseCreate, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
-    """Endpoint to add a new expense and split it."""
+@retry_on_lock_conflict
+def create_expense(
+    expense: ExpenseCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Endpoint to add a new expense and split it.
+    Retries carrying the same Idempotency-Key header return the original response.
+    """
     cursor = db_conn.cursor(dictionary=True)
     try:
-        # Get group's current settlement cycle
-        cursor.execute("SELECT settlement_cycle FROM groups WHERE id = %s", (expense.group_id,))
-        group_row = cursor.fetchone()
-        settlement_cycle = group_row['settlement_cycle'] if group_row and group_row.get('settlement_cycle') else 1
-        
-        # 1. Create the main expense record with settlement_cycle
-        expense_date = datetime.utcnow()
-        cursor.execute(
-            "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, settlement_cycle) VALUES (%s, %s, %s, %s, %s, %s)",
-            (expense.description, expense.amount, expense.paid_by_user_id, expense.group_id, expense_date, settlement_cycle)
-        )
-        expense_id = cursor.lastrowid
-
-        # 2. Calculate and insert splits
-        splits_to_insert = []
-        if expense.split_type == 'equal':
-            # For equal split, the splits dict contains user_ids with amounts
-            num_participants = len(expense.splits)
-            if num_participants == 0:
-                raise HTTPException(status_code=400, detail="No participants for equal split.")
-            split_amount = round(expense.amount / num_participants, 2)
-            for user_id in expense.splits:
-                splits_to_insert.append((expense_id, user_id, split_amount))
-
-        elif expense.split_type == 'exact':
-            # For exact split, amounts are specified directly
-            total = sum(expense.splits.values())
-            if abs(total - expense.amount) > 0.01: # Tolerance for float precision
-                raise HTTPException(status_code=400, detail="Exact split amounts do not sum to total expense.")
-            for user_id, amount in expense.splits.items():
-                splits_to_insert.append((expense_id, user_id, amount))
-        
-        elif expense.split_type == 'percentage':
-            # For percentage split, splits dict contains user_ids with percentage values
-            total_percentage = sum(expense.splits.values())
-            if abs(total_percentage - 100.0) > 0.1: # Tolerance for float precision
-                raise HTTPException(status_code=400, detail=f"Percentage split must total 100%, got {total_percentage}%")
-            for user_id, percentage in expense.splits.items():
-                amount = round((expense.amount * percentage) / 100.0, 2)
-                splits_to_insert.append((expense_id, user_id, amount))
-        
-        else:
-            raise HTTPException(status_code=400, detail="Invalid split type specified. Must be 'equal', 'exact', or 'percentage'.")
+        # Validate and compute the splits before touching the database
+        split_rows = compute_expense_splits(expense.split_type, expense.amount, expense.splits)
 
-        cursor.executemany(
-            "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES (%s, %s, %s)",
-            splits_to_insert
-        )
+        begin_group_write(db_conn)
+        replay = begin_idempotent_request(cursor, current_user.id, idempotency_key, 'create_expense', expense)
+        if replay:
+            db_conn.rollback()
+            return replay
+
+        # Lock the group and get its current settlement cycle
+        group_row = lock_group_for_write(cursor, expense.group_id)
+        created = insert_expense(cursor, expense, split_rows, group_row['settlement_cycle'])
+        bump_group_version(cursor, expense.group_id)
+
+        complete_idempotent_request(cursor, current_user.id, idempotency_key, status.HTTP_201_CREATED, created)
         
         db_conn.commit()
         
-        return {"id": expense_id, "expense_date": expense_date, **expense.dict()}
+        return created
 
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
     finally:
         cursor.close()
 
-@api_router.get("/groups/", response_model=List[Group])
-def get_user_groups(current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
-    """Get all groups the current user is a member of."""
+def parse_expense_batch_csv(text: str) -> List[Dict[str, Any]]:
+    """
+    Parse a CSV expense import into row dicts.
+
+    Columns: description, amount, paid_by_user_id, split_type, splits and the
+    optional expense_date and category. The splits column holds "user_id:value" pairs separated
+    by ';' (the value may be left out for equal splits), e.g. "1:20;2:30".
+    """
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        row = {key.strip(): (value or '').strip() for key, value in record.items() if key}
+        splits = {}
+        for part in row.get('splits', '').split(';'):
+            if not part.strip():
+                continue
+            user_id, _, value = part.partition(':')
+            splits[user_id.strip()] = value.strip() or 0
+        row['splits'] = splits
+        for optional in ('expense_date', 'category'):
+            if not row.get(optional):
+                row.pop(optional, None)
+        rows.append(row)
+    return rows
+
+@retry_on_lock_conflict
+def import_expenses_into_group(db_conn, group_id: int, current_user: User, raw_rows: List[Any], all_or_nothing: bool):
+    """Validate all rows of a bulk import, then write the valid ones in one transaction."""
+    begin_group_write(db_conn)
     cursor = db_conn.cursor(dictionary=True)
     try:
+        # Load the member list once; it is used both for authorization and row validation
         cursor.execute("""
-            SELECT g.id, g.name, g.created_by, g.currency, g.settlement_method
-            FROM groups g
-            INNER JOIN group_members gm ON g.id = gm.group_id
-            WHERE gm.user_id = %s AND gm.is_active = TRUE
-        """, (current_user.id,))
-        groups = cursor.fetchall()
-        
-        # Fetch members for each group
-        result = []
-        for group in groups:
-            cursor.execute("""
-                SELECT u.id, u.email, u.full_name as name
-                FROM users u
-                INNER JOIN group_members gm ON u.id = gm.user_id
-                WHERE gm.group_id = %s AND gm.is_active = TRUE
-            """, (group['id'],))
-            members = cursor.fetchall()
-            group['members'] = [User(**member) for member in members]
-            result.append(Group(**group))
-        
-        return result
-    finally:
-        cursor.close()
-
-@api_router.get("/groups/{group_id}", response_model=Group)
+            SELECT user_id FROM group_members WHERE group_id = %s AND is_active = TRUE
+        """, (group_id,))
+        member_ids = {row['user_id'] for row in cursor.fetchall()}
+        if current_user.id not in member_ids:
+            raise HTTPException(status_code=403, detail="Not a member of this group")
+
+        group_row = lock_group_for_write(cursor, group_id)
+        settlement_cycle = group_row['settlement_cycle']
+
+        # STEP 1: Validate every row and compute its splits before writing anything
+        now = datetime.utcnow()
+        expense_rows = []
+        expense_splits = []
+        row_numbers = []
+        errors = []
+        for row_number, raw in enumerate(raw_rows, start=1):
+            try:
+                if not isinstance(raw, dict):
+                    raise ValueError("Each row must be an object")
+                item = ExpenseBatchItem(**raw)
+                if item.amount <= 0:
+                    raise ValueError("Expense amount must be positive")
+                if item.paid_by_user_id not in member_ids:
+                    raise ValueError(f"Payer {item.paid_by_user_id} is not a member of this group")
+                outsiders = [user_id for user_id in item.splits if user_id not in member_ids]
+                if outsiders:
+                    raise ValueError(f"Users {outsiders} are not members of this group")
+                split_rows = compute_expense_splits(item.split_type, item.amount, item.splits)
+            except ValidationError as err:
+                detail = "; ".join(f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']}" for e in err.errors())
+                errors.append({"row": row_number, "detail": detail})
+                continue
+            except ValueError as err:
+                errors.append({"row": row_number, "detail": str(err)})
+                continue
+            except HTTPException as err:
+                errors.append({"row": row_number, "detail": err.detail})
+                continue
+
+            expense_rows.append((item.description, item.amount, item.paid_by_user_id, group_id,
+                                 item.expense_date or now, settlement_cycle, (item.category or '').strip() or None))
+            expense_splits.append(split_rows)
+            row_numbers.append(row_number)
+
+        if errors and all_or_nothing:
+            raise HTTPException(
+                status_code=422,
+                detail={"message": "Import rejected; no expenses were created", "errors": errors}
+            )
+
+        # STEP 2: Write expenses and splits with chunked multi-row INSERTs
+        expense_ids = []
+        if expense_rows:
+            expense_ids = insert_rows_chunked(
+                cursor,
+                "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, settlement_cycle, category) VALUES ",
+                "(%s, %s, %s, %s, %s, %s, %s)",
+                expense_rows,
+                owner=("group_id", group_id)
+            )
+            split_rows_to_insert = [
+                (expense_id, user_id, amount)
+                for expense_id, split_rows in zip(expense_ids, expense_splits)
+                for user_id, amount in split_rows
+            ]
+            insert_rows_chunked(
+                cursor,
+                "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES ",
+                "(%s, %s, %s)",
+                split_rows_to_insert
+            )
+            record_expense_rollups(cursor, group_id, [
+                (row[4], row[6], row[2], row[1], split_rows)
+                for row, split_rows in zip(expense_rows, expense_splits)
+            ])
+            bump_group_version(cursor, group_id)
+            db_conn.commit()
+
+        return {
+            "group_id": group_id,
+            "created": len(expense_ids),
+            "failed": len(errors),
+            "imported": [{"row": row_number, "expense_id": expense_id} for row_number, expense_id in zip(row_numbers, expense_ids)],
+            "errors": errors
+        }
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
+@api_router.post("/groups/{group_id}/expenses:batch", response_model=Dict[str, Any])
+async def import_group_expenses(
+    group_id: int,
+    request: Request,
+    all_or_nothing: bool = False,
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Bulk-import expenses into a group in a single transaction.
+
+    Accepts a JSON array of expenses, or a CSV document when sent with
+    Content-Type: text/csv. Splits use the same rules as POST /expenses/.
+    All rows are validated first; invalid rows are reported by their 1-based
+    row number and skipped, or reject the whole import when all_or_nothing=true.
+    """
+    body = await request.body()
+    try:
+        if 'csv' in request.headers.get('content-type', ''):
+            raw_rows = parse_expense_batch_csv(body.decode('utf-8-sig'))
+        else:
+            raw_rows = json.loads(body or b'[]')
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=f"Could not parse import: {err}")
+
+    if not isinstance(raw_rows, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    if len(raw_rows) > MAX_BATCH_EXPENSES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_EXPENSES} expenses can be imported at once")
+
+    # The database work is blocking, so keep it off the event loop
+    return await run_in_threadpool(import_expenses_into_group, db_conn, group_id, current_user, raw_rows, all_or_nothing)
+
+def fetch_user_groups(cursor, user_id: int) -> List[Group]:
+    """All groups the user is an active member of, with their members, in two queries."""
+    cursor.execute("""
+        SELECT g.id, g.name, g.created_by, g.currency, g.settlement_method
+        FROM groups g
+        INNER JOIN group_members gm ON g.id = gm.group_id
+        WHERE gm.user_id = %s AND gm.is_active = TRUE
+    """, (user_id,))
+    groups = cursor.fetchall()
+    if not groups:
+        return []
+    
+    # Fetch members for all groups at once
+    placeholders = ','.join(['%s'] * len(groups))
+    cursor.execute(f"""
+        SELECT gm.group_id, u.id, u.email, u.full_name as name
+        FROM group_members gm
+        INNER JOIN users u ON u.id = gm.user_id
+        WHERE gm.group_id IN ({placeholders}) AND gm.is_active = TRUE
+    """, [group['id'] for group in groups])
+    members_by_group: Dict[int, List[User]] = {}
+    for member in cursor.fetchall():
+        group_id = member.pop('group_id')
+        members_by_group.setdefault(group_id, []).append(User(**member))
+    
+    result = []
+    for group in groups:
+        group['members'] = members_by_group.get(group['id'], [])
+        result.append(Group(**group))
+    return result
+
+def fetch_user_group_balances(cursor, user_id: int) -> Dict[int, float]:
+    """
+    The user's net balance in the current cycle of each of their groups, in one query.
+    Positive means they are owed (same convention as compute_cycle_balances).
+    """
+    cursor.execute("""
+        SELECT
+            g.id as group_id,
+            (SELECT COALESCE(SUM(e.amount), 0) FROM expenses e
+             WHERE e.group_id = g.id AND e.settlement_cycle = g.settlement_cycle AND e.paid_by = %s)
+            - (SELECT COALESCE(SUM(es.amount), 0) FROM expenses e
+               INNER JOIN expense_splits es ON es.expense_id = e.id AND es.user_id = %s
+               WHERE e.group_id = g.id AND e.settlement_cycle = g.settlement_cycle)
+            + (SELECT COALESCE(SUM(s.amount), 0) FROM settlements s
+               WHERE s.group_id = g.id AND s.settlement_cycle = g.settlement_cycle AND s.payer_id = %s)
+            - (SELECT COALESCE(SUM(s.amount), 0) FROM settlements s
+               WHERE s.group_id = g.id AND s.settlement_cycle = g.settlement_cycle AND s.payee_id = %s) as balance
+        FROM group_members gm
+        INNER JOIN groups g ON g.id = gm.group_id
+        WHERE gm.user_id = %s AND gm.is_active = TRUE
+    """, (user_id, user_id, user_id, user_id, user_id))
+    return {row['group_id']: round(float(row['balance']), 2) for row in cursor.fetchall()}
+
+@api_router.get("/groups/", response_model=List[Group])
+def get_user_groups(current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """Get all groups the current user is a member of."""
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        return fetch_user_groups(cursor, current_user.id)
+    finally:
+        cursor.close()
+
+@api_router.get("/groups/{group_id}", response_model=Group)
 def get_group(group_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
     """Get details of a specific group."""
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Check if user is a member
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (group_id, current_user.id))
-        if cursor.fetchone()['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
+        require_group_member(db_conn, current_user.id, group_id)
         
         # Get group details
         cursor.execute("SELECT id, name, created_by, currency, settlement_method FROM groups WHERE id = %s", (group_id,))
@@ -543,9 +1694,111 @@ def get_group(group_id: int, current_user: User = Depends(get_current_user), db_
     finally:
         cursor.close()
 
+MEMBER_ACTIONS = ('add', 'remove', 'replace')
+
+def apply_member_changes(cursor, group_id: int, current_user_id: int, action: str, user_ids: List[int]) -> Dict[str, List[int]]:
+    """
+    Add, remove or replace a group's active members with set-based statements.
+
+    Call with the group write lock held and a dictionary cursor. Removed members
+    keep their group_members row with is_active = FALSE, and adding them again
+    reactivates that row. Returns the diff as sorted user id lists: 'added'
+    (new rows), 'reactivated' and 'removed'.
+    """
+    if action not in MEMBER_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"action must be one of {', '.join(MEMBER_ACTIONS)}")
+    requested = set(user_ids)
+    if action == 'remove' and current_user_id in requested:
+        raise HTTPException(status_code=400, detail="You cannot remove yourself from the group")
+
+    if requested and action != 'remove':
+        placeholders = ','.join(['%s'] * len(requested))
+        cursor.execute(f"SELECT id FROM users WHERE id IN ({placeholders})", list(requested))
+        unknown = requested - {row['id'] for row in cursor.fetchall()}
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown user ids: {sorted(unknown)}")
+
+    cursor.execute("SELECT user_id, is_active FROM group_members WHERE group_id = %s", (group_id,))
+    rows = {row['user_id']: bool(row['is_active']) for row in cursor.fetchall()}
+    active = {user_id for user_id, is_active in rows.items() if is_active}
+
+    if action == 'add':
+        target = active | requested
+    elif action == 'remove':
+        target = active - requested
+    else:
+        target = requested | {current_user_id}
+
+    to_activate = sorted(target - active)
+    to_remove = sorted(active - target)
+    if to_activate:
+        # New users get a row, previous members have theirs reactivated
+        upsert_rows_chunked(
+            cursor,
+            "INSERT INTO group_members (group_id, user_id, is_active) VALUES ",
+            "(%s, %s, TRUE)",
+            [(group_id, user_id) for user_id in to_activate],
+            "is_active = TRUE"
+        )
+    if to_remove:
+        placeholders = ','.join(['%s'] * len(to_remove))
+        cursor.execute(f"""
+            UPDATE group_members SET is_active = FALSE
+            WHERE group_id = %s AND user_id IN ({placeholders})
+        """, [group_id] + to_remove)
+
+    return {
+        "added": [user_id for user_id in to_activate if user_id not in rows],
+        "reactivated": [user_id for user_id in to_activate if user_id in rows],
+        "removed": to_remove,
+    }
+
+def invalidate_member_changes(group_id: int, changes: Dict[str, List[int]]) -> None:
+    """Drop cached memberships touched by apply_member_changes; call after commit."""
+    membership_index.invalidate_group(group_id)
+    membership_index.invalidate(changes["added"] + changes["reactivated"] + changes["removed"])
+
+@api_router.post("/groups/{group_id}/members:bulk", response_model=Dict[str, Any])
+@retry_on_lock_conflict
+def bulk_update_group_members(group_id: int, bulk: GroupMembersBulk, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """
+    Add, remove or replace many group members in one transaction.
+
+    Changes are applied with one multi-row upsert and one UPDATE, whatever the
+    number of users, and the response lists who was added, reactivated and removed.
+    """
+    if len(bulk.user_ids) > MAX_BULK_MEMBERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_MEMBERS} users per request")
+    begin_group_write(db_conn)
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        require_group_member(db_conn, current_user.id, group_id)
+        lock_group_for_write(cursor, group_id)
+
+        changes = apply_member_changes(cursor, group_id, current_user.id, bulk.action, bulk.user_ids)
+        if any(changes.values()):
+            bump_group_version(cursor, group_id)
+        cursor.execute(
+            "SELECT COUNT(*) as count FROM group_members WHERE group_id = %s AND is_active = TRUE", (group_id,)
+        )
+        member_count = cursor.fetchone()['count']
+        db_conn.commit()
+        invalidate_member_changes(group_id, changes)
+
+        return {"group_id": group_id, "action": bulk.action, **changes, "member_count": member_count}
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
 @api_router.put("/groups/{group_id}", response_model=Group)
+@retry_on_lock_conflict
 def update_group(group_id: int, group_update: GroupCreate, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
     """Update a group's name and members."""
+    begin_group_write(db_conn)
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Check if user is a member and get group details
@@ -557,55 +1810,19 @@ def update_group(group_id: int, group_update: GroupCreate, current_user: User =
         group = cursor.fetchone()
         if not group:
             raise HTTPException(status_code=404, detail="Group not found or not a member")
+        lock_group_for_write(cursor, group_id)
         
         # Update group name and currency
         cursor.execute("""
             UPDATE `groups` SET name = %s, currency = %s WHERE id = %s
         """, (group_update.name, group_update.currency or 'USD', group_id))
         
-        # Update members - remove old members not in new list, add new members
-        # Get current members
-        cursor.execute("""
-            SELECT user_id FROM group_members WHERE group_id = %s AND is_active = TRUE
-        """, (group_id,))
-        current_member_ids = [row['user_id'] for row in cursor.fetchall()]
-        
-        # Ensure current user is in the member list
-        if current_user.id not in group_update.member_ids:
-            group_update.member_ids.append(current_user.id)
-        
-        # Members to remove (set is_active to FALSE)
-        members_to_remove = [uid for uid in current_member_ids if uid not in group_update.member_ids]
-        if members_to_remove:
-            placeholders = ','.join(['%s'] * len(members_to_remove))
-            cursor.execute(f"""
-                UPDATE group_members SET is_active = FALSE 
-                WHERE group_id = %s AND user_id IN ({placeholders})
-            """, [group_id] + members_to_remove)
-        
-        # Members to add
-        members_to_add = [uid for uid in group_update.member_ids if uid not in current_member_ids]
-        if members_to_add:
-            # Check if they were previously members (reactivate) or new members (insert)
-            for user_id in members_to_add:
-                cursor.execute("""
-                    SELECT id FROM group_members WHERE group_id = %s AND user_id = %s
-                """, (group_id, user_id))
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # Reactivate existing membership
-                    cursor.execute("""
-                        UPDATE group_members SET is_active = TRUE 
-                        WHERE group_id = %s AND user_id = %s
-                    """, (group_id, user_id))
-                else:
-                    # Add new member
-                    cursor.execute("""
-                        INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)
-                    """, (group_id, user_id))
-        
+        # Make the member list the group's active members (the caller always stays)
+        changes = apply_member_changes(cursor, group_id, current_user.id, 'replace', group_update.member_ids)
+
+        bump_group_version(cursor, group_id)
         db_conn.commit()
+        invalidate_member_changes(group_id, changes)
         
         # Fetch and return updated group
         cursor.execute("SELECT id, name, created_by, currency FROM groups WHERE id = %s", (group_id,))
@@ -625,22 +1842,29 @@ def update_group(group_id: int, group_update: GroupCreate, current_user: User =
         
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
     finally:
         cursor.close()
 
-@api_router.delete("/groups/{group_id}", response_model=Dict[str, Any])
+@api_router.delete("/groups/{group_id}", response_model=Dict[str, Any], status_code=status.HTTP_202_ACCEPTED)
+@retry_on_lock_conflict
 def delete_group(group_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
     """
     Delete a group and all associated data.
     Only the group creator can delete the group.
-    Returns statistics about what was deleted.
+
+    The group is marked deleted and hidden from all members immediately; its
+    history is purged in small committed batches by a background 'delete_group'
+    job whose progress can be polled at /api/jobs/{job_id}.
     """
+    begin_group_write(db_conn)
     cursor = db_conn.cursor(dictionary=True)
     try:
-        # Get group details and verify creator
+        # Get group details and verify creator (locking out concurrent writes to the group)
         cursor.execute("""
-            SELECT id, name, created_by FROM groups WHERE id = %s
+            SELECT id, name, created_by FROM groups WHERE id = %s AND deleted_at IS NULL FOR UPDATE
         """, (group_id,))
         group = cursor.fetchone()
         
@@ -654,55 +1878,48 @@ def delete_group(group_id: int, current_user: User = Depends(get_current_user),
                 detail="Only the group creator can delete this group"
             )
         
-        # Count what will be deleted (for return statistics)
-        cursor.execute("SELECT COUNT(*) as count FROM expense_splits es INNER JOIN expenses e ON es.expense_id = e.id WHERE e.group_id = %s", (group_id,))
-        expense_splits_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM expenses WHERE group_id = %s", (group_id,))
-        expenses_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM settlements WHERE group_id = %s", (group_id,))
-        settlements_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM group_members WHERE group_id = %s", (group_id,))
-        members_count = cursor.fetchone()['count']
-        
-        # Start atomic deletion (proper order to respect foreign keys)
-        # Step 1: Delete expense splits (deepest child)
-        cursor.execute("""
-            DELETE es FROM expense_splits es
-            INNER JOIN expenses e ON es.expense_id = e.id
-            WHERE e.group_id = %s
-        """, (group_id,))
-        
-        # Step 2: Delete expenses
-        cursor.execute("DELETE FROM expenses WHERE group_id = %s", (group_id,))
-        
-        # Step 3: Delete settlements
-        cursor.execute("DELETE FROM settlements WHERE group_id = %s", (group_id,))
-        
-        # Step 4: Delete group memberships
-        cursor.execute("DELETE FROM group_members WHERE group_id = %s", (group_id,))
+        # Index-only counts for the response (clients show them to the user),
+        # including archived cycles, which the purge deletes as well
+        counts_sql = history_union("""
+            SELECT
+                (SELECT COUNT(*) FROM {expenses} WHERE group_id = %s) as expenses,
+                (SELECT COUNT(*) FROM {settlements} WHERE group_id = %s) as settlements
+        """)
+        cursor.execute(f"""
+            SELECT
+                SUM(history.expenses) as expenses,
+                SUM(history.settlements) as settlements,
+                (SELECT COUNT(*) FROM group_members WHERE group_id = %s) as members
+            FROM ({counts_sql}) as history
+        """, (group_id,) + (group_id, group_id) * len(HISTORY_TABLE_SETS))
+        counts = cursor.fetchone()
         
-        # Step 5: Delete the group itself
-        cursor.execute("DELETE FROM groups WHERE id = %s", (group_id,))
+        # Mark deleted and deactivate memberships so the group disappears at once,
+        # then hand the purge over to the job runner
+        cursor.execute("UPDATE groups SET deleted_at = NOW(), data_version = data_version + 1 WHERE id = %s", (group_id,))
+        cursor.execute("UPDATE group_members SET is_active = FALSE WHERE group_id = %s", (group_id,))
+        job_id = enqueue_job(cursor, 'delete_group', {"group_id": group_id}, created_by=current_user.id)
         
         db_conn.commit()
+        membership_index.invalidate_group(group_id)
         
         return {
             "success": True,
             "message": f"Group '{group['name']}' deleted successfully",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
             "deleted": {
-                "expense_splits": expense_splits_count,
-                "expenses": expenses_count,
-                "settlements": settlements_count,
-                "members": members_count
+                "expenses": int(counts['expenses']),
+                "settlements": int(counts['settlements']),
+                "members": counts['members']
             }
         }
         
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
     finally:
         cursor.close()
 
@@ -712,21 +1929,19 @@ def get_group_expenses(group_id: int, current_user: User = Depends(get_current_u
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Check if user is a member
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (group_id, current_user.id))
-        if cursor.fetchone()['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
+        require_group_member(db_conn, current_user.id, group_id)
         
-        # Get expenses
-        cursor.execute("""
-            SELECT id, description, amount, paid_by as paid_by_user_id, 
-                   group_id, expense_date
-            FROM expenses 
-            WHERE group_id = %s 
+        # Get expenses, including archived cycles
+        expenses_sql = history_union("""
+            SELECT id, description, amount, paid_by as paid_by_user_id,
+                   group_id, expense_date, category
+            FROM {expenses}
+            WHERE group_id = %s
+        """)
+        cursor.execute(f"""
+            SELECT * FROM ({expenses_sql}) as history
             ORDER BY expense_date DESC
-        """, (group_id,))
+        """, (group_id,) * len(HISTORY_TABLE_SETS))
         expenses = cursor.fetchall()
         
         return [Expense(**expense) for expense in expenses]
@@ -748,93 +1963,196 @@ def get_group_balances(group_id: int, current_user: User = Depends(get_current_u
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Check if user is a member
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (group_id, current_user.id))
-        if cursor.fetchone()['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
+        require_group_member(db_conn, current_user.id, group_id)
         
-        # Get group name and current settlement cycle
-        cursor.execute("SELECT name, COALESCE(settlement_cycle, 1) as settlement_cycle FROM groups WHERE id = %s", (group_id,))
+        # Get group name, current settlement cycle and data version
+        cursor.execute("SELECT name, settlement_cycle, data_version FROM groups WHERE id = %s", (group_id,))
         group_result = cursor.fetchone()
         if not group_result:
             raise HTTPException(status_code=404, detail="Group not found")
         group_name = group_result['name']
         current_cycle = group_result['settlement_cycle']
+
+        def compute():
+            # Net balances for the CURRENT settlement cycle, with all its settlements applied
+            balance_map = compute_cycle_balances(db_conn, group_id, current_cycle)
+            
+            balances = [Balance(**b) for b in balance_map.values()]
+            
+            # Calculate simplified settlements (greedy algorithm)
+            settlements = calculate_settlements(balances)
+            
+            return GroupBalance(
+                group_id=group_id,
+                group_name=group_name,
+                balances=balances,
+                settlements=settlements
+            )
+
+        key = result_cache_key('balances', group_id, current_cycle, group_result['data_version'])
+        return cached_result(key, compute)
+    finally:
+        cursor.close()
+
+def compute_pairwise_balances(cursor, group_id: int, current_cycle: int) -> Dict[str, Any]:
+    """Pairwise debts for one settlement cycle of a group (see get_pairwise_balances)."""
+    # STEP 1: Get all expense data with splits - ONLY for current cycle
+    cursor.execute("""
+        SELECT 
+            e.id as expense_id,
+            e.description,
+            e.amount as total_amount,
+            e.expense_date,
+            e.paid_by as paid_by_user_id,
+            payer.full_name as paid_by_name,
+            es.user_id as owes_user_id,
+            ower.full_name as owes_user_name,
+            es.amount as owed_amount
+        FROM expenses e
+        INNER JOIN users payer ON e.paid_by = payer.id
+        INNER JOIN expense_splits es ON e.id = es.expense_id
+        INNER JOIN users ower ON es.user_id = ower.id
+        WHERE e.group_id = %s AND e.settlement_cycle = %s
+        ORDER BY e.expense_date DESC
+    """, (group_id, current_cycle))
+    expense_data = cursor.fetchall()
+
+    # Get ALL settlements in current cycle
+    # The settlement_type is used for the lock mechanism, not for filtering here
+    # This ensures the pairwise view shows accurate balances regardless of settlement method used
+    cursor.execute("""
+        SELECT payer_id, payee_id, amount
+        FROM settlements
+        WHERE group_id = %s AND settlement_cycle = %s
+    """, (group_id, current_cycle))
+    all_settlements = cursor.fetchall()
+
+    logging.debug(
+        f"Pairwise balances for group {group_id}, cycle {current_cycle}: "
+        f"{len(expense_data)} expense splits, {len(all_settlements)} settlements"
+    )
+    return {"pairwise_balances": build_pairwise_balances(expense_data, all_settlements)}
+
+def build_pairwise_balances(expense_data: List[Dict[str, Any]], all_settlements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Net debt between each pair of members from expense split rows and settlements.
+    Pure function over the rows compute_pairwise_balances reads; highest debts first.
+    """
+    # STEP 2: Build bidirectional pairwise structure
+    # Track debts in both directions between each pair
+    bidirectional = {}  # (user1, user2) -> debt info where user1 < user2
+    
+    for row in expense_data:
+        paid_by = row['paid_by_user_id']
+        owes_by = row['owes_user_id']
+        amount = float(row['owed_amount'])
         
-        # Calculate balances: what each person paid minus what they owe
-        # ONLY for expenses in the CURRENT settlement cycle
-        cursor.execute("""
-            SELECT 
-                u.id as user_id,
-                u.full_name as user_name,
-                COALESCE(paid.total_paid, 0) as total_paid,
-                COALESCE(owed.total_owed, 0) as total_owed
-            FROM users u
-            INNER JOIN group_members gm ON u.id = gm.user_id AND gm.group_id = %s AND gm.is_active = TRUE
-            LEFT JOIN (
-                SELECT paid_by as user_id, SUM(amount) as total_paid
-                FROM expenses
-                WHERE group_id = %s AND COALESCE(settlement_cycle, 1) = %s
-                GROUP BY paid_by
-            ) paid ON paid.user_id = u.id
-            LEFT JOIN (
-                SELECT es.user_id, SUM(es.amount) as total_owed
-                FROM expense_splits es
-                INNER JOIN expenses e ON es.expense_id = e.id
-                WHERE e.group_id = %s AND COALESCE(e.settlement_cycle, 1) = %s
-                GROUP BY es.user_id
-            ) owed ON owed.user_id = u.id
-            WHERE gm.group_id = %s AND gm.is_active = TRUE
-        """, (group_id, group_id, current_cycle, group_id, current_cycle, group_id))
+        # Skip self-debts
+        if paid_by == owes_by:
+            continue
         
-        balance_data = cursor.fetchall()
+        # Canonical pair key (smaller id first)
+        user_pair = tuple(sorted([owes_by, paid_by]))
         
-        # Apply ALL settlements in the current cycle (both simplified and detailed)
-        # The settlement_type is used for the lock mechanism, not for filtering here
-        # This ensures Group Details shows accurate net balances regardless of settlement method used
-        cursor.execute("""
-            SELECT payer_id, payee_id, amount
-            FROM settlements
-            WHERE group_id = %s AND COALESCE(settlement_cycle, 1) = %s
-        """, (group_id, current_cycle))
-        settlements_data = cursor.fetchall()
-        
-        # Create balance map
-        balance_map = {}
-        for row in balance_data:
-            net_balance = float(row['total_paid']) - float(row['total_owed'])
-            balance_map[row['user_id']] = {
-                'user_id': row['user_id'],
-                'user_name': row['user_name'],
-                'balance': net_balance
+        if user_pair not in bidirectional:
+            # Determine which name goes with which ID
+            user1_name = row['owes_user_name'] if owes_by == user_pair[0] else row['paid_by_name']
+            user2_name = row['paid_by_name'] if paid_by == user_pair[1] else row['owes_user_name']
+            
+            bidirectional[user_pair] = {
+                'user1_id': user_pair[0],
+                'user1_name': user1_name,
+                'user2_id': user_pair[1],
+                'user2_name': user2_name,
+                'user1_owes_user2': 0.0,  # Amount user1 owes user2
+                'user2_owes_user1': 0.0,  # Amount user2 owes user1
+                'expenses_user1_owes_user2': [],
+                'expenses_user2_owes_user1': []
             }
         
-        # Apply settlements
-        for settlement in settlements_data:
-            payer_id = settlement['payer_id']
-            payee_id = settlement['payee_id']
-            amount = float(settlement['amount'])
-            
-            if payer_id in balance_map:
-                balance_map[payer_id]['balance'] += amount  # Payer paid, so increases their balance
-            if payee_id in balance_map:
-                balance_map[payee_id]['balance'] -= amount  # Payee received, so decreases their balance
+        # Add the debt in the correct direction
+        if owes_by == user_pair[0] and paid_by == user_pair[1]:
+            # user1 owes user2
+            bidirectional[user_pair]['user1_owes_user2'] += amount
+            bidirectional[user_pair]['expenses_user1_owes_user2'].append({
+                'expense_id': row['expense_id'],
+                'description': row['description'],
+                'amount': amount,
+                'date': row['expense_date'].isoformat() if row['expense_date'] else None
+            })
+        else:
+            # user2 owes user1
+            bidirectional[user_pair]['user2_owes_user1'] += amount
+            bidirectional[user_pair]['expenses_user2_owes_user1'].append({
+                'expense_id': row['expense_id'],
+                'description': row['description'],
+                'amount': amount,
+                'date': row['expense_date'].isoformat() if row['expense_date'] else None
+            })
+    
+    # STEP 3: Apply settlements to pairwise debts
+    for settlement in all_settlements:
+        payer_id = settlement['payer_id']  # Person paying
+        payee_id = settlement['payee_id']  # Person receiving
+        amount = float(settlement['amount'])
         
-        balances = [Balance(**b) for b in balance_map.values()]
+        user_pair = tuple(sorted([payer_id, payee_id]))
+        
+        if user_pair in bidirectional:
+            data = bidirectional[user_pair]
+            # Reduce the debt where payer owes payee
+            if payer_id == data['user1_id'] and payee_id == data['user2_id']:
+                data['user1_owes_user2'] = max(0, data['user1_owes_user2'] - amount)
+            elif payer_id == data['user2_id'] and payee_id == data['user1_id']:
+                data['user2_owes_user1'] = max(0, data['user2_owes_user1'] - amount)
+    
+    # STEP 4: Calculate net pairwise balances and build result
+    pairwise_list = []
+    
+    for user_pair, data in bidirectional.items():
+        user1_owes = data['user1_owes_user2']
+        user2_owes = data['user2_owes_user1']
         
-        # Calculate simplified settlements (greedy algorithm)
-        settlements = calculate_settlements(balances)
+        # Net debt between this pair
+        net_debt = user1_owes - user2_owes
         
-        return GroupBalance(
-            group_id=group_id,
-            group_name=group_name,
-            balances=balances,
-            settlements=settlements
-        )
-    finally:
-        cursor.close()
+        # Use 0.05 threshold to match mobile/web rounding tolerance
+        if abs(net_debt) < 0.05:
+            continue  # Balanced, skip
+        
+        if net_debt > 0:
+            # User1 owes User2
+            pairwise_list.append({
+                'from_user_id': data['user1_id'],
+                'from_user_name': data['user1_name'],
+                'to_user_id': data['user2_id'],
+                'to_user_name': data['user2_name'],
+                'total_amount': round(net_debt, 2),
+                'breakdown': {
+                    'owes': round(user1_owes, 2),
+                    'owed_back': round(user2_owes, 2)
+                },
+                'expenses': data['expenses_user1_owes_user2'] + data['expenses_user2_owes_user1']
+            })
+        else:
+            # User2 owes User1
+            pairwise_list.append({
+                'from_user_id': data['user2_id'],
+                'from_user_name': data['user2_name'],
+                'to_user_id': data['user1_id'],
+                'to_user_name': data['user1_name'],
+                'total_amount': round(abs(net_debt), 2),
+                'breakdown': {
+                    'owes': round(user2_owes, 2),
+                    'owed_back': round(user1_owes, 2)
+                },
+                'expenses': data['expenses_user2_owes_user1'] + data['expenses_user1_owes_user2']
+            })
+    
+    # Sort by amount (highest first)
+    pairwise_list.sort(key=lambda x: x['total_amount'], reverse=True)
+    
+    return pairwise_list
 
 @api_router.get("/groups/{group_id}/pairwise-balances", response_model=Dict[str, Any])
 def get_pairwise_balances(group_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
@@ -851,191 +2169,19 @@ def get_pairwise_balances(group_id: int, current_user: User = Depends(get_curren
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Check if user is a member
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (group_id, current_user.id))
-        if cursor.fetchone()['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
+        require_group_member(db_conn, current_user.id, group_id)
         
-        # Get group's current settlement cycle
-        cursor.execute("SELECT COALESCE(settlement_cycle, 1) as settlement_cycle FROM groups WHERE id = %s", (group_id,))
+        # Get group's current settlement cycle and data version
+        cursor.execute("SELECT settlement_cycle, data_version FROM groups WHERE id = %s", (group_id,))
         group_row = cursor.fetchone()
         current_cycle = group_row['settlement_cycle'] if group_row else 1
-        
-        # STEP 1: Get all expense data with splits - ONLY for current cycle
-        cursor.execute("""
-            SELECT 
-                e.id as expense_id,
-                e.description,
-                e.amount as total_amount,
-                e.expense_date,
-                e.paid_by as paid_by_user_id,
-                payer.full_name as paid_by_name,
-                es.user_id as owes_user_id,
-                ower.full_name as owes_user_name,
-                es.amount as owed_amount
-            FROM expenses e
-            INNER JOIN users payer ON e.paid_by = payer.id
-            INNER JOIN expense_splits es ON e.id = es.expense_id
-            INNER JOIN users ower ON es.user_id = ower.id
-            WHERE e.group_id = %s AND COALESCE(e.settlement_cycle, 1) = %s
-            ORDER BY e.expense_date DESC
-        """, (group_id, current_cycle))
-        
-        expense_data = cursor.fetchall()
-        
-        # STEP 2: Build bidirectional pairwise structure
-        # Track debts in both directions between each pair
-        bidirectional = {}  # (user1, user2) -> debt info where user1 < user2
-        
-        for row in expense_data:
-            paid_by = row['paid_by_user_id']
-            owes_by = row['owes_user_id']
-            amount = float(row['owed_amount'])
-            
-            # Skip self-debts
-            if paid_by == owes_by:
-                continue
-            
-            # Canonical pair key (smaller id first)
-            user_pair = tuple(sorted([owes_by, paid_by]))
-            
-            if user_pair not in bidirectional:
-                # Determine which name goes with which ID
-                user1_name = row['owes_user_name'] if owes_by == user_pair[0] else row['paid_by_name']
-                user2_name = row['paid_by_name'] if paid_by == user_pair[1] else row['owes_user_name']
-                
-                bidirectional[user_pair] = {
-                    'user1_id': user_pair[0],
-                    'user1_name': user1_name,
-                    'user2_id': user_pair[1],
-                    'user2_name': user2_name,
-                    'user1_owes_user2': 0.0,  # Amount user1 owes user2
-                    'user2_owes_user1': 0.0,  # Amount user2 owes user1
-                    'expenses_user1_owes_user2': [],
-                    'expenses_user2_owes_user1': []
-                }
-            
-            # Add the debt in the correct direction
-            if owes_by == user_pair[0] and paid_by == user_pair[1]:
-                # user1 owes user2
-                bidirectional[user_pair]['user1_owes_user2'] += amount
-                bidirectional[user_pair]['expenses_user1_owes_user2'].append({
-                    'expense_id': row['expense_id'],
-                    'description': row['description'],
-                    'amount': amount,
-                    'date': row['expense_date'].isoformat() if row['expense_date'] else None
-                })
-            else:
-                # user2 owes user1
-                bidirectional[user_pair]['user2_owes_user1'] += amount
-                bidirectional[user_pair]['expenses_user2_owes_user1'].append({
-                    'expense_id': row['expense_id'],
-                    'description': row['description'],
-                    'amount': amount,
-                    'date': row['expense_date'].isoformat() if row['expense_date'] else None
-                })
-        
-        # STEP 3: Get ALL settlements in current cycle and apply them
-        # The settlement_type is used for the lock mechanism, not for filtering here
-        # This ensures the pairwise view shows accurate balances regardless of settlement method used
-        cursor.execute("""
-            SELECT payer_id, payee_id, amount
-            FROM settlements
-            WHERE group_id = %s AND COALESCE(settlement_cycle, 1) = %s
-        """, (group_id, current_cycle))
-        all_settlements = cursor.fetchall()
-        
-        # DEBUG: Log what we're processing
-        print(f"[DEBUG pairwise] Group {group_id}, Cycle {current_cycle}")
-        print(f"[DEBUG pairwise] Expenses found: {len(expense_data)}")
-        print(f"[DEBUG pairwise] Bidirectional pairs: {list(bidirectional.keys())}")
-        print(f"[DEBUG pairwise] Settlements found: {len(all_settlements)}")
-        for s in all_settlements:
-            print(f"[DEBUG pairwise] Settlement: payer={s['payer_id']}, payee={s['payee_id']}, amount={s['amount']}")
-        
-        # Apply settlements to pairwise debts
-        for settlement in all_settlements:
-            payer_id = settlement['payer_id']  # Person paying
-            payee_id = settlement['payee_id']  # Person receiving
-            amount = float(settlement['amount'])
-            
-            user_pair = tuple(sorted([payer_id, payee_id]))
-            
-            print(f"[DEBUG pairwise] Processing settlement: user_pair={user_pair}, payer={payer_id}, payee={payee_id}")
-            print(f"[DEBUG pairwise] Pair in bidirectional: {user_pair in bidirectional}")
-            
-            if user_pair in bidirectional:
-                data = bidirectional[user_pair]
-                print(f"[DEBUG pairwise] BEFORE: user1_owes_user2={data['user1_owes_user2']}, user2_owes_user1={data['user2_owes_user1']}")
-                print(f"[DEBUG pairwise] user1_id={data['user1_id']}, user2_id={data['user2_id']}")
-                # Reduce the debt where payer owes payee
-                if payer_id == data['user1_id'] and payee_id == data['user2_id']:
-                    data['user1_owes_user2'] = max(0, data['user1_owes_user2'] - amount)
-                    print(f"[DEBUG pairwise] Reduced user1_owes_user2 by {amount}")
-                elif payer_id == data['user2_id'] and payee_id == data['user1_id']:
-                    data['user2_owes_user1'] = max(0, data['user2_owes_user1'] - amount)
-                    print(f"[DEBUG pairwise] Reduced user2_owes_user1 by {amount}")
-                else:
-                    print(f"[DEBUG pairwise] NO MATCH - settlement direction doesn't match debt direction!")
-                print(f"[DEBUG pairwise] AFTER: user1_owes_user2={data['user1_owes_user2']}, user2_owes_user1={data['user2_owes_user1']}")
-        
-        # STEP 4: Calculate net pairwise balances and build result
-        pairwise_list = []
-        
-        for user_pair, data in bidirectional.items():
-            user1_owes = data['user1_owes_user2']
-            user2_owes = data['user2_owes_user1']
-            
-            # Net debt between this pair
-            net_debt = user1_owes - user2_owes
-            
-            # Use 0.05 threshold to match mobile/web rounding tolerance
-            if abs(net_debt) < 0.05:
-                continue  # Balanced, skip
-            
-            if net_debt > 0:
-                # User1 owes User2
-                pairwise_list.append({
-                    'from_user_id': data['user1_id'],
-                    'from_user_name': data['user1_name'],
-                    'to_user_id': data['user2_id'],
-                    'to_user_name': data['user2_name'],
-                    'total_amount': round(net_debt, 2),
-                    'breakdown': {
-                        'owes': round(user1_owes, 2),
-                        'owed_back': round(user2_owes, 2)
-                    },
-                    'expenses': data['expenses_user1_owes_user2'] + data['expenses_user2_owes_user1']
-                })
-            else:
-                # User2 owes User1
-                pairwise_list.append({
-                    'from_user_id': data['user2_id'],
-                    'from_user_name': data['user2_name'],
-                    'to_user_id': data['user1_id'],
-                    'to_user_name': data['user1_name'],
-                    'total_amount': round(abs(net_debt), 2),
-                    'breakdown': {
-                        'owes': round(user2_owes, 2),
-                        'owed_back': round(user1_owes, 2)
-                    },
-                    'expenses': data['expenses_user2_owes_user1'] + data['expenses_user1_owes_user2']
-                })
-        
-        # Sort by amount (highest first)
-        pairwise_list.sort(key=lambda x: x['total_amount'], reverse=True)
-        
-        # DEBUG: Final result
-        print(f"[DEBUG pairwise] Final pairwise_list count: {len(pairwise_list)}")
-        for p in pairwise_list:
-            print(f"[DEBUG pairwise] Result: {p['from_user_name']} owes {p['to_user_name']}: {p['total_amount']}")
-        
-        return {"pairwise_balances": pairwise_list}
+        data_version = group_row['data_version'] if group_row else 0
+
+        key = result_cache_key('pairwise', group_id, current_cycle, data_version)
+        return cached_result(key, lambda: compute_pairwise_balances(cursor, group_id, current_cycle))
         
     except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
     finally:
         cursor.close()
 
@@ -1086,11 +2232,268 @@ def calculate_settlements(balances: List[Balance]) -> List[Dict]:
     
     return settlements
 
+def apply_settlements_to_balances(balance_map: Dict[int, Dict[str, Any]], settlements: List[Dict[str, Any]]) -> None:
+    """Apply recorded payments to a balance map (user_id -> {'balance': ...}) in place."""
+    for settlement in settlements:
+        payer_id = settlement['payer_id']
+        payee_id = settlement['payee_id']
+        amount = float(settlement['amount'])
+
+        if payer_id in balance_map:
+            balance_map[payer_id]['balance'] += amount  # Payer paid, so increases their balance
+        if payee_id in balance_map:
+            balance_map[payee_id]['balance'] -= amount  # Payee received, so decreases their balance
+
+def compute_cycle_balances(db_conn, group_id: int, cycle: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Net balance of every active member for one settlement cycle.
+    Returns user_id -> {'user_id', 'user_name', 'balance'}; positive means they are owed.
+    """
+    # Calculate balances: what each person paid minus what they owe
+    # ONLY for expenses in the given settlement cycle
+    rows = prepared_statements.execute(
+        db_conn, CYCLE_MEMBER_TOTALS, (group_id, group_id, cycle, group_id, cycle, group_id)
+    )
+
+    balance_map = {}
+    for row in rows:
+        balance_map[row['user_id']] = {
+            'user_id': row['user_id'],
+            'user_name': row['user_name'],
+            'balance': float(row['total_paid']) - float(row['total_owed'])
+        }
+
+    # Apply ALL settlements in the cycle (both simplified and detailed)
+    # The settlement_type is used for the lock mechanism, not for filtering here
+    apply_settlements_to_balances(balance_map, prepared_statements.execute(db_conn, CYCLE_SETTLEMENTS, (group_id, cycle)))
+
+    return balance_map
+
+def build_cycle_snapshot(cursor, group_id: int, cycle: int) -> Dict[str, Any]:
+    """
+    Summarize one settlement cycle from the active detail tables: what each member
+    paid, owed, settled and received, the settlements recorded and the counts.
+    Amounts are summed in integer cents. cursor must be a dictionary cursor.
+    """
+    cursor.execute("""
+        SELECT paid_by as user_id, COUNT(*) as expense_count, SUM(amount) as paid
+        FROM expenses
+        WHERE group_id = %s AND settlement_cycle = %s
+        GROUP BY paid_by
+    """, (group_id, cycle))
+    paid_rows = cursor.fetchall()
+    cursor.execute("""
+        SELECT es.user_id, SUM(es.amount) as share
+        FROM expense_splits es
+        INNER JOIN expenses e ON es.expense_id = e.id
+        WHERE e.group_id = %s AND e.settlement_cycle = %s
+        GROUP BY es.user_id
+    """, (group_id, cycle))
+    share_rows = cursor.fetchall()
+    cursor.execute("""
+        SELECT id, payer_id, payee_id, amount, settlement_type, settlement_date
+        FROM settlements
+        WHERE group_id = %s AND settlement_cycle = %s
+        ORDER BY settlement_date, id
+    """, (group_id, cycle))
+    settlement_rows = cursor.fetchall()
+
+    def cents(amount):
+        return int(round(float(amount) * 100))
+
+    totals = {}
+    def member(user_id):
+        return totals.setdefault(user_id, {
+            'paid': 0, 'share': 0, 'settled_paid': 0, 'settled_received': 0, 'expenses_paid': 0
+        })
+
+    for row in paid_rows:
+        member(row['user_id'])['paid'] += cents(row['paid'])
+        member(row['user_id'])['expenses_paid'] += row['expense_count']
+    for row in share_rows:
+        member(row['user_id'])['share'] += cents(row['share'])
+    for row in settlement_rows:
+        member(row['payer_id'])['settled_paid'] += cents(row['amount'])
+        member(row['payee_id'])['settled_received'] += cents(row['amount'])
+
+    names = {}
+    if totals:
+        placeholders = ','.join(['%s'] * len(totals))
+        cursor.execute(f"SELECT id, full_name FROM users WHERE id IN ({placeholders})", tuple(totals))
+        names = {row['id']: row['full_name'] for row in cursor.fetchall()}
+
+    return {
+        'group_id': group_id,
+        'settlement_cycle': cycle,
+        # The closing settlement is the cycle's last one
+        'closed_at': settlement_rows[-1]['settlement_date'] if settlement_rows else datetime.utcnow(),
+        'expense_count': sum(row['expense_count'] for row in paid_rows),
+        'expense_total': sum(cents(row['paid']) for row in paid_rows) / 100,
+        'settlement_count': len(settlement_rows),
+        'settlement_total': sum(cents(row['amount']) for row in settlement_rows) / 100,
+        'member_totals': [
+            {
+                'user_id': user_id,
+                'user_name': names.get(user_id),
+                'paid': t['paid'] / 100,
+                'share': t['share'] / 100,
+                'settled_paid': t['settled_paid'] / 100,
+                'settled_received': t['settled_received'] / 100,
+                'expenses_paid': t['expenses_paid'],
+            }
+            for user_id, t in sorted(totals.items())
+        ],
+        'settlements': [
+            {
+                'id': row['id'],
+                'payer_id': row['payer_id'],
+                'payee_id': row['payee_id'],
+                'amount': float(row['amount']),
+                'settlement_type': row['settlement_type'] or 'simplified',
+                'settlement_date': row['settlement_date'],
+            }
+            for row in settlement_rows
+        ],
+    }
+
+def store_cycle_snapshot(cursor, snapshot: Dict[str, Any]) -> None:
+    """Save a cycle snapshot; a snapshot already stored for the cycle is kept."""
+    cursor.execute("""
+        INSERT INTO cycle_snapshots
+            (group_id, settlement_cycle, closed_at, expense_count, expense_total,
+             settlement_count, settlement_total, member_totals, settlements)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE group_id = group_id
+    """, (
+        snapshot['group_id'], snapshot['settlement_cycle'], snapshot['closed_at'],
+        snapshot['expense_count'], snapshot['expense_total'],
+        snapshot['settlement_count'], snapshot['settlement_total'],
+        json.dumps(snapshot['member_totals']), json.dumps(snapshot['settlements'], default=str)
+    ))
+
+def save_cycle_snapshot(cursor, group_id: int, cycle: int) -> bool:
+    """
+    Snapshot a cycle that is closing without risking the write that closed it:
+    on failure the snapshot is rolled back, logged and left for GET /cycles to
+    build later. Returns True when the snapshot was stored.
+    """
+    cursor.execute("SAVEPOINT cycle_snapshot")
+    try:
+        store_cycle_snapshot(cursor, build_cycle_snapshot(cursor, group_id, cycle))
+    except mysql.connector.Error as err:
+        if is_lock_conflict(err):
+            raise  # the whole transaction was rolled back; retried by retry_on_lock_conflict
+        cursor.execute("ROLLBACK TO SAVEPOINT cycle_snapshot")
+        metrics.increment("cycle_snapshots.failed")
+        logging.warning(f"Could not snapshot cycle {cycle} of group {group_id}: {err}")
+        return False
+    cursor.execute("RELEASE SAVEPOINT cycle_snapshot")
+    return True
+
+def close_cycle_if_settled(db_conn, group_id: int, current_cycle: int) -> bool:
+    """
+    If every member's balance in the current cycle is zero, reset the settlement
+    method lock, snapshot the cycle and start the next one. Returns True when
+    the cycle was closed.
+    """
+    balance_map = compute_cycle_balances(db_conn, group_id, current_cycle)
+
+    # Check if all settled (use 0.05 threshold to match mobile/web rounding tolerance)
+    BALANCE_THRESHOLD = 0.05
+    all_settled = all(abs(b['balance']) < BALANCE_THRESHOLD for b in balance_map.values())
+
+    if all_settled:
+        # Reset the settlement method lock AND increment the cycle
+        cursor = db_conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                UPDATE groups SET settlement_method = NULL, settlement_cycle = %s WHERE id = %s
+            """, (current_cycle + 1, group_id))
+            if save_cycle_snapshot(cursor, group_id, current_cycle) and CYCLE_ARCHIVE_ENABLED:
+                enqueue_job(
+                    cursor, 'archive_cycle', {"group_id": group_id, "settlement_cycle": current_cycle},
+                    delay_seconds=CYCLE_ARCHIVE_AFTER_DAYS * 86400
+                )
+        finally:
+            cursor.close()
+    return all_settled
+
+def apply_settlement(db_conn, cursor, settlement: SettlementCreate, group_row: Dict[str, Any]) -> Settlement:
+    """
+    Validate and record a settlement in a group locked by lock_group_for_write,
+    enforcing the settlement method lock and closing the cycle once everyone is
+    settled. group_row is updated in place, so later writes in the same
+    transaction see the new method lock and cycle.
+    """
+    # Verify payer and payee are members of the group
+    cursor.execute("""
+        SELECT COUNT(*) as count FROM group_members 
+        WHERE group_id = %s AND user_id IN (%s, %s) AND is_active = TRUE
+    """, (settlement.group_id, settlement.payer_id, settlement.payee_id))
+    result = cursor.fetchone()
+    if result['count'] != 2:
+        raise HTTPException(status_code=400, detail="Payer or payee is not a member of this group")
+    
+    # Validate amount
+    if settlement.amount <= 0:
+        raise HTTPException(status_code=400, detail="Settlement amount must be positive")
+    
+    # Validate settlement_type
+    valid_types = ['simplified', 'detailed']
+    settlement_type = settlement.settlement_type or 'simplified'
+    if settlement_type not in valid_types:
+        settlement_type = 'simplified'
+    
+    current_method = group_row['settlement_method']
+    current_cycle = group_row['settlement_cycle']
+    
+    # Enforce lock if exists
+    if current_method and current_method != settlement_type:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"This group is locked to '{current_method}' settlement method. Please use the {current_method} view to settle."
+        )
+    
+    # Set lock if not already set
+    if not current_method:
+        cursor.execute("""
+            UPDATE groups SET settlement_method = %s WHERE id = %s
+        """, (settlement_type, settlement.group_id))
+        group_row['settlement_method'] = settlement_type
+    
+    # Insert settlement with current settlement_cycle
+    settlement_date = datetime.utcnow()
+    cursor.execute("""
+        INSERT INTO settlements (group_id, payer_id, payee_id, amount, notes, settlement_date, settlement_type, settlement_cycle)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (settlement.group_id, settlement.payer_id, settlement.payee_id, 
+          settlement.amount, settlement.notes, settlement_date, settlement_type, current_cycle))
+    
+    settlement_id = cursor.lastrowid
+    
+    # Check if all balances are now zero - if so, reset lock and INCREMENT CYCLE
+    if close_cycle_if_settled(db_conn, settlement.group_id, current_cycle):
+        group_row['settlement_method'] = None
+        group_row['settlement_cycle'] = current_cycle + 1
+
+    return Settlement(
+        id=settlement_id,
+        settlement_date=settlement_date,
+        **settlement.dict()
+    )
+
 @api_router.post("/settlements/", response_model=Settlement, status_code=status.HTTP_201_CREATED)
-def record_settlement(settlement: SettlementCreate, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+@retry_on_lock_conflict
+def record_settlement(
+    settlement: SettlementCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
     """
     Record a settlement (payment) between two users in a group.
     Supports both full and partial settlements.
+    Retries carrying the same Idempotency-Key header return the original response.
     
     Settlement Method Lock:
     - First settlement in a group locks the settlement method for all members
@@ -1099,120 +2502,183 @@ def record_settlement(settlement: SettlementCreate, current_user: User = Depends
     """
     cursor = db_conn.cursor(dictionary=True)
     try:
+        begin_group_write(db_conn)
+        replay = begin_idempotent_request(cursor, current_user.id, idempotency_key, 'record_settlement', settlement)
+        if replay:
+            db_conn.rollback()
+            return replay
+
         # Verify current user is a member of the group
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (settlement.group_id, current_user.id))
-        result = cursor.fetchone()
-        if result['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        
-        # Verify payer and payee are members of the group
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id IN (%s, %s) AND is_active = TRUE
-        """, (settlement.group_id, settlement.payer_id, settlement.payee_id))
-        result = cursor.fetchone()
-        if result['count'] != 2:
-            raise HTTPException(status_code=400, detail="Payer or payee is not a member of this group")
-        
-        # Validate amount
-        if settlement.amount <= 0:
-            raise HTTPException(status_code=400, detail="Settlement amount must be positive")
-        
-        # Validate settlement_type
-        valid_types = ['simplified', 'detailed']
-        settlement_type = settlement.settlement_type or 'simplified'
-        if settlement_type not in valid_types:
-            settlement_type = 'simplified'
+        require_group_member(db_conn, current_user.id, settlement.group_id)
+
+        # Lock the group, then record the payment against its current cycle
+        group_row = lock_group_for_write(cursor, settlement.group_id)
+        created = apply_settlement(db_conn, cursor, settlement, group_row)
+        bump_group_version(cursor, settlement.group_id)
+
+        complete_idempotent_request(cursor, current_user.id, idempotency_key, status.HTTP_201_CREATED, created)
         
-        # Check group's settlement method lock and get current cycle
-        cursor.execute("""
-            SELECT settlement_method, COALESCE(settlement_cycle, 1) as settlement_cycle FROM groups WHERE id = %s
-        """, (settlement.group_id,))
-        group_row = cursor.fetchone()
-        current_method = group_row['settlement_method'] if group_row else None
-        current_cycle = group_row['settlement_cycle'] if group_row else 1
+        db_conn.commit()
         
-        # Enforce lock if exists
-        if current_method and current_method != settlement_type:
+        return created
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
+@api_router.post("/groups/{group_id}/settlements:batch", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
+@retry_on_lock_conflict
+def record_settlements_batch(group_id: int, batch: SettlementBatchCreate, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """
+    Record a whole settlement plan in one transaction ("settle everything").
+
+    Membership, amounts and the settlement method lock are validated once for the
+    whole batch, the payments are inserted with a single multi-row statement, and
+    the cycle-close check runs once at the end. With apply_suggested=true the
+    current simplified suggestions are recorded instead of an explicit list.
+    """
+    begin_group_write(db_conn)
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        # Load active members once for authorization and payer/payee validation
+        cursor.execute("""
+            SELECT user_id FROM group_members WHERE group_id = %s AND is_active = TRUE
+        """, (group_id,))
+        member_ids = {row['user_id'] for row in cursor.fetchall()}
+        if current_user.id not in member_ids:
+            raise HTTPException(status_code=403, detail="Not a member of this group")
+
+        group_row = lock_group_for_write(cursor, group_id)
+        current_method = group_row['settlement_method']
+        current_cycle = group_row['settlement_cycle']
+
+        settlement_type = batch.settlement_type or 'simplified'
+        if settlement_type not in ['simplified', 'detailed']:
+            settlement_type = 'simplified'
+
+        if batch.apply_suggested:
+            if batch.settlements:
+                raise HTTPException(status_code=400, detail="Provide either settlements or apply_suggested, not both")
+            # The suggestions come from the simplified (greedy) view
+            settlement_type = 'simplified'
+            balance_map = compute_cycle_balances(db_conn, group_id, current_cycle)
+            suggestions = calculate_settlements([Balance(**b) for b in balance_map.values()])
+            items = [
+                SettlementBatchItem(payer_id=s['from_user_id'], payee_id=s['to_user_id'], amount=s['amount'], notes=batch.notes)
+                for s in suggestions
+            ]
+        else:
+            items = batch.settlements
+
+        if not items:
+            raise HTTPException(status_code=400, detail="No settlements to record")
+
+        # Validate the whole batch before writing anything
+        for index, item in enumerate(items, start=1):
+            if item.payer_id not in member_ids or item.payee_id not in member_ids:
+                raise HTTPException(status_code=400, detail=f"Settlement {index}: payer or payee is not a member of this group")
+            if item.payer_id == item.payee_id:
+                raise HTTPException(status_code=400, detail=f"Settlement {index}: payer and payee must be different")
+            if item.amount <= 0:
+                raise HTTPException(status_code=400, detail=f"Settlement {index}: amount must be positive")
+
+        # Enforce lock if exists, set it if not
+        if current_method and current_method != settlement_type:
             raise HTTPException(
-                status_code=400, 
+                status_code=400,
                 detail=f"This group is locked to '{current_method}' settlement method. Please use the {current_method} view to settle."
             )
-        
-        # Set lock if not already set
         if not current_method:
             cursor.execute("""
                 UPDATE groups SET settlement_method = %s WHERE id = %s
-            """, (settlement_type, settlement.group_id))
-        
-        # Insert settlement with current settlement_cycle
+            """, (settlement_type, group_id))
+
+        # Insert all settlements with the current settlement_cycle
         settlement_date = datetime.utcnow()
-        cursor.execute("""
-            INSERT INTO settlements (group_id, payer_id, payee_id, amount, notes, settlement_date, settlement_type, settlement_cycle)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (settlement.group_id, settlement.payer_id, settlement.payee_id, 
-              settlement.amount, settlement.notes, settlement_date, settlement_type, current_cycle))
-        
-        settlement_id = cursor.lastrowid
-        
-        # Check if all balances are now zero - if so, reset lock and INCREMENT CYCLE
-        # Only consider expenses and settlements in the CURRENT cycle
-        cursor.execute("""
-            SELECT 
-                u.id as user_id,
-                COALESCE(paid.total_paid, 0) - COALESCE(owed.total_owed, 0) as net_before_settlements
-            FROM users u
-            INNER JOIN group_members gm ON u.id = gm.user_id AND gm.group_id = %s AND gm.is_active = TRUE
-            LEFT JOIN (
-                SELECT paid_by as user_id, SUM(amount) as total_paid
-                FROM expenses WHERE group_id = %s AND COALESCE(settlement_cycle, 1) = %s GROUP BY paid_by
-            ) paid ON paid.user_id = u.id
-            LEFT JOIN (
-                SELECT es.user_id, SUM(es.amount) as total_owed
-                FROM expense_splits es
-                INNER JOIN expenses e ON es.expense_id = e.id
-                WHERE e.group_id = %s AND COALESCE(e.settlement_cycle, 1) = %s GROUP BY es.user_id
-            ) owed ON owed.user_id = u.id
-        """, (settlement.group_id, settlement.group_id, current_cycle, settlement.group_id, current_cycle))
-        
-        net_balances = {row['user_id']: float(row['net_before_settlements']) for row in cursor.fetchall()}
-        
-        # Apply only current cycle settlements to net balances
-        cursor.execute("""
-            SELECT payer_id, payee_id, amount FROM settlements 
-            WHERE group_id = %s AND COALESCE(settlement_cycle, 1) = %s
-        """, (settlement.group_id, current_cycle))
-        
-        for s in cursor.fetchall():
-            payer_id, payee_id, amount = s['payer_id'], s['payee_id'], float(s['amount'])
-            if payer_id in net_balances:
-                net_balances[payer_id] += amount
-            if payee_id in net_balances:
-                net_balances[payee_id] -= amount
-        
-        # Check if all settled (use 0.05 threshold to match mobile/web rounding tolerance)
-        BALANCE_THRESHOLD = 0.05
-        all_settled = all(abs(net) < BALANCE_THRESHOLD for net in net_balances.values())
-        
-        if all_settled:
-            # Reset the settlement method lock AND increment the cycle
-            cursor.execute("""
-                UPDATE groups SET settlement_method = NULL, settlement_cycle = %s WHERE id = %s
-            """, (current_cycle + 1, settlement.group_id))
-        
-        db_conn.commit()
-        
-        return Settlement(
-            id=settlement_id,
-            settlement_date=settlement_date,
-            **settlement.dict()
+        settlement_ids = insert_rows_chunked(
+            cursor,
+            "INSERT INTO settlements (group_id, payer_id, payee_id, amount, notes, settlement_date, settlement_type, settlement_cycle) VALUES ",
+            "(%s, %s, %s, %s, %s, %s, %s, %s)",
+            [(group_id, item.payer_id, item.payee_id, item.amount, item.notes if item.notes is not None else batch.notes,
+              settlement_date, settlement_type, current_cycle) for item in items],
+            owner=("group_id", group_id)
         )
+
+        # Single cycle-close check for the whole plan
+        cycle_closed = close_cycle_if_settled(db_conn, group_id, current_cycle)
+        bump_group_version(cursor, group_id)
+
+        db_conn.commit()
+
+        return {
+            "group_id": group_id,
+            "settlements": [
+                Settlement(
+                    id=settlement_id,
+                    settlement_date=settlement_date,
+                    group_id=group_id,
+                    payer_id=item.payer_id,
+                    payee_id=item.payee_id,
+                    amount=item.amount,
+                    notes=item.notes if item.notes is not None else batch.notes,
+                    settlement_type=settlement_type
+                )
+                for settlement_id, item in zip(settlement_ids, items)
+            ],
+            "cycle_closed": cycle_closed,
+            "settlement_cycle": current_cycle + 1 if cycle_closed else current_cycle
+        }
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
+@api_router.get("/groups/{group_id}/cycles", response_model=Dict[str, Any])
+def get_group_cycles(group_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """
+    Summaries of a group's closed settlement cycles, newest first, served from
+    cycle_snapshots. Cycles closed before snapshots existed are summarized on first request.
+    """
+    require_group_member(db_conn, current_user.id, group_id)
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT settlement_cycle FROM groups WHERE id = %s AND deleted_at IS NULL", (group_id,))
+        group = cursor.fetchone()
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        current_cycle = group['settlement_cycle']
+
+        cursor.execute("SELECT settlement_cycle FROM cycle_snapshots WHERE group_id = %s", (group_id,))
+        missing = set(range(1, current_cycle)) - {row['settlement_cycle'] for row in cursor.fetchall()}
+        if missing:
+            for cycle in sorted(missing):
+                store_cycle_snapshot(cursor, build_cycle_snapshot(cursor, group_id, cycle))
+            db_conn.commit()
+
+        cursor.execute("""
+            SELECT settlement_cycle, closed_at, expense_count, expense_total, settlement_count,
+                   settlement_total, member_totals, settlements, archived_at
+            FROM cycle_snapshots
+            WHERE group_id = %s
+            ORDER BY settlement_cycle DESC
+        """, (group_id,))
+        cycles = cursor.fetchall()
+        for cycle in cycles:
+            cycle['expense_total'] = float(cycle['expense_total'])
+            cycle['settlement_total'] = float(cycle['settlement_total'])
+            cycle['member_totals'] = json.loads(cycle['member_totals'])
+            cycle['settlements'] = json.loads(cycle['settlements'])
+
+        return {"group_id": group_id, "current_cycle": current_cycle, "cycles": cycles}
     except mysql.connector.Error as err:
         db_conn.rollback()
-        raise HTTPException(status_code=400, detail=f"Database error: {err}")
+        raise db_http_error(err)
     finally:
         cursor.close()
 
@@ -1222,21 +2688,19 @@ def get_group_settlements(group_id: int, current_user: User = Depends(get_curren
     cursor = db_conn.cursor(dictionary=True)
     try:
         # Verify user is a member
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM group_members 
-            WHERE group_id = %s AND user_id = %s AND is_active = TRUE
-        """, (group_id, current_user.id))
-        if cursor.fetchone()['count'] == 0:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
+        require_group_member(db_conn, current_user.id, group_id)
         
-        # Get settlements
-        cursor.execute("""
+        # Get settlements, including archived cycles
+        settlements_sql = history_union("""
             SELECT id, group_id, payer_id, payee_id, amount, notes, settlement_date,
                    COALESCE(settlement_type, 'simplified') as settlement_type
-            FROM settlements
+            FROM {settlements}
             WHERE group_id = %s
+        """)
+        cursor.execute(f"""
+            SELECT * FROM ({settlements_sql}) as history
             ORDER BY settlement_date DESC
-        """, (group_id,))
+        """, (group_id,) * len(HISTORY_TABLE_SETS))
         
         settlements = cursor.fetchall()
         return [Settlement(**s) for s in settlements]
@@ -1248,7 +2712,8 @@ def get_all_expenses(current_user: User = Depends(get_current_user), db_conn = D
     """Get all expenses for the current user across all their groups."""
     cursor = db_conn.cursor(dictionary=True)
     try:
-        cursor.execute("""
+        # Archived cycles are included
+        expenses_sql = history_union("""
             SELECT
                 e.id,
                 e.description,
@@ -1258,39 +2723,176 @@ def get_all_expenses(current_user: User = Depends(get_current_user), db_conn = D
                 e.expense_date,
                 g.name as group_name,
                 payer.full_name as paid_by_name
-            FROM expenses e
+            FROM {expenses} e
             INNER JOIN groups g ON e.group_id = g.id
             INNER JOIN group_members gm ON g.id = gm.group_id
             INNER JOIN users payer ON e.paid_by = payer.id
             WHERE gm.user_id = %s AND gm.is_active = TRUE
-            ORDER BY e.expense_date DESC
-        """, (current_user.id,))
+        """)
+        cursor.execute(f"""
+            SELECT * FROM ({expenses_sql}) as history
+            ORDER BY expense_date DESC
+        """, (current_user.id,) * len(HISTORY_TABLE_SETS))
         
         expenses = cursor.fetchall()
         return expenses
     finally:
         cursor.close()
 
+def build_search_query(q: str) -> str:
+    """
+    Turn user input into a BOOLEAN MODE query: every word is required and
+    prefix-matched, and operator characters are dropped.
+    """
+    words = [word for word in re.findall(r"\w+", q.lower()) if len(word) >= SEARCH_MIN_TOKEN_LENGTH]
+    return ' '.join(f"+{word}*" for word in words)
+
+SEARCH_SCORE_RE = re.compile(r"^\d{1,14}(\.\d{1,6})?$")
+
+def encode_search_cursor(row: Dict[str, Any]) -> str:
+    # The score is a fixed-precision DECIMAL kept as its exact text, so the next
+    # page compares against the same value the database ranked by
+    position = {"score": str(row['score']), "type": row['type'], "id": row['id']}
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_search_cursor(cursor_token: str) -> Dict[str, Any]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+        score = str(position['score'])
+        if not SEARCH_SCORE_RE.match(score):
+            raise ValueError(score)
+        return {"score": score, "type": str(position['type']), "id": int(position['id'])}
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/search", response_model=Dict[str, Any])
+def search_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_RESULTS),
+    cursor_token: Optional[str] = Query(None, alias="cursor"),
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Full-text search over expense descriptions/notes and settlement notes in the
+    user's groups, best matches first. Pass next_cursor back as ?cursor= for the
+    next page.
+
+    Uses the MySQL FULLTEXT indexes from migration 010.
+    """
+    search_query = build_search_query(q)
+    if not search_query:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Search needs at least one word of {SEARCH_MIN_TOKEN_LENGTH} or more characters"
+        )
+    position = decode_search_cursor(cursor_token) if cursor_token else None
+
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        group_ids = sorted(membership_index.group_ids(db_conn, current_user.id))
+        if not group_ids:
+            return {"items": [], "next_cursor": None}
+        group_placeholders = ','.join(['%s'] * len(group_ids))
+
+        # Keyset pagination on (score DESC, type ASC, id DESC). The score is
+        # rounded to a fixed-precision DECIMAL so ties compare exactly. Each branch
+        # applies the position and its own LIMIT, so only a few pages' worth of
+        # rows reach the final sort.
+        after_sql = ""
+        after_params: List[Any] = []
+        if position:
+            after_sql = "HAVING score < %s OR (score = %s AND (type > %s OR (type = %s AND id < %s)))"
+            after_params = [position['score'], position['score'], position['type'], position['type'], position['id']]
+
+        # Archived cycles are searched too
+        expense_hits = history_union("""
+                (SELECT
+                    'expense' as type,
+                    e.id,
+                    e.group_id,
+                    g.name as group_name,
+                    e.description,
+                    e.notes,
+                    e.amount,
+                    e.expense_date as date,
+                    payer.full_name as paid_by_name,
+                    NULL as payer_name,
+                    NULL as payee_name,
+                    CAST(MATCH(e.description, e.notes) AGAINST (%s IN BOOLEAN MODE) AS DECIMAL(20, 6)) as score
+                FROM {expenses} e
+                INNER JOIN groups g ON e.group_id = g.id
+                INNER JOIN users payer ON e.paid_by = payer.id
+                WHERE MATCH(e.description, e.notes) AGAINST (%s IN BOOLEAN MODE)
+                  AND e.group_id IN ({group_placeholders})
+                {after_sql}
+                ORDER BY score DESC, id DESC
+                LIMIT %s)
+        """, group_placeholders=group_placeholders, after_sql=after_sql)
+        settlement_hits = history_union("""
+                (SELECT
+                    'settlement' as type,
+                    s.id,
+                    s.group_id,
+                    g.name as group_name,
+                    NULL as description,
+                    s.notes,
+                    s.amount,
+                    s.settlement_date as date,
+                    NULL as paid_by_name,
+                    payer.full_name as payer_name,
+                    payee.full_name as payee_name,
+                    CAST(MATCH(s.notes) AGAINST (%s IN BOOLEAN MODE) AS DECIMAL(20, 6)) as score
+                FROM {settlements} s
+                INNER JOIN groups g ON s.group_id = g.id
+                INNER JOIN users payer ON s.payer_id = payer.id
+                INNER JOIN users payee ON s.payee_id = payee.id
+                WHERE MATCH(s.notes) AGAINST (%s IN BOOLEAN MODE)
+                  AND s.group_id IN ({group_placeholders})
+                {after_sql}
+                ORDER BY score DESC, id DESC
+                LIMIT %s)
+        """, group_placeholders=group_placeholders, after_sql=after_sql)
+        branch_params = [search_query, search_query, *group_ids, *after_params, limit + 1] * len(HISTORY_TABLE_SETS)
+
+        cursor.execute(f"""
+            SELECT * FROM (
+                {expense_hits}
+                UNION ALL
+                {settlement_hits}
+            ) as hits
+            ORDER BY score DESC, type ASC, id DESC
+            LIMIT %s
+        """, [*branch_params, *branch_params, limit + 1])
+        rows = cursor.fetchall()
+
+        items = rows[:limit]
+        next_cursor = encode_search_cursor(items[-1]) if len(rows) > limit else None
+        for item in items:
+            item['score'] = float(item['score'])
+        return {"items": items, "next_cursor": next_cursor}
+    finally:
+        cursor.close()
+
 @api_router.get("/expenses/{expense_id}/splits")
 def get_expense_splits(expense_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
     """Get the split details for a specific expense."""
     cursor = db_conn.cursor(dictionary=True)
     try:
-        # Verify user has access to this expense
-        cursor.execute("""
-            SELECT e.id, e.group_id FROM expenses e
-            INNER JOIN group_members gm ON e.group_id = gm.group_id
-            WHERE e.id = %s AND gm.user_id = %s AND gm.is_active = TRUE
-        """, (expense_id, current_user.id))
+        # Verify user has access to this expense (which may be in an archived cycle)
+        cursor.execute(history_union("""
+            SELECT id, group_id, '{expense_splits}' as splits_table FROM {expenses} WHERE id = %s
+        """), (expense_id,) * len(HISTORY_TABLE_SETS))
         
         expense = cursor.fetchone()
-        if not expense:
+        cursor.fetchall()
+        if not expense or not membership_index.is_member(db_conn, current_user.id, expense['group_id']):
             raise HTTPException(status_code=404, detail="Expense not found or access denied")
         
-        # Get splits
-        cursor.execute("""
+        # Get splits from the table the expense lives in
+        cursor.execute(f"""
             SELECT es.user_id, u.full_name as user_name, es.amount
-            FROM expense_splits es
+            FROM {expense['splits_table']} es
             INNER JOIN users u ON es.user_id = u.id
             WHERE es.expense_id = %s
         """, (expense_id,))
@@ -1300,6 +2902,128 @@ def get_expense_splits(expense_id: int, current_user: User = Depends(get_current
     finally:
         cursor.close()
 
+def fetch_activity_page(cursor, user_id: int, limit: int, offset: int) -> Dict[str, Any]:
+    """One page of expenses and settlements across the user's groups, newest first."""
+    # Limit the maximum items per request
+    limit = min(limit, 50)
+    
+    # First, get the total count without fetching all data
+    # Archived cycles stay part of the feed
+    expense_ids_sql = history_union("""
+            SELECT e.id FROM {expenses} e
+            INNER JOIN group_members gm ON e.group_id = gm.group_id
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+    """)
+    settlement_ids_sql = history_union("""
+            SELECT s.id FROM {settlements} s
+            INNER JOIN group_members gm ON s.group_id = gm.group_id
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+    """)
+    user_params = (user_id,) * (2 * len(HISTORY_TABLE_SETS))
+    cursor.execute(f"""
+        SELECT COUNT(*) as total FROM (
+            {expense_ids_sql}
+            UNION ALL
+            {settlement_ids_sql}
+        ) as combined
+    """, user_params)
+    total_count = cursor.fetchone()['total']
+    
+    # Get combined sorted activities using a subquery with LIMIT and OFFSET
+    expense_rows_sql = history_union("""
+            SELECT
+                e.id,
+                e.description,
+                e.amount,
+                e.expense_date as date,
+                'expense' as type,
+                e.group_id,
+                g.name as group_name,
+                payer.full_name as paid_by_name,
+                e.paid_by as paid_by_user_id,
+                COUNT(DISTINCT es.user_id) as participant_count,
+                NULL as payer_name,
+                NULL as payee_name,
+                NULL as payer_id,
+                NULL as payee_id,
+                NULL as notes
+            FROM {expenses} e
+            INNER JOIN groups g ON e.group_id = g.id
+            INNER JOIN group_members gm ON g.id = gm.group_id
+            INNER JOIN users payer ON e.paid_by = payer.id
+            LEFT JOIN {expense_splits} es ON e.id = es.expense_id
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+            GROUP BY e.id, e.description, e.amount, e.expense_date, e.group_id, 
+                     g.name, payer.full_name, e.paid_by
+    """)
+    settlement_rows_sql = history_union("""
+            SELECT
+                s.id,
+                NULL as description,
+                s.amount,
+                s.settlement_date as date,
+                'settlement' as type,
+                s.group_id,
+                g.name as group_name,
+                NULL as paid_by_name,
+                NULL as paid_by_user_id,
+                NULL as participant_count,
+                payer.full_name as payer_name,
+                payee.full_name as payee_name,
+                s.payer_id,
+                s.payee_id,
+                s.notes
+            FROM {settlements} s
+            INNER JOIN groups g ON s.group_id = g.id
+            INNER JOIN group_members gm ON g.id = gm.group_id
+            INNER JOIN users payer ON s.payer_id = payer.id
+            INNER JOIN users payee ON s.payee_id = payee.id
+            WHERE gm.user_id = %s AND gm.is_active = TRUE
+    """)
+    cursor.execute(f"""
+        SELECT * FROM (
+            {expense_rows_sql}
+            
+            UNION ALL
+            
+            {settlement_rows_sql}
+        ) as combined_activity
+        ORDER BY date DESC
+        LIMIT %s OFFSET %s
+    """, (*user_params, limit, offset))
+    
+    activities = cursor.fetchall()
+    
+    # Participants of every expense on the page in one query
+    expense_ids = [activity['id'] for activity in activities if activity['type'] == 'expense']
+    participants: Dict[int, List[Dict[str, Any]]] = {}
+    if expense_ids:
+        placeholders = ','.join(['%s'] * len(expense_ids))
+        participants_sql = history_union("""
+            SELECT es.expense_id, u.full_name as user_name, es.amount
+            FROM {expense_splits} es
+            INNER JOIN users u ON es.user_id = u.id
+            WHERE es.expense_id IN ({placeholders})
+        """, placeholders=placeholders)
+        cursor.execute(f"""
+            SELECT * FROM ({participants_sql}) as participants
+            ORDER BY user_name
+        """, expense_ids * len(HISTORY_TABLE_SETS))
+        for row in cursor.fetchall():
+            participants.setdefault(row.pop('expense_id'), []).append(row)
+    for activity in activities:
+        if activity['type'] == 'expense':
+            activity['participants'] = participants.get(activity['id'], [])
+    
+    # Return paginated results with metadata
+    return {
+        "items": activities,
+        "total": total_count,
+        "limit": limit,
+        "offset": offset,
+        "has_more": (offset + limit) < total_count
+    }
+
 @api_router.get("/activity")
 def get_activity(
     limit: int = 20, 
@@ -1310,101 +3034,34 @@ def get_activity(
     """Get recent activity (expenses and settlements) for the current user across all groups with pagination."""
     cursor = db_conn.cursor(dictionary=True)
     try:
-        # Limit the maximum items per request
-        limit = min(limit, 50)
-        
-        # First, get the total count without fetching all data
-        cursor.execute("""
-            SELECT COUNT(*) as total FROM (
-                SELECT e.id FROM expenses e
-                INNER JOIN group_members gm ON e.group_id = gm.group_id
-                WHERE gm.user_id = %s AND gm.is_active = TRUE
-                UNION ALL
-                SELECT s.id FROM settlements s
-                INNER JOIN group_members gm ON s.group_id = gm.group_id
-                WHERE gm.user_id = %s AND gm.is_active = TRUE
-            ) as combined
-        """, (current_user.id, current_user.id))
-        total_count = cursor.fetchone()['total']
-        
-        # Get combined sorted activities using a subquery with LIMIT and OFFSET
-        cursor.execute("""
-            SELECT * FROM (
-                SELECT
-                    e.id,
-                    e.description,
-                    e.amount,
-                    e.expense_date as date,
-                    'expense' as type,
-                    e.group_id,
-                    g.name as group_name,
-                    payer.full_name as paid_by_name,
-                    e.paid_by as paid_by_user_id,
-                    COUNT(DISTINCT es.user_id) as participant_count,
-                    NULL as payer_name,
-                    NULL as payee_name,
-                    NULL as payer_id,
-                    NULL as payee_id,
-                    NULL as notes
-                FROM expenses e
-                INNER JOIN groups g ON e.group_id = g.id
-                INNER JOIN group_members gm ON g.id = gm.group_id
-                INNER JOIN users payer ON e.paid_by = payer.id
-                LEFT JOIN expense_splits es ON e.id = es.expense_id
-                WHERE gm.user_id = %s AND gm.is_active = TRUE
-                GROUP BY e.id, e.description, e.amount, e.expense_date, e.group_id, 
-                         g.name, payer.full_name, e.paid_by
-                
-                UNION ALL
-                
-                SELECT
-                    s.id,
-                    NULL as description,
-                    s.amount,
-                    s.settlement_date as date,
-                    'settlement' as type,
-                    s.group_id,
-                    g.name as group_name,
-                    NULL as paid_by_name,
-                    NULL as paid_by_user_id,
-                    NULL as participant_count,
-                    payer.full_name as payer_name,
-                    payee.full_name as payee_name,
-                    s.payer_id,
-                    s.payee_id,
-                    s.notes
-                FROM settlements s
-                INNER JOIN groups g ON s.group_id = g.id
-                INNER JOIN group_members gm ON g.id = gm.group_id
-                INNER JOIN users payer ON s.payer_id = payer.id
-                INNER JOIN users payee ON s.payee_id = payee.id
-                WHERE gm.user_id = %s AND gm.is_active = TRUE
-            ) as combined_activity
-            ORDER BY date DESC
-            LIMIT %s OFFSET %s
-        """, (current_user.id, current_user.id, limit, offset))
-        
-        activities = cursor.fetchall()
-        
-        # For each expense, get the list of participants
-        for activity in activities:
-            if activity['type'] == 'expense':
-                cursor.execute("""
-                    SELECT u.full_name as user_name, es.amount
-                    FROM expense_splits es
-                    INNER JOIN users u ON es.user_id = u.id
-                    WHERE es.expense_id = %s
-                    ORDER BY u.full_name
-                """, (activity['id'],))
-                activity['participants'] = cursor.fetchall()
-        
-        # Return paginated results with metadata
+        return fetch_activity_page(cursor, current_user.id, limit, offset)
+    finally:
+        cursor.close()
+
+@api_router.get("/bootstrap", response_model=Dict[str, Any])
+def get_bootstrap(
+    activity_limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Everything the home screen needs at app launch in one request: profile,
+    groups with members, the user's current-cycle balance in each group,
+    friends and the first activity page. Uses a fixed number of queries on
+    one connection regardless of how many groups the user has.
+    """
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        groups = fetch_user_groups(cursor, current_user.id)
+        group_balances = fetch_user_group_balances(cursor, current_user.id)
         return {
-            "items": activities,
-            "total": total_count,
-            "limit": limit,
-            "offset": offset,
-            "has_more": (offset + limit) < total_count
+            "user": current_user,
+            "groups": [
+                {**group.dict(), "my_balance": group_balances.get(group.id, 0.0)}
+                for group in groups
+            ],
+            "friends": fetch_friends(cursor, current_user.id),
+            "activity": fetch_activity_page(cursor, current_user.id, activity_limit, 0),
         }
     finally:
         cursor.close()
@@ -1475,22 +3132,29 @@ def get_sync_changes(
             group['members'] = cursor.fetchall()
             
             # Get user's balance in this group
-            cursor.execute("""
+            # Archived cycles still count towards the balance
+            paid_sql = history_union("""
+                SELECT amount
+                FROM {expenses}
+                WHERE group_id = %s AND paid_by = %s
+            """)
+            owed_sql = history_union("""
+                SELECT es.amount
+                FROM {expense_splits} es
+                INNER JOIN {expenses} e ON es.expense_id = e.id
+                WHERE e.group_id = %s AND es.user_id = %s
+            """)
+            cursor.execute(f"""
                 SELECT
                     COALESCE(paid.total_paid, 0) - COALESCE(owed.total_owed, 0) as balance
                 FROM (SELECT 1) as dummy
                 LEFT JOIN (
-                    SELECT SUM(amount) as total_paid
-                    FROM expenses
-                    WHERE group_id = %s AND paid_by = %s
+                    SELECT SUM(amount) as total_paid FROM ({paid_sql}) as paid_rows
                 ) paid ON 1=1
                 LEFT JOIN (
-                    SELECT SUM(es.amount) as total_owed
-                    FROM expense_splits es
-                    INNER JOIN expenses e ON es.expense_id = e.id
-                    WHERE e.group_id = %s AND es.user_id = %s
+                    SELECT SUM(amount) as total_owed FROM ({owed_sql}) as owed_rows
                 ) owed ON 1=1
-            """, (group['id'], current_user.id, group['id'], current_user.id))
+            """, (group['id'], current_user.id) * (2 * len(HISTORY_TABLE_SETS)))
             
             balance_result = cursor.fetchone()
             group['balance'] = float(balance_result['balance']) if balance_result else 0.0
@@ -1499,17 +3163,20 @@ def get_sync_changes(
             has_changes = True
         
         # Get expenses modified since timestamp
-        cursor.execute("""
+        modified_sql = history_union("""
             SELECT e.id, e.description, e.amount, e.paid_by as paid_by_user_id,
                    e.group_id, e.expense_date, e.updated_at
-            FROM expenses e
+            FROM {expenses} e
             INNER JOIN group_members gm ON e.group_id = gm.group_id
             WHERE gm.user_id = %s
             AND gm.is_active = TRUE
             AND e.updated_at > %s
-            ORDER BY e.updated_at DESC
+        """)
+        cursor.execute(f"""
+            SELECT * FROM ({modified_sql}) as modified
+            ORDER BY updated_at DESC
             LIMIT 100
-        """, (current_user.id, since_dt))
+        """, (current_user.id, since_dt) * len(HISTORY_TABLE_SETS))
         
         modified_expenses = cursor.fetchall()
         if modified_expenses:
@@ -1532,8 +3199,7 @@ def get_sync_changes(
             has_changes = True
         
         # Get recent activity (last 20 items regardless of timestamp for activity feed)
-        cursor.execute("""
-            SELECT * FROM (
+        recent_expenses_sql = history_union("""
                 SELECT
                     e.id,
                     e.description,
@@ -1549,15 +3215,14 @@ def get_sync_changes(
                     NULL as payer_id,
                     NULL as payee_id,
                     NULL as notes
-                FROM expenses e
+                FROM {expenses} e
                 INNER JOIN groups g ON e.group_id = g.id
                 INNER JOIN group_members gm ON g.id = gm.group_id
                 INNER JOIN users payer ON e.paid_by = payer.id
                 WHERE gm.user_id = %s AND gm.is_active = TRUE
                 AND e.updated_at > %s
-                
-                UNION ALL
-                
+        """)
+        recent_settlements_sql = history_union("""
                 SELECT
                     s.id,
                     NULL as description,
@@ -1573,17 +3238,25 @@ def get_sync_changes(
                     s.payer_id,
                     s.payee_id,
                     s.notes
-                FROM settlements s
+                FROM {settlements} s
                 INNER JOIN groups g ON s.group_id = g.id
                 INNER JOIN group_members gm ON g.id = gm.group_id
                 INNER JOIN users payer ON s.payer_id = payer.id
                 INNER JOIN users payee ON s.payee_id = payee.id
                 WHERE gm.user_id = %s AND gm.is_active = TRUE
                 AND s.updated_at > %s
+        """)
+        cursor.execute(f"""
+            SELECT * FROM (
+                {recent_expenses_sql}
+                
+                UNION ALL
+                
+                {recent_settlements_sql}
             ) as combined_activity
             ORDER BY date DESC
             LIMIT 20
-        """, (current_user.id, since_dt, current_user.id, since_dt))
+        """, (current_user.id, since_dt) * (2 * len(HISTORY_TABLE_SETS)))
         
         recent_activity = cursor.fetchall()
         if recent_activity:
@@ -1597,33 +3270,1818 @@ def get_sync_changes(
     finally:
         cursor.close()
 
-@api_router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
-def register_user_alias(user: UserCreate, db_conn = Depends(get_db_connection)):
-    """Alias endpoint for registration (same as POST /api/users/)."""
-    db_user = get_user_by_email(db_conn, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = create_db_user(db_conn, user)
-    return new_user
+SYNC_MUTATION_MODELS = {'create_expense': ExpenseCreate, 'record_settlement': SettlementCreate}
 
-# --- App Initialization ---
+@retry_on_lock_conflict
+def apply_group_mutations(db_conn, group_id: int, current_user: User, mutations: List[tuple]) -> Dict[str, Dict[str, Any]]:
+    """
+    Apply one group's offline mutations, in order, in a single transaction.
 
-app.include_router(api_router)
+    mutations holds (SyncMutation, parsed model) pairs. Each mutation runs under a
+    savepoint, so one that is rejected is undone without losing the others, and
+    claims its client_id as an idempotency key so a re-uploaded mutation replays
+    its first result. Returns client_id -> result.
+    """
+    results = {}
+    begin_group_write(db_conn)
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        require_group_member(db_conn, current_user.id, group_id)
+        group_row = lock_group_for_write(cursor, group_id)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], # Allow all origins for development
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        applied = 0
+        for mutation, model in mutations:
+            cursor.execute("SAVEPOINT sync_mutation")
+            # apply_settlement updates group_row in place; undo that along with the savepoint
+            group_state = dict(group_row)
+            try:
+                replay = begin_idempotent_request(
+                    cursor, current_user.id, mutation.client_id, f"sync_push:{mutation.type}", model, key_scope='sync'
+                )
+                if replay:
+                    cursor.execute("ROLLBACK TO SAVEPOINT sync_mutation")
+                    results[mutation.client_id] = {
+                        "status": "duplicate", "status_code": replay.status_code, "result": json.loads(replay.body)
+                    }
+                    continue
 
-@app.on_event("shutdown")
-def shutdown_event():
-    """Close the database connection pool on application shutdown."""
-    logging.info("Closing MySQL connection pool.")
-    # The pool itself doesn't have a close method in this version,
-    # connections are closed as they are returned.
+                if mutation.type == 'create_expense':
+                    split_rows = compute_expense_splits(model.split_type, model.amount, model.splits)
+                    created = insert_expense(cursor, model, split_rows, group_row['settlement_cycle'])
+                else:
+                    created = apply_settlement(db_conn, cursor, model, group_row)
+                complete_idempotent_request(
+                    cursor, current_user.id, mutation.client_id, status.HTTP_201_CREATED, created, key_scope='sync'
+                )
+                cursor.execute("RELEASE SAVEPOINT sync_mutation")
+                results[mutation.client_id] = {
+                    "status": "applied", "status_code": status.HTTP_201_CREATED, "result": created
+                }
+                applied += 1
+            except HTTPException as err:
+                cursor.execute("ROLLBACK TO SAVEPOINT sync_mutation")
+                group_row.update(group_state)
+                results[mutation.client_id] = {"status": "rejected", "status_code": err.status_code, "detail": err.detail}
+            except mysql.connector.Error as err:
+                if is_lock_conflict(err):
+                    raise  # the whole group is retried by retry_on_lock_conflict
+                cursor.execute("ROLLBACK TO SAVEPOINT sync_mutation")
+                group_row.update(group_state)
+                error = db_http_error(err)
+                results[mutation.client_id] = {"status": "rejected", "status_code": error.status_code, "detail": error.detail}
+
+        if applied:
+            bump_group_version(cursor, group_id)
+        db_conn.commit()
+        return results
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        if is_lock_conflict(err):
+            raise  # retried by retry_on_lock_conflict
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
+@api_router.post("/sync/push", response_model=Dict[str, Any])
+def push_sync_mutations(
+    push: SyncPush,
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Upload expenses and settlements queued offline, in the order they were made.
+
+    Mutations are applied group by group, one transaction per group, and get one
+    result each (applied, duplicate or rejected) in request order. The response
+    also carries the changes since push.since and the new sync cursor, exactly as
+    GET /sync/changes would return them.
+    """
+    if len(push.mutations) > MAX_SYNC_PUSH_MUTATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SYNC_PUSH_MUTATIONS} mutations per push")
+    client_ids = [mutation.client_id for mutation in push.mutations]
+    if len(set(client_ids)) != len(client_ids):
+        raise HTTPException(status_code=400, detail="client_id values must be unique within a push")
+
+    # Validate every mutation and bucket it by group, keeping the client's order within a group
+    results = {}
+    by_group: Dict[int, List[tuple]] = {}
+    for mutation in push.mutations:
+        model_class = SYNC_MUTATION_MODELS.get(mutation.type)
+        if model_class is None:
+            results[mutation.client_id] = {
+                "status": "rejected", "status_code": 400,
+                "detail": f"Unknown mutation type '{mutation.type}'. Must be one of {sorted(SYNC_MUTATION_MODELS)}"
+            }
+            continue
+        try:
+            model = model_class(**mutation.data)
+        except ValidationError as err:
+            detail = "; ".join(f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']}" for e in err.errors())
+            results[mutation.client_id] = {"status": "rejected", "status_code": 422, "detail": detail}
+            continue
+        if model.group_id is None:
+            results[mutation.client_id] = {"status": "rejected", "status_code": 422, "detail": "group_id is required"}
+            continue
+        by_group.setdefault(model.group_id, []).append((mutation, model))
+
+    for group_id, mutations in by_group.items():
+        try:
+            results.update(apply_group_mutations(db_conn, group_id, current_user, mutations))
+        except HTTPException as err:
+            # The group itself was refused (not found, not a member, busy): nothing in it was applied
+            for mutation, _ in mutations:
+                results[mutation.client_id] = {"status": "rejected", "status_code": err.status_code, "detail": err.detail}
+
+    sync = get_sync_changes(since=push.since, current_user=current_user, db_conn=db_conn)
+    return {
+        "results": [{"client_id": client_id, **results[client_id]} for client_id in client_ids],
+        **sync,
+    }
+
+# --- Spending Analytics ---
+
+# expense_rollups holds one row per (group, month, category, member) with what the
+# member paid and their share of expenses. Uncategorized expenses use category ''.
+ROLLUP_UPSERT_SQL = "INSERT INTO expense_rollups (group_id, month, category, user_id, paid_amount, share_amount, expenses_paid) VALUES "
+ROLLUP_UPSERT_UPDATE_SQL = """
+    paid_amount = paid_amount + VALUES(paid_amount),
+    share_amount = share_amount + VALUES(share_amount),
+    expenses_paid = expenses_paid + VALUES(expenses_paid)
+"""
+
+def record_expense_rollups(cursor, group_id: int, expenses) -> None:
+    """
+    Add newly written expenses to expense_rollups, in the caller's transaction.
+    expenses: iterable of (expense_date, category, paid_by, amount, split_rows).
+    """
+    totals = {}
+    for expense_date, category, paid_by, amount, split_rows in expenses:
+        month = expense_date.date().replace(day=1)
+        category = category or ''
+        paid = totals.setdefault((month, category, paid_by), [0.0, 0.0, 0])
+        paid[0] += amount
+        paid[2] += 1
+        for user_id, share in split_rows:
+            totals.setdefault((month, category, user_id), [0.0, 0.0, 0])[1] += share
+
+    rows = [
+        (group_id, month, category, user_id, round(paid, 2), round(share, 2), count)
+        for (month, category, user_id), (paid, share, count) in totals.items()
+    ]
+    upsert_rows_chunked(cursor, ROLLUP_UPSERT_SQL, "(%s, %s, %s, %s, %s, %s, %s)", rows, ROLLUP_UPSERT_UPDATE_SQL)
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def query_spending_stats(cursor, scope: str, scope_id: int, start: date, end: date) -> List[Dict[str, Any]]:
+    """
+    Spending rows (month, category, group_id, user_id, paid, share, expenses) for a
+    group (scope='group') or a member across groups (scope='user') over [start, end].
+
+    Months fully inside the range are read from expense_rollups; only the partial
+    months at the edges of the range (usually just the current month) are
+    aggregated from expenses/expense_splits.
+    """
+    rollup_filter = "r.group_id = %s" if scope == 'group' else "r.user_id = %s"
+    paid_filter = "e.group_id = %s" if scope == 'group' else "e.paid_by = %s"
+    share_filter = "e.group_id = %s" if scope == 'group' else "es.user_id = %s"
+
+    end_exclusive = end + timedelta(days=1)
+    first_full_month = start if start.day == 1 else _next_month(start)
+    # Month after the last fully covered month
+    full_months_end = _month_start(end_exclusive)
+
+    rows = []
+    if first_full_month < full_months_end:
+        cursor.execute(f"""
+            SELECT r.month, r.category, r.group_id, r.user_id,
+                   r.paid_amount as paid, r.share_amount as share, r.expenses_paid as expenses
+            FROM expense_rollups r
+            WHERE {rollup_filter} AND r.month >= %s AND r.month < %s
+        """, (scope_id, first_full_month, full_months_end))
+        rows.extend(cursor.fetchall())
+
+    # Partial months at either edge of the range come from the detail tables
+    partial_slices = []
+    if first_full_month >= full_months_end:
+        partial_slices.append((start, end_exclusive))
+    else:
+        if start < first_full_month:
+            partial_slices.append((start, first_full_month))
+        if full_months_end < end_exclusive:
+            partial_slices.append((full_months_end, end_exclusive))
+
+    for slice_start, slice_end in partial_slices:
+        month = _month_start(slice_start)
+        # An edge month can lie in a closed cycle that was already archived
+        paid_sql = history_union("""
+            SELECT COALESCE(e.category, '') as category, e.group_id, e.paid_by as user_id,
+                   SUM(e.amount) as paid, 0 as share, COUNT(*) as expenses
+            FROM {expenses} e
+            WHERE {paid_filter} AND e.expense_date >= %s AND e.expense_date < %s
+            GROUP BY COALESCE(e.category, ''), e.group_id, e.paid_by
+        """, paid_filter=paid_filter)
+        share_sql = history_union("""
+            SELECT COALESCE(e.category, '') as category, e.group_id, es.user_id,
+                   0 as paid, SUM(es.amount) as share, 0 as expenses
+            FROM {expense_splits} es
+            INNER JOIN {expenses} e ON es.expense_id = e.id
+            WHERE {share_filter} AND e.expense_date >= %s AND e.expense_date < %s
+            GROUP BY COALESCE(e.category, ''), e.group_id, es.user_id
+        """, share_filter=share_filter)
+        slice_params = (scope_id, slice_start, slice_end) * len(HISTORY_TABLE_SETS)
+        cursor.execute(f"""
+            {paid_sql}
+            UNION ALL
+            {share_sql}
+        """, slice_params * 2)
+        for row in cursor.fetchall():
+            row['month'] = month
+            rows.append(row)
+
+    return rows
+
+def summarize_spending(rows: List[Dict[str, Any]], group_by: List[str]) -> Dict[str, Any]:
+    """Aggregate spending rows over the requested dimensions."""
+    dimension_columns = {'month': 'month', 'category': 'category', 'member': 'user_id', 'group': 'group_id'}
+    buckets = {}
+    totals = {'paid': 0.0, 'share': 0.0, 'expenses': 0}
+    for row in rows:
+        key = tuple(row[dimension_columns[dim]] for dim in group_by)
+        bucket = buckets.setdefault(key, {'paid': 0.0, 'share': 0.0, 'expenses': 0})
+        for field in totals:
+            bucket[field] += row[field] if field == 'expenses' else float(row[field])
+            totals[field] += row[field] if field == 'expenses' else float(row[field])
+
+    result_rows = []
+    for key in sorted(buckets, key=lambda k: tuple(str(part) for part in k)):
+        entry = {}
+        for dim, value in zip(group_by, key):
+            if dim == 'month':
+                entry['month'] = value.strftime('%Y-%m')
+            elif dim == 'category':
+                entry['category'] = value or None
+            else:
+                entry[dimension_columns[dim]] = value
+        bucket = buckets[key]
+        entry.update(paid=round(bucket['paid'], 2), share=round(bucket['share'], 2), expenses=int(bucket['expenses']))
+        result_rows.append(entry)
+
+    return {
+        "totals": {"paid": round(totals['paid'], 2), "share": round(totals['share'], 2), "expenses": int(totals['expenses'])},
+        "rows": result_rows
+    }
+
+def parse_stats_range(start: Optional[date], end: Optional[date], group_by: str, allowed: List[str]):
+    dimensions = [dim.strip() for dim in group_by.split(',') if dim.strip()]
+    invalid = [dim for dim in dimensions if dim not in allowed]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by {invalid}. Allowed: {allowed}")
+    end = end or datetime.utcnow().date()
+    start = start or _month_start(end)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end, dimensions
+
+def rebuild_expense_rollups(db_conn, group_id: int) -> int:
+    """
+    Recompute a group's expense_rollups from its expenses and splits.
+    Aggregation runs as a pandas/NumPy batch over the whole history.
+    Returns the number of rollup rows written.
+    """
+    # Only the rebuild path needs pandas, so keep it out of the import-time cost
+    import numpy as np
+    import pandas as pd
+
+    cursor = db_conn.cursor()
+    try:
+        # Archived cycles still count towards the group's history
+        cursor.execute("""
+            SELECT e.expense_date, COALESCE(e.category, ''), e.paid_by, e.amount
+            FROM expenses e WHERE e.group_id = %s
+            UNION ALL
+            SELECT e.expense_date, COALESCE(e.category, ''), e.paid_by, e.amount
+            FROM expenses_archive e WHERE e.group_id = %s
+        """, (group_id, group_id))
+        paid = pd.DataFrame(cursor.fetchall(), columns=['expense_date', 'category', 'user_id', 'amount'])
+        cursor.execute("""
+            SELECT e.expense_date, COALESCE(e.category, ''), es.user_id, es.amount
+            FROM expense_splits es
+            INNER JOIN expenses e ON es.expense_id = e.id
+            WHERE e.group_id = %s
+            UNION ALL
+            SELECT e.expense_date, COALESCE(e.category, ''), es.user_id, es.amount
+            FROM expense_splits_archive es
+            INNER JOIN expenses_archive e ON es.expense_id = e.id
+            WHERE e.group_id = %s
+        """, (group_id, group_id))
+        shares = pd.DataFrame(cursor.fetchall(), columns=['expense_date', 'category', 'user_id', 'amount'])
+
+        keys = ['month', 'category', 'user_id']
+        for frame in (paid, shares):
+            frame['month'] = pd.to_datetime(frame['expense_date']).dt.to_period('M').dt.to_timestamp()
+            # Sum in integer cents to avoid float drift over long histories
+            frame['cents'] = np.rint(frame['amount'].astype(float) * 100).astype(np.int64)
+
+        paid_totals = paid.groupby(keys).agg(paid_cents=('cents', 'sum'), expenses_paid=('cents', 'size'))
+        share_totals = shares.groupby(keys).agg(share_cents=('cents', 'sum'))
+        rollups = paid_totals.join(share_totals, how='outer').fillna(0).reset_index()
+
+        rows = [
+            (group_id, month.date(), category, int(user_id), int(paid_cents) / 100, int(share_cents) / 100, int(expenses_paid))
+            for month, category, user_id, paid_cents, expenses_paid, share_cents in rollups[
+                ['month', 'category', 'user_id', 'paid_cents', 'expenses_paid', 'share_cents']
+            ].itertuples(index=False, name=None)
+        ]
+
+        cursor.execute("DELETE FROM expense_rollups WHERE group_id = %s", (group_id,))
+        insert_rows_chunked(cursor, ROLLUP_UPSERT_SQL, "(%s, %s, %s, %s, %s, %s, %s)", rows)
+        db_conn.commit()
+        return len(rows)
+    except mysql.connector.Error:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@api_router.get("/groups/{group_id}/stats", response_model=Dict[str, Any])
+def get_group_stats(
+    group_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = 'month,category',
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    Spending totals for a group between start and end (inclusive dates, default:
+    the current month), grouped by any of month, category and member.
+    'paid' is what was paid out, 'share' is what members owe for those expenses.
+    """
+    start, end, dimensions = parse_stats_range(start, end, group_by, ['month', 'category', 'member'])
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        # Check if user is a member
+        require_group_member(db_conn, current_user.id, group_id)
+
+        rows = query_spending_stats(cursor, 'group', group_id, start, end)
+        return {"group_id": group_id, "start": start, "end": end, "group_by": dimensions, **summarize_spending(rows, dimensions)}
+    finally:
+        cursor.close()
+
+@api_router.get("/users/me/stats", response_model=Dict[str, Any])
+def get_user_stats(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = 'month,category',
+    current_user: User = Depends(get_current_user),
+    db_conn = Depends(get_db_connection)
+):
+    """
+    The current user's own spending between start and end, grouped by any of
+    month, category and group. 'share' is the user's part of each expense.
+    """
+    start, end, dimensions = parse_stats_range(start, end, group_by, ['month', 'category', 'group'])
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        rows = query_spending_stats(cursor, 'user', current_user.id, start, end)
+        return {"user_id": current_user.id, "start": start, "end": end, "group_by": dimensions, **summarize_spending(rows, dimensions)}
+    finally:
+        cursor.close()
+
+@api_router.post("/groups/{group_id}/stats/rebuild", response_model=Dict[str, Any], status_code=status.HTTP_202_ACCEPTED)
+def rebuild_group_stats(group_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """Queue a rebuild of a group's spending rollups from its full expense history (backfill)."""
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        # Check if user is a member
+        require_group_member(db_conn, current_user.id, group_id)
+
+        job_id = enqueue_job(cursor, 'rebuild_rollups', {"group_id": group_id}, created_by=current_user.id)
+        db_conn.commit()
+        return {"group_id": group_id, "job_id": job_id, "status_url": f"/api/jobs/{job_id}"}
+    except mysql.connector.Error as err:
+        db_conn.rollback()
+        raise db_http_error(err)
+    finally:
+        cursor.close()
+
+# --- Ledger Export ---
+
+LEDGER_EXPORT_COLUMNS = [
+    'record_type', 'group_id', 'group_name', 'settlement_cycle', 'id', 'date',
+    'description', 'amount', 'payer_id', 'payer_name', 'payee_id', 'payee_name',
+    'user_id', 'user_name', 'share_amount', 'notes', 'settlement_type', 'closed'
+]
+
+class LedgerRows:
+    """
+    Ledger rows (expenses joined with their splits, plus settlements, including
+    archived cycles) ordered by group, settlement cycle and date, read through one
+    unbuffered server-side cursor.
+
+    The endpoint checks the connection out and starts the query before the response
+    begins, so an unavailable database is still a 503 rather than a 200 with a
+    truncated body. The rows are streamed after request-scoped dependencies have
+    been cleaned up; close() hands the connection back and runs as the response's
+    background task, or when iteration ends, whichever comes first.
+    """
+
+    def __init__(self, connection, deadline: Optional["RequestDeadline"], scope_sql: str, scope_params: tuple,
+                 cycle_from: Optional[int], cycle_to: Optional[int]):
+        """scope_sql restricts the group_id column, e.g. "= %s" or "IN (SELECT ...)"."""
+        self.connection = connection
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._closed = False
+        query, params = ledger_query(scope_sql, scope_params, cycle_from, cycle_to)
+        self.cursor = connection.cursor(dictionary=True)
+        self.cursor.execute(query, params)
+
+    def __iter__(self):
+        try:
+            while True:
+                rows = self.cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.connection.unread_result:
+            # The client went away mid-stream: drop the session rather than
+            # pull the rest of the result over the wire just to reuse it
+            discard_db_connection(self.connection, self.deadline)
+            return
+        try:
+            self.cursor.close()
+        except mysql.connector.Error:
+            pass
+        release_db_connection(self.connection, self.deadline)
+
+def ledger_query(scope_sql: str, scope_params: tuple, cycle_from: Optional[int], cycle_to: Optional[int]):
+    """The ledger export query and its parameters; see LedgerRows."""
+    cycle_filter = ""
+    cycle_params = ()
+    if cycle_from is not None:
+        cycle_filter += " AND {alias}.settlement_cycle >= %s"
+        cycle_params += (cycle_from,)
+    if cycle_to is not None:
+        cycle_filter += " AND {alias}.settlement_cycle <= %s"
+        cycle_params += (cycle_to,)
+
+    expense_select = """
+            SELECT
+                'expense' as record_type,
+                e.group_id,
+                g.name as group_name,
+                g.settlement_cycle as current_cycle,
+                e.settlement_cycle,
+                e.expense_date as date,
+                e.id,
+                e.description,
+                e.amount,
+                e.paid_by as payer_id,
+                payer.full_name as payer_name,
+                NULL as payee_id,
+                NULL as payee_name,
+                es.user_id,
+                ower.full_name as user_name,
+                es.amount as share_amount,
+                e.notes,
+                NULL as settlement_type
+            FROM {expenses} e
+            INNER JOIN groups g ON e.group_id = g.id
+            INNER JOIN users payer ON e.paid_by = payer.id
+            LEFT JOIN {expense_splits} es ON e.id = es.expense_id
+            LEFT JOIN users ower ON es.user_id = ower.id
+            WHERE e.group_id {scope_sql}{cycle_filter}
+    """
+    settlement_select = """
+            SELECT
+                'settlement' as record_type,
+                s.group_id,
+                g.name as group_name,
+                g.settlement_cycle as current_cycle,
+                s.settlement_cycle,
+                s.settlement_date as date,
+                s.id,
+                NULL as description,
+                s.amount,
+                s.payer_id,
+                payer.full_name as payer_name,
+                s.payee_id,
+                payee.full_name as payee_name,
+                NULL as user_id,
+                NULL as user_name,
+                NULL as share_amount,
+                s.notes,
+                COALESCE(s.settlement_type, 'simplified') as settlement_type
+            FROM {settlements} s
+            INNER JOIN groups g ON s.group_id = g.id
+            INNER JOIN users payer ON s.payer_id = payer.id
+            INNER JOIN users payee ON s.payee_id = payee.id
+            WHERE s.group_id {scope_sql}{cycle_filter}
+    """
+    # Active rows plus the closed cycles moved to the archive tables
+    selects = [
+        expense_select.format(expenses=expenses, expense_splits=splits, scope_sql=scope_sql,
+                              cycle_filter=cycle_filter.format(alias='e'))
+        for expenses, splits in (("expenses", "expense_splits"), ("expenses_archive", "expense_splits_archive"))
+    ] + [
+        settlement_select.format(settlements=settlements, scope_sql=scope_sql,
+                                 cycle_filter=cycle_filter.format(alias='s'))
+        for settlements in ("settlements", "settlements_archive")
+    ]
+    query = f"""
+        SELECT * FROM (
+            {" UNION ALL ".join(selects)}
+        ) as ledger
+        ORDER BY group_id, settlement_cycle, date, record_type, id
+    """
+    return query, (scope_params + cycle_params) * len(selects)
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is not None and not isinstance(value, (int, str)):
+        return float(value)  # DECIMAL columns
+    return value
+
+def iter_ledger_records(rows):
+    """
+    Turn flat ledger rows into export records: a 'cycle' marker at each
+    (group, cycle) boundary, one 'expense' record per expense carrying its splits,
+    and one 'settlement' record per payment. Memory use is bounded by one expense.
+    """
+    current_cycle_key = None
+    expense = None
+    for row in rows:
+        cycle_key = (row['group_id'], row['settlement_cycle'])
+        is_same_expense = (expense is not None and row['record_type'] == 'expense'
+                           and row['id'] == expense['id'])
+        if expense is not None and not is_same_expense:
+            yield expense
+            expense = None
+
+        if cycle_key != current_cycle_key:
+            current_cycle_key = cycle_key
+            yield {
+                'record_type': 'cycle',
+                'group_id': row['group_id'],
+                'group_name': row['group_name'],
+                'settlement_cycle': row['settlement_cycle'],
+                'closed': row['settlement_cycle'] < row['current_cycle']
+            }
+
+        if row['record_type'] == 'expense':
+            if expense is None:
+                expense = {
+                    'record_type': 'expense',
+                    'group_id': row['group_id'],
+                    'group_name': row['group_name'],
+                    'settlement_cycle': row['settlement_cycle'],
+                    'id': row['id'],
+                    'date': _export_value(row['date']),
+                    'description': row['description'],
+                    'amount': _export_value(row['amount']),
+                    'payer_id': row['payer_id'],
+                    'payer_name': row['payer_name'],
+                    'notes': row['notes'],
+                    'splits': []
+                }
+            if row['user_id'] is not None:
+                expense['splits'].append({
+                    'user_id': row['user_id'],
+                    'user_name': row['user_name'],
+                    'amount': _export_value(row['share_amount'])
+                })
+        else:
+            yield {
+                'record_type': 'settlement',
+                'group_id': row['group_id'],
+                'group_name': row['group_name'],
+                'settlement_cycle': row['settlement_cycle'],
+                'id': row['id'],
+                'date': _export_value(row['date']),
+                'amount': _export_value(row['amount']),
+                'payer_id': row['payer_id'],
+                'payer_name': row['payer_name'],
+                'payee_id': row['payee_id'],
+                'payee_name': row['payee_name'],
+                'notes': row['notes'],
+                'settlement_type': row['settlement_type']
+            }
+
+    if expense is not None:
+        yield expense
+
+def iter_ledger_ndjson(records):
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+def iter_ledger_csv(records):
+    """CSV rendering: splits become 'split' rows following their expense row."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=LEDGER_EXPORT_COLUMNS, extrasaction='ignore')
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return value
+
+    writer.writeheader()
+    yield flush()
+    for record in records:
+        writer.writerow(record)
+        if record['record_type'] == 'expense':
+            for split in record['splits']:
+                writer.writerow({
+                    'record_type': 'split',
+                    'group_id': record['group_id'],
+                    'group_name': record['group_name'],
+                    'settlement_cycle': record['settlement_cycle'],
+                    'id': record['id'],
+                    'date': record['date'],
+                    'user_id': split['user_id'],
+                    'user_name': split['user_name'],
+                    'share_amount': split['amount']
+                })
+        yield flush()
+
+def ledger_export_response(rows: LedgerRows, export_format: str, filename: str):
+    records = iter_ledger_records(rows)
+    # Also runs when the client disconnects before the body is finished
+    release = BackgroundTask(rows.close)
+    if export_format == 'ndjson':
+        return StreamingResponse(
+            iter_ledger_ndjson(records),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'},
+            background=release
+        )
+    return StreamingResponse(
+        iter_ledger_csv(records),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        background=release
+    )
+
+def start_ledger_export(current_user: User, group_id: Optional[int], export_format: str,
+                        cycle_from: Optional[int], cycle_to: Optional[int]):
+    """Check out a connection, authorize and start the export query, then stream it."""
+    deadline = current_deadline.get()
+    connection = checkout_db_connection(deadline)
+    try:
+        if group_id is not None:
+            # Check if user is a member
+            require_group_member(connection, current_user.id, group_id)
+            rows = LedgerRows(connection, deadline, "= %s", (group_id,), cycle_from, cycle_to)
+            filename = f"hisab-group-{group_id}-ledger"
+        else:
+            rows = LedgerRows(
+                connection, deadline,
+                "IN (SELECT group_id FROM group_members WHERE user_id = %s AND is_active = TRUE)",
+                (current_user.id,), cycle_from, cycle_to
+            )
+            filename = f"hisab-user-{current_user.id}-ledger"
+    except mysql.connector.Error as err:
+        release_db_connection(connection, deadline)
+        raise db_http_error(err)
+    except BaseException:
+        release_db_connection(connection, deadline)
+        raise
+    return ledger_export_response(rows, export_format, filename)
+
+@api_router.get("/groups/{group_id}/export")
+def export_group_ledger(
+    group_id: int,
+    export_format: str = Query('csv', alias='format', pattern='^(csv|ndjson)$'),
+    cycle_from: Optional[int] = None,
+    cycle_to: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream a group's ledger (expenses with splits, settlements and cycle boundaries)
+    as CSV or NDJSON. cycle_from/cycle_to select a range of settlement cycles.
+    """
+    return start_ledger_export(current_user, group_id, export_format, cycle_from, cycle_to)
+
+@api_router.get("/users/me/export")
+def export_user_ledger(
+    export_format: str = Query('csv', alias='format', pattern='^(csv|ndjson)$'),
+    cycle_from: Optional[int] = None,
+    cycle_to: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream the ledgers of every group the current user belongs to as CSV or NDJSON.
+    cycle_from/cycle_to apply to each group's settlement cycles.
+    """
+    return start_ledger_export(current_user, None, export_format, cycle_from, cycle_to)
+
+# --- Background Jobs ---
+#
+# Jobs are rows in the `jobs` table, so they survive restarts and can be picked up
+# by any worker process. Each process runs one JobRunner thread that claims jobs
+# with SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8.0.1+ / MariaDB 10.6+) and holds a
+# lease (locked_until) while working. A job whose worker died is reclaimed once its
+# lease expires. Failed attempts are retried with exponential backoff.
+
+JOB_RUNNER_ENABLED = os.environ.get("JOB_RUNNER_ENABLED", "true").lower() == "true"
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get("JOB_POLL_INTERVAL_SECONDS", "2"))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "300"))
+JOB_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+GROUP_PURGE_BATCH_SIZE = int(os.environ.get("GROUP_PURGE_BATCH_SIZE", "500"))
+# Moving closed cycles' detail rows to the archive tables is opt-in
+CYCLE_ARCHIVE_ENABLED = os.environ.get("CYCLE_ARCHIVE_ENABLED", "false").lower() == "true"
+CYCLE_ARCHIVE_AFTER_DAYS = int(os.environ.get("CYCLE_ARCHIVE_AFTER_DAYS", "30"))
+CYCLE_ARCHIVE_BATCH_SIZE = int(os.environ.get("CYCLE_ARCHIVE_BATCH_SIZE", "500"))
+
+JOB_HANDLERS: Dict[str, Callable[['JobContext'], Any]] = {}
+
+# Maintenance tasks the runner calls on a fixed interval: (interval_seconds, fn(db_conn))
+PERIODIC_TASKS: List[tuple] = []
+
+def periodic_task(interval_seconds: float):
+    """Register a maintenance function the job runner calls every interval_seconds."""
+    def decorator(task):
+        PERIODIC_TASKS.append((interval_seconds, task))
+        return task
+    return decorator
+
+def job_handler(job_type: str):
+    """Register a function as the handler for a job type."""
+    def register(handler):
+        JOB_HANDLERS[job_type] = handler
+        return handler
+    return register
+
+def enqueue_job(cursor, job_type: str, payload: Dict[str, Any], created_by: Optional[int] = None,
+                max_attempts: int = 5, delay_seconds: int = 0) -> int:
+    """Queue a job in the caller's transaction; it becomes visible on commit and runs after delay_seconds."""
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    cursor.execute("""
+        INSERT INTO jobs (job_type, payload, created_by, max_attempts, run_after)
+        VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+    """, (job_type, json.dumps(payload), created_by, max_attempts, delay_seconds))
+    return cursor.lastrowid
+
+class JobContext:
+    """What a job handler gets: its payload, saved progress and a connection."""
+
+    def __init__(self, db_conn, job: Dict[str, Any]):
+        self.db_conn = db_conn
+        self.job_id = job['id']
+        self.payload = json.loads(job['payload'] or '{}')
+        self.progress = json.loads(job['progress']) if job['progress'] else None
+
+    def checkpoint(self, progress: Dict[str, Any]) -> None:
+        """Save progress and extend the lease, then commit the handler's batch with it."""
+        self.progress = progress
+        cursor = self.db_conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE jobs SET progress = %s, locked_until = NOW() + INTERVAL %s SECOND WHERE id = %s
+            """, (json.dumps(progress), JOB_LEASE_SECONDS, self.job_id))
+        finally:
+            cursor.close()
+        self.db_conn.commit()
+
+def claim_next_job(db_conn) -> Optional[Dict[str, Any]]:
+    """Lease the next runnable job (queued and due, or running with an expired lease)."""
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id, job_type, payload, progress, attempts, max_attempts
+            FROM jobs
+            WHERE (status = 'queued' AND run_after <= NOW())
+               OR (status = 'running' AND locked_until < NOW())
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        job = cursor.fetchone()
+        if job:
+            cursor.execute("""
+                UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                    locked_until = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+            """, (JOB_WORKER_ID, JOB_LEASE_SECONDS, job['id']))
+            job['attempts'] += 1
+        db_conn.commit()
+        return job
+    finally:
+        cursor.close()
+
+def run_job(db_conn, job: Dict[str, Any]) -> None:
+    """Run a claimed job and record its outcome, scheduling a retry on failure."""
+    cursor = db_conn.cursor()
+    try:
+        handler = JOB_HANDLERS.get(job['job_type'])
+        if handler is None:
+            raise ValueError(f"No handler for job type {job['job_type']}")
+        result = handler(JobContext(db_conn, job))
+        cursor.execute("""
+            UPDATE jobs SET status = 'succeeded', result = %s, last_error = NULL, locked_by = NULL, locked_until = NULL
+            WHERE id = %s
+        """, (json.dumps(result, default=str), job['id']))
+        db_conn.commit()
+    except Exception as err:
+        logging.exception(f"Job {job['id']} ({job['job_type']}) failed on attempt {job['attempts']}")
+        db_conn.rollback()
+        if job['attempts'] >= job['max_attempts']:
+            cursor.execute("""
+                UPDATE jobs SET status = 'failed', last_error = %s, locked_by = NULL, locked_until = NULL WHERE id = %s
+            """, (str(err), job['id']))
+        else:
+            backoff_seconds = min(300, 5 * 2 ** (job['attempts'] - 1))
+            cursor.execute("""
+                UPDATE jobs SET status = 'queued', last_error = %s, locked_by = NULL, locked_until = NULL,
+                       run_after = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+            """, (str(err), backoff_seconds, job['id']))
+        db_conn.commit()
+    finally:
+        cursor.close()
+
+class JobRunner:
+    """Background thread that polls for jobs and runs them one at a time."""
+
+    def __init__(self, poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._periodic_last_run: Dict[Callable, float] = {}
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hisab-job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> bool:
+        """Claim and run one job. Returns False when there was nothing to do."""
+        connection = db_pool.get_connection()
+        try:
+            job = claim_next_job(connection)
+            if not job:
+                return False
+            run_job(connection, job)
+            return True
+        finally:
+            connection.close()
+
+    def run_periodic_tasks(self) -> None:
+        """Run any periodic task whose interval has elapsed."""
+        now = time.monotonic()
+        for interval_seconds, task in PERIODIC_TASKS:
+            last_run = self._periodic_last_run.get(task)
+            if last_run is not None and now - last_run < interval_seconds:
+                continue
+            self._periodic_last_run[task] = now
+            connection = db_pool.get_connection()
+            try:
+                task(connection)
+            except Exception:
+                logging.exception(f"Periodic task {task.__name__} failed")
+                connection.rollback()
+            finally:
+                connection.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.run_periodic_tasks()
+            try:
+                ran_job = self.run_once()
+            except Exception:
+                logging.exception("Job runner iteration failed")
+                ran_job = False
+            if not ran_job:
+                self._stop.wait(self.poll_interval)
+
+job_runner = JobRunner()
+
+@periodic_task(3600)
+def purge_expired_idempotency_keys(db_conn) -> None:
+    """Delete expired Idempotency-Key records in small batches."""
+    cursor = db_conn.cursor()
+    try:
+        while True:
+            cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW() LIMIT 1000")
+            deleted = cursor.rowcount
+            db_conn.commit()
+            if deleted < 1000:
+                break
+    finally:
+        cursor.close()
+
+@job_handler('delete_group')
+def purge_deleted_group(ctx: JobContext) -> Dict[str, Any]:
+    """
+    Purge a soft-deleted group in small committed batches so row locks on
+    expense_splits/expenses are held only briefly. Safe to resume after a crash.
+    """
+    group_id = ctx.payload['group_id']
+    deleted = ctx.progress or {"expense_splits": 0, "expenses": 0, "settlements": 0, "members": 0}
+    batch_size = GROUP_PURGE_BATCH_SIZE
+    cursor = ctx.db_conn.cursor()
+    try:
+        # Expenses and their splits, a batch of expenses at a time, active rows then archived ones
+        for expenses_table, splits_table in (("expenses", "expense_splits"), ("expenses_archive", "expense_splits_archive")):
+            while True:
+                cursor.execute(f"SELECT id FROM {expenses_table} WHERE group_id = %s ORDER BY id LIMIT %s", (group_id, batch_size))
+                expense_ids = [row[0] for row in cursor.fetchall()]
+                if not expense_ids:
+                    break
+                placeholders = ','.join(['%s'] * len(expense_ids))
+                cursor.execute(f"DELETE FROM {splits_table} WHERE expense_id IN ({placeholders})", expense_ids)
+                deleted['expense_splits'] += cursor.rowcount
+                cursor.execute(f"DELETE FROM {expenses_table} WHERE id IN ({placeholders})", expense_ids)
+                deleted['expenses'] += cursor.rowcount
+                ctx.checkpoint(deleted)
+
+        for table, counter in (("settlements", "settlements"), ("settlements_archive", "settlements"),
+                               ("expense_rollups", None), ("group_members", "members")):
+            while True:
+                cursor.execute(f"DELETE FROM {table} WHERE group_id = %s LIMIT %s", (group_id, batch_size))
+                removed = cursor.rowcount
+                if counter:
+                    deleted[counter] += removed
+                ctx.checkpoint(deleted)
+                if removed < batch_size:
+                    break
+
+        cursor.execute("DELETE FROM groups WHERE id = %s AND deleted_at IS NOT NULL", (group_id,))
+        ctx.db_conn.commit()
+        return {"group_id": group_id, "deleted": deleted}
+    finally:
+        cursor.close()
+
+@job_handler('archive_cycle')
+def archive_closed_cycle(ctx: JobContext) -> Dict[str, Any]:
+    """
+    Move a closed cycle's expenses, splits and settlements to the archive tables in
+    small committed batches. Each batch is copied and deleted in one transaction,
+    so the job is safe to resume after a crash. Cycles without a snapshot are left alone.
+    """
+    group_id = ctx.payload['group_id']
+    cycle = ctx.payload['settlement_cycle']
+    moved = ctx.progress or {"expense_splits": 0, "expenses": 0, "settlements": 0}
+    batch_size = CYCLE_ARCHIVE_BATCH_SIZE
+    cursor = ctx.db_conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT g.settlement_cycle FROM cycle_snapshots cs
+            INNER JOIN groups g ON g.id = cs.group_id
+            WHERE cs.group_id = %s AND cs.settlement_cycle = %s AND g.deleted_at IS NULL
+        """, (group_id, cycle))
+        row = cursor.fetchone()
+        if not row or row[0] <= cycle:
+            return {"group_id": group_id, "settlement_cycle": cycle, "archived": False}
+
+        while True:
+            cursor.execute("""
+                SELECT id FROM expenses WHERE group_id = %s AND settlement_cycle = %s ORDER BY id LIMIT %s
+            """, (group_id, cycle, batch_size))
+            expense_ids = [row[0] for row in cursor.fetchall()]
+            if not expense_ids:
+                break
+            placeholders = ','.join(['%s'] * len(expense_ids))
+            cursor.execute(f"INSERT INTO expense_splits_archive SELECT * FROM expense_splits WHERE expense_id IN ({placeholders})", expense_ids)
+            moved['expense_splits'] += cursor.rowcount
+            cursor.execute(f"INSERT INTO expenses_archive SELECT * FROM expenses WHERE id IN ({placeholders})", expense_ids)
+            moved['expenses'] += cursor.rowcount
+            cursor.execute(f"DELETE FROM expense_splits WHERE expense_id IN ({placeholders})", expense_ids)
+            cursor.execute(f"DELETE FROM expenses WHERE id IN ({placeholders})", expense_ids)
+            ctx.checkpoint(moved)
+
+        while True:
+            cursor.execute("""
+                SELECT id FROM settlements WHERE group_id = %s AND settlement_cycle = %s ORDER BY id LIMIT %s
+            """, (group_id, cycle, batch_size))
+            settlement_ids = [row[0] for row in cursor.fetchall()]
+            if not settlement_ids:
+                break
+            placeholders = ','.join(['%s'] * len(settlement_ids))
+            cursor.execute(f"INSERT INTO settlements_archive SELECT * FROM settlements WHERE id IN ({placeholders})", settlement_ids)
+            moved['settlements'] += cursor.rowcount
+            cursor.execute(f"DELETE FROM settlements WHERE id IN ({placeholders})", settlement_ids)
+            ctx.checkpoint(moved)
+
+        cursor.execute("""
+            UPDATE cycle_snapshots SET archived_at = NOW() WHERE group_id = %s AND settlement_cycle = %s
+        """, (group_id, cycle))
+        ctx.db_conn.commit()
+        return {"group_id": group_id, "settlement_cycle": cycle, "archived": True, "moved": moved}
+    finally:
+        cursor.close()
+
+@job_handler('rebuild_rollups')
+def rebuild_rollups_job(ctx: JobContext) -> Dict[str, Any]:
+    group_id = ctx.payload['group_id']
+    return {"group_id": group_id, "rollup_rows": rebuild_expense_rollups(ctx.db_conn, group_id)}
+
+@api_router.get("/jobs/{job_id}", response_model=Dict[str, Any])
+def get_job_status(job_id: int, current_user: User = Depends(get_current_user), db_conn = Depends(get_db_connection)):
+    """Poll the status of a background job started by the current user."""
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id, job_type, status, attempts, max_attempts, progress, result, last_error,
+                   created_at, updated_at
+            FROM jobs
+            WHERE id = %s AND created_by = %s
+        """, (job_id, current_user.id))
+        job = cursor.fetchone()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        for field in ('progress', 'result'):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+    finally:
+        cursor.close()
+
+@api_router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
+def register_user_alias(user: UserCreate, db_conn = Depends(get_db_connection)):
+    """Alias endpoint for registration (same as POST /api/users/)."""
+    db_user = get_user_by_email(db_conn, email=user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    new_user = create_db_user(db_conn, user)
+    return new_user
+
+# --- Admission Control ---
+# Requests are rate limited and capped here, before any DB connection is taken,
+# so a flood is shed with a fast 429/503 instead of exhausting the pool.
+
+# Token buckets: sustained requests per second and burst size
+RATE_LIMIT_USER_PER_SECOND = float(os.environ.get("RATE_LIMIT_USER_PER_SECOND", "10"))
+RATE_LIMIT_USER_BURST = int(os.environ.get("RATE_LIMIT_USER_BURST", "40"))
+# Per-IP limits apply to every request, so keep them loose enough for shared NATs
+RATE_LIMIT_IP_PER_SECOND = float(os.environ.get("RATE_LIMIT_IP_PER_SECOND", "30"))
+RATE_LIMIT_IP_BURST = int(os.environ.get("RATE_LIMIT_IP_BURST", "120"))
+# Bound on the number of users/IPs whose buckets are remembered
+RATE_LIMIT_MAX_TRACKED_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_TRACKED_CLIENTS", "10000"))
+# Addresses (or CIDR ranges) of the reverse proxies (nginx) whose X-Real-IP /
+# X-Forwarded-For is used as the client address. Headers from anyone else are
+# ignored, so clients reaching the backend port directly cannot pick their own IP.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(address.strip(), strict=False)
+    for address in os.environ.get("TRUSTED_PROXIES", "").split(",") if address.strip()
+]
+
+# In-flight request caps; the global cap defaults to the DB pool size since
+# nearly every request holds a pooled connection for its whole duration
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", os.environ.get("DB_POOL_SIZE", "10")))
+ADMISSION_CONCURRENCY_LIMITS = {
+    "read": int(os.environ.get("ADMISSION_READ_CONCURRENCY", str(ADMISSION_MAX_IN_FLIGHT))),
+    "write": int(os.environ.get("ADMISSION_WRITE_CONCURRENCY", str(max(1, ADMISSION_MAX_IN_FLIGHT // 2)))),
+    "heavy": int(os.environ.get("ADMISSION_HEAVY_CONCURRENCY", "2")),
+    "auth": int(os.environ.get("ADMISSION_AUTH_CONCURRENCY", "4")),
+}
+
+# Cheap endpoints that must stay reachable even under overload
+ADMISSION_EXEMPT_PATHS = {"/api/health", "/api/ready", "/api/metrics"}
+
+class TokenBucketLimiter:
+    """Token buckets per key, keeping only the most recently seen keys."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take a token for key. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            tokens, updated = bucket
+            bucket[0] = min(float(self.burst), tokens + (now - updated) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+def classify_route(method: str, path: str) -> str:
+    """Map a request to the route class whose concurrency cap it counts against."""
+    if path in ("/api/token", "/api/register") or (method == "POST" and path == "/api/users/"):
+        return "auth"
+    if path.endswith("/export") or "/stats" in path or path.endswith((":batch", ":bulk")) or path == "/api/sync/push":
+        return "heavy"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+def token_subject(headers: Dict[str, str]) -> Optional[str]:
+    """JWT subject from the Authorization header, verified but without any DB lookup."""
+    authorization = headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        peer = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(peer in network for network in TRUSTED_PROXIES)
+
+def client_address(scope, headers: Dict[str, str]) -> str:
+    """The client's IP: the peer address, or what a trusted proxy says the client was."""
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if is_trusted_proxy(peer):
+        # The last X-Forwarded-For entry is the one the proxy added; earlier ones come from the client
+        forwarded = headers.get("x-real-ip") or headers.get("x-forwarded-for", "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return peer
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware enforcing per-user and per-IP token buckets plus in-flight
+    caps per route class and overall. All state lives on the event loop thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.user_limiter = TokenBucketLimiter(RATE_LIMIT_USER_PER_SECOND, RATE_LIMIT_USER_BURST, RATE_LIMIT_MAX_TRACKED_CLIENTS)
+        self.ip_limiter = TokenBucketLimiter(RATE_LIMIT_IP_PER_SECOND, RATE_LIMIT_IP_BURST, RATE_LIMIT_MAX_TRACKED_CLIENTS)
+        self.in_flight = {route_class: 0 for route_class in ADMISSION_CONCURRENCY_LIMITS}
+        self.total_in_flight = 0
+        metrics.register_gauge("admission_in_flight", lambda: {"total": self.total_in_flight, **self.in_flight})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        subject = token_subject(headers)
+        if subject is not None:
+            wait = self.user_limiter.acquire(subject)
+            if wait:
+                metrics.increment("admission_shed_total.user_rate_limit")
+                await self._reject(scope, receive, send, 429, "Too many requests, please slow down", wait)
+                return
+        wait = self.ip_limiter.acquire(client_address(scope, headers))
+        if wait:
+            metrics.increment("admission_shed_total.ip_rate_limit")
+            await self._reject(scope, receive, send, 429, "Too many requests, please slow down", wait)
+            return
+
+        route_class = classify_route(scope["method"], scope["path"])
+        if self.total_in_flight >= ADMISSION_MAX_IN_FLIGHT or self.in_flight[route_class] >= ADMISSION_CONCURRENCY_LIMITS[route_class]:
+            metrics.increment(f"admission_shed_total.{route_class}_concurrency")
+            await self._reject(scope, receive, send, 503, "Server is busy, please retry shortly", 1)
+            return
+
+        self.in_flight[route_class] += 1
+        self.total_in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[route_class] -= 1
+            self.total_in_flight -= 1
+
+    async def _reject(self, scope, receive, send, status_code: int, detail: str, retry_after: float) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+@api_router.get("/metrics")
+def get_metrics():
+    """Process-local counters (e.g. shed requests) and current gauges for this worker."""
+    return metrics.snapshot()
+
+# --- Request Deadlines ---
+# Every request gets a deadline from its route class (or a shorter X-Request-Timeout
+# header). Its pooled connection carries the remaining time as a session statement
+# timeout, and a watchdog kills the running statement when the deadline passes or
+# the client disconnects, so the connection goes back to the pool promptly.
+
+REQUEST_TIMEOUT_SECONDS = {
+    "read": float(os.environ.get("REQUEST_TIMEOUT_READ_SECONDS", "10")),
+    "write": float(os.environ.get("REQUEST_TIMEOUT_WRITE_SECONDS", "15")),
+    "heavy": float(os.environ.get("REQUEST_TIMEOUT_HEAVY_SECONDS", "60")),
+    "auth": float(os.environ.get("REQUEST_TIMEOUT_AUTH_SECONDS", "10")),
+}
+REQUEST_TIMEOUT_HEADER = "x-request-timeout"
+# Clients may ask for less time than the route allows, never more
+REQUEST_TIMEOUT_MIN_SECONDS = 0.1
+
+ER_QUERY_INTERRUPTED = 1317  # KILL QUERY
+ER_STATEMENT_TIMEOUT = 1969  # MariaDB max_statement_time
+ER_QUERY_TIMEOUT = 3024  # MySQL max_execution_time
+STATEMENT_TIMEOUT_ERRNOS = {ER_QUERY_INTERRUPTED, ER_STATEMENT_TIMEOUT, ER_QUERY_TIMEOUT}
+
+class RequestDeadline:
+    """The time budget of one request and the DB connection working on it."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.connection_id: Optional[int] = None
+        self.cancelled: Optional[str] = None  # 'deadline' or 'client_disconnect' once the watchdog fired
+        # Held while killing, so the connection cannot be handed to another request meanwhile
+        self.lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+current_deadline: contextvars.ContextVar[Optional[RequestDeadline]] = contextvars.ContextVar("current_deadline", default=None)
+
+# MySQL and MariaDB name their statement timeout differently; detected on first use
+_session_timeout_variable: Optional[str] = None
+
+def apply_session_deadline(connection, deadline: RequestDeadline) -> None:
+    """Limit every statement and lock wait on this connection to the request's remaining time."""
+    global _session_timeout_variable
+    if _session_timeout_variable is None:
+        _session_timeout_variable = (
+            "max_statement_time" if "mariadb" in connection.get_server_info().lower() else "max_execution_time"
+        )
+    remaining = max(deadline.remaining(), 0.001)
+    # max_statement_time is in seconds, max_execution_time in milliseconds
+    statement_timeout = round(remaining, 3) if _session_timeout_variable == "max_statement_time" else math.ceil(remaining * 1000)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f"SET SESSION {_session_timeout_variable} = %s, innodb_lock_wait_timeout = %s",
+            (statement_timeout, max(1, math.ceil(remaining)))
+        )
+    finally:
+        cursor.close()
+    deadline.connection_id = connection.connection_id
+
+def clear_session_deadline(connection, deadline: RequestDeadline) -> None:
+    """Restore the server defaults before the connection is reused."""
+    with deadline.lock:
+        deadline.connection_id = None
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SET SESSION {_session_timeout_variable} = DEFAULT, innodb_lock_wait_timeout = DEFAULT")
+    finally:
+        cursor.close()
+
+def kill_running_statement(deadline: RequestDeadline) -> None:
+    """Interrupt whatever the request's connection is executing; an idle connection is unaffected."""
+    with deadline.lock:
+        connection_id = deadline.connection_id
+        if connection_id is None:
+            return
+        kill_on_server(connection_id, "QUERY")
+
+def kill_on_server(connection_id: int, target: str) -> bool:
+    """Run KILL QUERY or KILL CONNECTION for another session from a spare pooled connection."""
+    try:
+        connection = db_pool.get_connection()
+    except mysql.connector.Error as err:
+        # Pool exhausted or DB down: the session statement timeout still applies
+        logging.warning(f"Could not kill {target.lower()} {connection_id}: {err}")
+        return False
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"KILL {target} {int(connection_id)}")
+        finally:
+            cursor.close()
+        return True
+    except mysql.connector.Error as err:
+        logging.warning(f"Could not kill {target.lower()} {connection_id}: {err}")
+        return False
+    finally:
+        connection.close()
+
+def discard_db_connection(connection, deadline: Optional[RequestDeadline]) -> None:
+    """
+    Return a connection that still has an unread result without reading the rest of
+    it: its session is killed on the server and the pool reconnects it on next checkout.
+    """
+    if deadline is not None:
+        with deadline.lock:
+            deadline.connection_id = None
+    metrics.increment("db_connections_discarded")
+    kill_on_server(connection.connection_id, "CONNECTION")
+    try:
+        connection.disconnect()
+    except Exception:
+        # Expected once the server has dropped the session
+        pass
+    finally:
+        connection.close()
+
+def deadline_exceeded_error(deadline: Optional[RequestDeadline]) -> HTTPException:
+    reason = (deadline.cancelled if deadline else None) or "deadline"
+    metrics.increment(f"request_timeouts.{reason}")
+    return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="The request took too long and was cancelled")
+
+def is_timeout_error(err: mysql.connector.Error) -> bool:
+    return err.errno in STATEMENT_TIMEOUT_ERRNOS
+
+def db_http_error(err: mysql.connector.Error) -> HTTPException:
+    """HTTP error for a failed query: 504 if it ran out of time, 400 otherwise."""
+    if is_timeout_error(err):
+        return deadline_exceeded_error(current_deadline.get())
+    if err.errno in CONNECTION_LOST_ERRNOS:
+        db_breaker.record_failure()
+        return database_unavailable_error()
+    return HTTPException(status_code=400, detail=f"Database error: {err}")
+
+@app.exception_handler(mysql.connector.Error)
+async def database_error_handler(request: Request, err: mysql.connector.Error):
+    """Queries that were not caught by an endpoint: timeouts become 504, lost connections 503, anything else 500."""
+    if is_timeout_error(err) or err.errno in CONNECTION_LOST_ERRNOS:
+        error = db_http_error(err)
+        return JSONResponse(status_code=error.status_code, content={"detail": error.detail}, headers=error.headers)
+    logging.error(f"Unhandled database error on {request.method} {request.url.path}", exc_info=err)
+    return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+def request_timeout_seconds(method: str, path: str, headers: Dict[str, str]) -> float:
+    """The route class's timeout, shortened by a valid X-Request-Timeout header."""
+    seconds = REQUEST_TIMEOUT_SECONDS[classify_route(method, path)]
+    try:
+        requested = float(headers.get(REQUEST_TIMEOUT_HEADER, ""))
+    except ValueError:
+        return seconds
+    if math.isfinite(requested):
+        seconds = min(seconds, max(REQUEST_TIMEOUT_MIN_SECONDS, requested))
+    return seconds
+
+class RequestDeadlineMiddleware:
+    """
+    ASGI middleware that sets the request's deadline and runs a watchdog next to
+    the app. When the deadline passes or the client disconnects while a statement
+    is running, the watchdog kills that statement; the endpoint then fails fast
+    and releases its connection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        deadline = RequestDeadline(request_timeout_seconds(scope["method"], scope["path"], headers))
+        token = current_deadline.set(deadline)
+
+        # Once the app has read the whole body, the next message can only be a disconnect.
+        # From then on the disconnect watcher is the only reader of the channel and
+        # hands every message on to the app through inbox.
+        body_read = asyncio.Event()
+        inbox: asyncio.Queue = asyncio.Queue()
+
+        async def receive_wrapper():
+            if not body_read.is_set():
+                message = await receive()
+                if message["type"] != "http.request" or not message.get("more_body", False):
+                    body_read.set()
+                return message
+            message = await inbox.get()
+            if message["type"] == "http.disconnect":
+                inbox.put_nowait(message)  # later calls see the disconnect too
+            return message
+
+        if scope["method"] in ("GET", "HEAD", "DELETE"):
+            body_read.set()
+
+        async def cancel(reason: str):
+            if deadline.cancelled is None:
+                deadline.cancelled = reason
+            if deadline.connection_id is not None:
+                await run_in_threadpool(kill_running_statement, deadline)
+
+        async def watch_deadline():
+            await asyncio.sleep(max(deadline.remaining(), 0))
+            await cancel("deadline")
+
+        async def watch_disconnect():
+            await body_read.wait()
+            while True:
+                message = await receive()
+                inbox.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    await cancel("client_disconnect")
+                    return
+
+        watchdogs = [asyncio.create_task(watch_deadline()), asyncio.create_task(watch_disconnect())]
+        try:
+            await self.app(scope, receive_wrapper, send)
+        finally:
+            for watchdog in watchdogs:
+                watchdog.cancel()
+            current_deadline.reset(token)
+
+# --- Degraded Reads ---
+# A circuit breaker stops requests from waiting on connection timeouts while MySQL
+# is down: they fail fast with 503. The main per-user reads keep their last good
+# response in a local snapshot store and serve it, flagged as stale, instead of a
+# 503 or 504, so the app still shows the user's data during an outage.
+
+DB_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("DB_BREAKER_FAILURE_THRESHOLD", "3"))
+DB_BREAKER_RESET_SECONDS = float(os.environ.get("DB_BREAKER_RESET_SECONDS", "10"))
+DEGRADED_READS_ENABLED = os.environ.get("DEGRADED_READS_ENABLED", "true").lower() == "true"
+# One SQLite file shared by the workers, so snapshots also survive a restart
+SNAPSHOT_STORE_PATH = os.environ.get("SNAPSHOT_STORE_PATH", str(ROOT_DIR / "snapshots.sqlite3"))
+SNAPSHOT_MAX_AGE_HOURS = float(os.environ.get("SNAPSHOT_MAX_AGE_HOURS", "72"))
+# Snapshot digests each worker remembers to skip rewriting unchanged bodies (a key and 32 bytes each)
+SNAPSHOT_DIGEST_CACHE_SIZE = int(os.environ.get("SNAPSHOT_DIGEST_CACHE_SIZE", "50000"))
+
+# Client errors that mean the server is unreachable or the connection was lost
+CONNECTION_LOST_ERRNOS = {2002, 2003, 2006, 2013, 2055}
+
+# Reads worth keeping: groups, a group's balances, friends, the home screen, activity page 1
+SNAPSHOT_PATH_RE = re.compile(r"^/api/(groups/|groups/\d+/balances|friends/|bootstrap|activity)$")
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures to reach the database.
+    While open, one probe request per reset_seconds is let through; a success
+    closes the breaker, a failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._opened_at = time.monotonic()  # this request is the probe
+                return True
+            return False
+
+    def retry_after(self) -> int:
+        with self._lock:
+            if self._opened_at is None:
+                return 1
+            return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    metrics.increment("db_circuit_breaker.opened")
+                self._opened_at = time.monotonic()
+
+    def state(self) -> str:
+        with self._lock:
+            return "closed" if self._opened_at is None else "open"
+
+db_breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_RESET_SECONDS)
+metrics.register_gauge("db_circuit_breaker", db_breaker.state)
+
+def database_unavailable_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Database is unavailable, please retry shortly",
+        headers={"Retry-After": str(db_breaker.retry_after())},
+    )
+
+class SnapshotStore:
+    """
+    Last successful response body per (user, request), in a SQLite file. Unchanged
+    bodies are not rewritten. Errors are logged and never fail the request.
+    """
+
+    PRUNE_EVERY_WRITES = 1000
+
+    def __init__(self, path: str, max_age_hours: float):
+        self.path = path
+        self.max_age_seconds = max_age_hours * 3600
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._digests: OrderedDict = OrderedDict()  # key -> digest of the stored body
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, body BLOB NOT NULL, saved_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def save(self, key: str, body: bytes) -> None:
+        digest = hashlib.sha256(body).digest()
+        with self._lock:
+            if self._digests.get(key) == digest:
+                return
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO snapshots (key, body, saved_at) VALUES (?, ?, ?)", (key, body, time.time())
+                )
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % self.PRUNE_EVERY_WRITES == 0
+                if prune:
+                    connection.execute("DELETE FROM snapshots WHERE saved_at < ?", (time.time() - self.max_age_seconds,))
+        except sqlite3.Error as err:
+            logging.warning(f"Could not save response snapshot: {err}")
+            return
+        with self._lock:
+            self._digests[key] = digest
+            self._digests.move_to_end(key)
+            if len(self._digests) > SNAPSHOT_DIGEST_CACHE_SIZE:
+                self._digests.popitem(last=False)
+
+    def load(self, key: str) -> Optional[tuple]:
+        """(body, saved_at) of the last good response, or None."""
+        try:
+            row = self._connection().execute(
+                "SELECT body, saved_at FROM snapshots WHERE key = ? AND saved_at >= ?",
+                (key, time.time() - self.max_age_seconds)
+            ).fetchone()
+        except sqlite3.Error as err:
+            logging.warning(f"Could not read response snapshot: {err}")
+            return None
+        return (bytes(row[0]), row[1]) if row else None
+
+snapshot_store = SnapshotStore(SNAPSHOT_STORE_PATH, SNAPSHOT_MAX_AGE_HOURS) if DEGRADED_READS_ENABLED else None
+
+def snapshot_key(scope, subject: str) -> Optional[str]:
+    """Snapshot key for a GET worth keeping, or None."""
+    path = scope["path"]
+    if not SNAPSHOT_PATH_RE.match(path):
+        return None
+    query = scope["query_string"].decode("latin-1")
+    if path == "/api/activity" and parse_qs(query).get("offset", ["0"])[0] != "0":
+        return None  # only the first page
+    return f"{subject} {path}?{query}"
+
+class DegradedReadMiddleware:
+    """
+    ASGI middleware that records successful snapshot-worthy GETs and, when the
+    same request later fails with 503/504 (or crashes), replays the last good
+    body with X-Stale-Response: true and the time it was saved.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or snapshot_store is None:
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        subject = token_subject(headers)
+        key = snapshot_key(scope, subject) if subject else None
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        # These responses are small JSON documents, so buffer them to decide what to send
+        start_message = None
+        body_parts = []
+
+        async def capture(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+            elif message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, capture)
+        except Exception:
+            if await self._send_snapshot(key, scope, receive, send):
+                return
+            raise
+
+        body = b"".join(body_parts)
+        if start_message["status"] in (503, 504) and await self._send_snapshot(key, scope, receive, send):
+            return
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
+        if start_message["status"] == 200:
+            await run_in_threadpool(snapshot_store.save, key, body)
+
+    async def _send_snapshot(self, key: str, scope, receive, send) -> bool:
+        snapshot = await run_in_threadpool(snapshot_store.load, key)
+        if snapshot is None:
+            metrics.increment("degraded_reads.miss")
+            return False
+        body, saved_at = snapshot
+        metrics.increment("degraded_reads.served")
+        response = Response(
+            content=body,
+            media_type="application/json",
+            headers={
+                "X-Stale-Response": "true",
+                "X-Snapshot-Time": datetime.utcfromtimestamp(saved_at).isoformat() + "Z",
+                "Cache-Control": "no-store",
+            },
+        )
+        await response(scope, receive, send)
+        return True
+
+# --- Startup Warm-up ---
+# The app starts serving immediately; a background thread connects to MySQL with
+# backoff (so a DB restart doesn't crash-loop the container), validates the pool
+# connections and warms the membership cache. /api/ready reports 503 until then.
+
+WARMUP_MAX_BACKOFF_SECONDS = float(os.environ.get("WARMUP_MAX_BACKOFF_SECONDS", "30"))
+# Users whose groups changed within this many days get their memberships preloaded
+WARMUP_ACTIVE_DAYS = int(os.environ.get("WARMUP_ACTIVE_DAYS", "7"))
+WARMUP_MAX_USERS = int(os.environ.get("WARMUP_MAX_USERS", "5000"))
+
+warmup_state: Dict[str, Any] = {"phase": "starting", "ready": False, "attempts": 0, "last_error": None}
+warmup_stop = threading.Event()
+
+def validate_pool_connections() -> int:
+    """Check out every pooled connection once and ping it, reconnecting dead ones."""
+    connections = []
+    try:
+        for _ in range(db_pool.pool_size):
+            try:
+                connection = db_pool.get_connection()
+            except mysql.connector.errors.PoolError:
+                # The rest are already serving requests
+                break
+            connections.append(connection)
+            connection.ping(reconnect=True, attempts=1)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+def warm_membership_cache() -> int:
+    """Preload the membership index for recently active users."""
+    generation = membership_index.generation()
+    connection = db_pool.get_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT DISTINCT gm.user_id
+                FROM groups g
+                INNER JOIN group_members gm ON gm.group_id = g.id AND gm.is_active = TRUE
+                WHERE g.deleted_at IS NULL AND g.updated_at >= NOW() - INTERVAL %s DAY
+                LIMIT %s
+            """, (WARMUP_ACTIVE_DAYS, WARMUP_MAX_USERS))
+            user_ids = [row[0] for row in cursor.fetchall()]
+            group_ids_by_user: Dict[int, set] = {user_id: set() for user_id in user_ids}
+            for start in range(0, len(user_ids), 1000):
+                chunk = user_ids[start:start + 1000]
+                placeholders = ','.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f"SELECT user_id, group_id FROM group_members WHERE is_active = TRUE AND user_id IN ({placeholders})",
+                    chunk
+                )
+                for user_id, group_id in cursor.fetchall():
+                    group_ids_by_user[user_id].add(group_id)
+            membership_index.prime(group_ids_by_user, generation)
+            return len(user_ids)
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+def run_warmup() -> None:
+    """Connect (retrying with backoff), validate the pool, warm caches, then start the job runner."""
+    backoff_seconds = 1.0
+    while not warmup_stop.is_set():
+        warmup_state["attempts"] += 1
+        try:
+            warmup_state["phase"] = "connecting"
+            init_db_pool()
+            warmup_state["phase"] = "validating_pool"
+            warmup_state["pool_connections"] = validate_pool_connections()
+            break
+        except Exception as err:
+            warmup_state["last_error"] = str(err)
+            logging.warning(f"Database not reachable (attempt {warmup_state['attempts']}), retrying in {backoff_seconds:.0f}s: {err}")
+            warmup_stop.wait(backoff_seconds)
+            backoff_seconds = min(backoff_seconds * 2, WARMUP_MAX_BACKOFF_SECONDS)
+    if warmup_stop.is_set():
+        return
+
+    warmup_state["phase"] = "warming_caches"
+    try:
+        warmup_state["warmed_users"] = warm_membership_cache()
+    except Exception as err:
+        # Cold caches only cost latency; don't hold readiness back for them
+        logging.exception("Cache warm-up failed")
+        warmup_state["last_error"] = str(err)
+
+    if JOB_RUNNER_ENABLED:
+        job_runner.start()
+    warmup_state["phase"] = "done"
+    warmup_state["ready"] = True
+    logging.info("Startup warm-up complete.")
+
+@api_router.get("/ready")
+def readiness():
+    """
+    Readiness for load balancers: 200 once warm-up has finished and a pooled
+    connection answers a ping, 503 otherwise. Unlike /api/health this touches the DB.
+    """
+    body = {"status": "ready", "warmup": dict(warmup_state)}
+    if not warmup_state["ready"]:
+        body["status"] = "warming_up"
+        return JSONResponse(status_code=503, content=body, headers={"Retry-After": "5"})
+    try:
+        connection = db_pool.get_connection()
+        try:
+            connection.ping(reconnect=False)
+        finally:
+            connection.close()
+    except Exception as err:
+        body["status"] = "database_unavailable"
+        body["error"] = str(err)
+        return JSONResponse(status_code=503, content=body, headers={"Retry-After": "5"})
+    body["pool"] = {"name": db_pool.pool_name, "size": db_pool.pool_size}
+    return body
+
+# --- App Initialization ---
+
+app.include_router(api_router)
+
+# Innermost, so only admitted requests get a deadline
+app.add_middleware(RequestDeadlineMiddleware)
+
+# Added before CORS so rejected requests still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
+# Outside admission control, so reads shed with 503 can still be served from snapshots
+app.add_middleware(DegradedReadMiddleware)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"], # Allow all origins for development
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.on_event("startup")
+def startup_event():
+    """Start the warm-up thread; it creates the pool and then starts the job runner."""
+    warmup_stop.clear()
+    threading.Thread(target=run_warmup, name="hisab-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    Stop the job runner and close the database connection pool.
+    Uvicorn runs this after in-flight requests have drained (or the graceful timeout passed).
+    """
+    warmup_stop.set()
+    job_runner.stop()
+    close_db_pool()
 
 # Configure logging
 logging.basicConfig(
@@ -0,0 +1,74 @@
+"""
+Deterministic synthetic inputs for the micro-benchmarks, shaped like the rows
+the server reads from MySQL. The same size and seed always give the same data.
+"""
+import random
+from datetime import datetime, timedelta
+
+# Row counts each benchmark is run at
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+
+START = datetime(2025, 1, 1)
+
+
+def member_count(rows):
+    """Groups grow with their history, but stay within what a real group looks like."""
+    return max(2, min(50, rows // 20))
+
+
+def synthetic_balances(server, rows, seed=1):
+    """rows Balance objects whose amounts sum to zero, as in a real group."""
+    rng = random.Random(seed)
+    amounts = [round(rng.uniform(-500, 500), 2) for _ in range(rows - 1)]
+    amounts.append(round(-sum(amounts), 2))
+    return [
+        server.Balance(user_id=user_id, user_name=f"User {user_id}", balance=amount)
+        for user_id, amount in enumerate(amounts, start=1)
+    ]
+
+
+def synthetic_split_rows(rows, seed=2):
+    """rows expense split rows shaped like compute_pairwise_balances' query result."""
+    rng = random.Random(seed)
+    members = member_count(rows)
+    split_rows = []
+    expense_id = 0
+    while len(split_rows) < rows:
+        expense_id += 1
+        paid_by = rng.randint(1, members)
+        participants = rng.sample(range(1, members + 1), rng.randint(2, members))
+        total = round(rng.uniform(5, 300), 2)
+        expense_date = START + timedelta(minutes=expense_id)
+        for user_id in participants[:rows - len(split_rows)]:
+            split_rows.append({
+                'expense_id': expense_id,
+                'description': f"Expense {expense_id}",
+                'total_amount': total,
+                'expense_date': expense_date,
+                'paid_by_user_id': paid_by,
+                'paid_by_name': f"User {paid_by}",
+                'owes_user_id': user_id,
+                'owes_user_name': f"User {user_id}",
+                'owed_amount': round(total / len(participants), 2),
+            })
+    return split_rows
+
+
+def synthetic_settlements(rows, seed=3):
+    """rows settlement rows between the members of a group of matching size."""
+    rng = random.Random(seed)
+    members = member_count(rows)
+    settlements = []
+    for settlement_id in range(1, rows + 1):
+        payer_id, payee_id = rng.sample(range(1, members + 1), 2)
+        settlements.append({
+            'id': settlement_id,
+            'group_id': 1,
+            'payer_id': payer_id,
+            'payee_id': payee_id,
+            'amount': round(rng.uniform(1, 100), 2),
+            'notes': None,
+            'settlement_type': 'simplified',
+            'settlement_date': START + timedelta(minutes=settlement_id),
+        })
+    return settlements
@@ -0,0 +1,99 @@
+"""
+Micro-benchmarks for the pure-Python hot paths behind the balance, settlement
+and expense endpoints, from 10 to 100k input rows. No database is used.
+
+    python -m pytest tests/benchmarks --benchmark-only
+
+See baselines/README.md for saving runs and comparing against them.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+server = pytest.importorskip("server")
+
+from .synthetic import (  # noqa: E402
+    SIZES, START, member_count, synthetic_balances, synthetic_settlements, synthetic_split_rows
+)
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_calculate_settlements(benchmark, rows):
+    balances = synthetic_balances(server, rows)
+    settlements = benchmark(server.calculate_settlements, balances)
+    assert len(settlements) <= rows - 1
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_build_pairwise_balances(benchmark, rows):
+    split_rows = synthetic_split_rows(rows)
+    settlements = synthetic_settlements(max(1, rows // 10))
+    pairwise = benchmark(server.build_pairwise_balances, split_rows, settlements)
+    members = member_count(rows)
+    assert len(pairwise) <= members * (members - 1) // 2
+
+
+@pytest.mark.parametrize("split_type", ["equal", "exact", "percentage"])
+@pytest.mark.parametrize("rows", SIZES)
+def test_compute_expense_splits(benchmark, rows, split_type):
+    # One expense shared by `rows` participants
+    if split_type == "equal":
+        amount, splits = 1234.56, {user_id: 0 for user_id in range(1, rows + 1)}
+    elif split_type == "exact":
+        amount, splits = float(rows), {user_id: 1.0 for user_id in range(1, rows + 1)}
+    else:
+        amount, splits = 1234.56, {user_id: 100.0 / rows for user_id in range(1, rows + 1)}
+    split_rows = benchmark(server.compute_expense_splits, split_type, amount, splits)
+    assert len(split_rows) == rows
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_apply_settlements_to_balances(benchmark, rows):
+    settlements = synthetic_settlements(rows)
+
+    def setup():
+        balance_map = {
+            user_id: {'user_id': user_id, 'user_name': f"User {user_id}", 'balance': 0.0}
+            for user_id in range(1, member_count(rows) + 1)
+        }
+        return (balance_map, settlements), {}
+
+    benchmark.pedantic(server.apply_settlements_to_balances, setup=setup, rounds=20)
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_group_response_models(benchmark, rows):
+    groups = [
+        {
+            'id': group_id, 'name': f"Group {group_id}", 'created_by': 1, 'currency': 'USD',
+            'settlement_method': None,
+            'members': [
+                {'id': user_id, 'email': f"user{user_id}@example.com", 'name': f"User {user_id}"}
+                for user_id in range(1, 5)
+            ],
+        }
+        for group_id in range(1, rows + 1)
+    ]
+    result = benchmark(lambda: [server.Group(**group) for group in groups])
+    assert len(result) == rows
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_expense_response_models(benchmark, rows):
+    expenses = [
+        {
+            'id': row['expense_id'] * 100_000 + row['owes_user_id'], 'description': row['description'],
+            'amount': row['total_amount'], 'paid_by_user_id': row['paid_by_user_id'], 'group_id': 1,
+            'expense_date': row['expense_date'], 'category': None,
+        }
+        for row in synthetic_split_rows(rows)
+    ]
+    result = benchmark(lambda: [server.Expense(**expense) for expense in expenses])
+    assert len(result) == rows
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_settlement_response_models(benchmark, rows):
+    settlements = synthetic_settlements(rows)
+    result = benchmark(lambda: [server.Settlement(**settlement) for settlement in settlements])
+    assert len(result) == rows
+    assert result[0].settlement_date >= START
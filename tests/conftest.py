@@ -0,0 +1,205 @@
+"""
+Shared fixtures for tests that run against a scratch MySQL/MariaDB database.
+
+Set HISAB_TEST_DB_HOST, HISAB_TEST_DB_USER, HISAB_TEST_DB_PASSWORD and
+HISAB_TEST_DB_NAME to a database the tests are allowed to drop and recreate.
+Database tests are skipped when these are not set.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+TEST_DB_ENV = {
+    "DB_HOST": "HISAB_TEST_DB_HOST",
+    "DB_USER": "HISAB_TEST_DB_USER",
+    "DB_PASSWORD": "HISAB_TEST_DB_PASSWORD",
+    "DB_NAME": "HISAB_TEST_DB_NAME",
+}
+
+# Errors that mean a migration step is already reflected in schema.sql
+ALREADY_APPLIED_ERRNOS = {1050, 1060, 1061, 1091}
+
+# bcrypt hash of "password", as used by the sample users in schema.sql
+SEED_PASSWORD_HASH = "$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewY5NU7L/tLnk5g2"
+
+
+def split_sql_script(text):
+    """Split a .sql file into statements, dropping comments and USE lines."""
+    lines = [
+        line for line in text.splitlines()
+        if not line.strip().startswith("--") and not line.strip().upper().startswith("USE ")
+    ]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def create_users(server, prefix, count):
+    """Insert count users named after prefix and return them as User models."""
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        user_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO users (email, hashed_password, full_name) VALUES ",
+            "(%s, %s, %s)",
+            [(f"{prefix}{n}@example.com", "x", f"{prefix.title()} {n}") for n in range(count)]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    return [server.User(id=user_id, email=f"{prefix}{n}@example.com", name=f"{prefix.title()} {n}")
+            for n, user_id in enumerate(user_ids)]
+
+
+def create_group(server, members):
+    """Create a group owned by members[0] with all of members in it; returns its id."""
+    conn = server.db_pool.get_connection()
+    try:
+        group = server.create_group(
+            server.GroupCreate(name="Test group", member_ids=[member.id for member in members[1:]]),
+            current_user=members[0], db_conn=conn
+        )
+    finally:
+        conn.close()
+    return group["id"]
+
+
+def call_endpoint(server, endpoint, *args, **kwargs):
+    """Call an endpoint function directly with a pooled connection of its own."""
+    conn = server.db_pool.get_connection()
+    try:
+        return endpoint(*args, db_conn=conn, **kwargs)
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def server():
+    """The server module, configured against the scratch test database."""
+    missing = [name for name in TEST_DB_ENV.values() if not os.environ.get(name)]
+    if missing:
+        pytest.skip(f"Database tests need {', '.join(missing)}")
+    for server_name, test_name in TEST_DB_ENV.items():
+        os.environ[server_name] = os.environ[test_name]
+
+    import server as server_module
+    server_module.init_db_pool()
+    return server_module
+
+
+@pytest.fixture(scope="session")
+def db_schema(server):
+    """Recreate the schema from schema.sql plus all migrations."""
+    import mysql.connector
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("SHOW TABLES")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"DROP TABLE `{table}`")
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+        scripts = [BACKEND_DIR / "schema.sql"] + sorted((BACKEND_DIR / "migrations").glob("*.sql"))
+        for script in scripts:
+            for statement in split_sql_script(script.read_text()):
+                try:
+                    cursor.execute(statement)
+                    if cursor.with_rows:
+                        cursor.fetchall()
+                except mysql.connector.Error as err:
+                    if err.errno not in ALREADY_APPLIED_ERRNOS:
+                        raise
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def seeded_db(server, db_schema):
+    """
+    A deterministic dataset big enough for the optimizer to prefer indexes:
+    300 users, 60 groups of 4-12 members, 3 settlement cycles per group
+    and 40 expenses (with equal splits) plus a few settlements per cycle.
+    """
+    rng = random.Random(42)
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        user_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO users (email, hashed_password, full_name) VALUES ",
+            "(%s, %s, %s)",
+            [(f"seed{n}@example.com", SEED_PASSWORD_HASH, f"Seed User {n}") for n in range(300)]
+        )
+
+        friend_rows = set()
+        for user_id in user_ids:
+            for friend_id in rng.sample(user_ids, 5):
+                if friend_id != user_id:
+                    friend_rows.add((user_id, friend_id))
+                    friend_rows.add((friend_id, user_id))
+        server.insert_rows_chunked(
+            cursor, "INSERT INTO user_friends (user_id, friend_id) VALUES ", "(%s, %s)", sorted(friend_rows)
+        )
+
+        start = datetime(2025, 1, 1)
+        groups = []
+        for n in range(60):
+            members = rng.sample(user_ids, rng.randint(4, 12))
+            cursor.execute(
+                "INSERT INTO `groups` (name, created_by, currency, settlement_cycle) VALUES (%s, %s, 'USD', 3)",
+                (f"Seed Group {n}", members[0])
+            )
+            group_id = cursor.lastrowid
+            server.insert_rows_chunked(
+                cursor, "INSERT INTO group_members (group_id, user_id) VALUES ", "(%s, %s)",
+                [(group_id, user_id) for user_id in members]
+            )
+
+            for cycle in (1, 2, 3):
+                expense_rows = []
+                for _ in range(40):
+                    expense_rows.append((
+                        "Seed expense", round(rng.uniform(5, 300), 2), rng.choice(members), group_id,
+                        start + timedelta(days=rng.randint(0, 365)), cycle, rng.choice(["Food", "Travel", None])
+                    ))
+                expense_ids = server.insert_rows_chunked(
+                    cursor,
+                    "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, settlement_cycle, category) VALUES ",
+                    "(%s, %s, %s, %s, %s, %s, %s)",
+                    expense_rows
+                )
+                split_rows = []
+                for expense_id, row in zip(expense_ids, expense_rows):
+                    participants = rng.sample(members, rng.randint(2, len(members)))
+                    share = round(row[1] / len(participants), 2)
+                    split_rows.extend((expense_id, user_id, share) for user_id in participants)
+                server.insert_rows_chunked(
+                    cursor, "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES ", "(%s, %s, %s)", split_rows
+                )
+                server.insert_rows_chunked(
+                    cursor,
+                    "INSERT INTO settlements (group_id, payer_id, payee_id, amount, settlement_type, settlement_cycle) VALUES ",
+                    "(%s, %s, %s, %s, 'simplified', %s)",
+                    [(group_id, *rng.sample(members, 2), round(rng.uniform(1, 50), 2), cycle) for _ in range(5)]
+                )
+            groups.append({"id": group_id, "members": members})
+
+        conn.commit()
+        cursor.execute("ANALYZE TABLE users, user_friends, `groups`, group_members, expenses, expense_splits, settlements")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return {"user_ids": user_ids, "groups": groups}
@@ -0,0 +1,182 @@
+"""
+Admission control: token buckets per user and IP answer 429 with Retry-After,
+in-flight caps per route class and overall answer 503, and the health,
+readiness and metrics endpoints are never shed.
+"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def shed_count(server, reason):
+    return server.metrics.snapshot()["counters"].get(f"admission_shed_total.{reason}", 0)
+
+
+def http_scope(method, path, headers=(), client="10.0.0.1"):
+    return {
+        "type": "http", "method": method, "path": path, "query_string": b"",
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+        "client": (client, 50000),
+    }
+
+
+async def send_request(middleware, scope):
+    """Run one request through the middleware; returns its status and headers."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    start = sent[0]
+    return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def test_bucket_spends_its_burst_then_refills_at_the_rate(server, clock):
+    limiter = server.TokenBucketLimiter(rate=2, burst=3, max_keys=10)
+    assert [limiter.acquire("alice") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("alice") == pytest.approx(0.5)
+    assert limiter.acquire("bob") == 0.0  # buckets are per key
+
+    clock[0] += 0.5
+    assert limiter.acquire("alice") == 0.0
+    assert limiter.acquire("alice") > 0
+
+    clock[0] += 60  # refills to the burst, never past it
+    assert [limiter.acquire("alice") for _ in range(4)][-1] > 0
+
+
+def test_bucket_forgets_the_least_recently_seen_keys(server, clock):
+    limiter = server.TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    assert limiter.acquire("a") > 0  # refreshes "a"
+    limiter.acquire("c")  # evicts "b"
+    assert limiter.acquire("b") == 0.0
+
+
+@pytest.mark.parametrize("method, path, route_class", [
+    ("POST", "/api/token", "auth"),
+    ("POST", "/api/users/", "auth"),
+    ("GET", "/api/users/", "read"),
+    ("GET", "/api/groups/3/export", "heavy"),
+    ("GET", "/api/groups/3/stats", "heavy"),
+    ("POST", "/api/groups/3/expenses:batch", "heavy"),
+    ("POST", "/api/groups/3/members:bulk", "heavy"),
+    ("POST", "/api/sync/push", "heavy"),
+    ("HEAD", "/api/groups/", "read"),
+    ("DELETE", "/api/groups/3", "write"),
+])
+def test_routes_are_classified(server, method, path, route_class):
+    assert server.classify_route(method, path) == route_class
+
+
+def test_user_over_its_rate_gets_429_with_retry_after(server, clock):
+    middleware = server.AdmissionControlMiddleware(ok_app)
+    middleware.user_limiter = server.TokenBucketLimiter(rate=0.25, burst=2, max_keys=10)
+    token = server.create_access_token({"sub": "alice@example.com"}, timedelta(minutes=5))
+    scope = http_scope("GET", "/api/groups/", [("authorization", f"Bearer {token}")])
+    before = shed_count(server, "user_rate_limit")
+
+    async def scenario():
+        return [await send_request(middleware, scope) for _ in range(3)]
+
+    statuses = asyncio.run(scenario())
+    assert [status for status, _ in statuses] == [200, 200, 429]
+    assert statuses[2][1]["retry-after"] == "4"
+    assert shed_count(server, "user_rate_limit") - before == 1
+
+
+def test_client_without_a_token_is_limited_by_ip(server, clock):
+    middleware = server.AdmissionControlMiddleware(ok_app)
+    middleware.ip_limiter = server.TokenBucketLimiter(rate=1, burst=1, max_keys=10)
+    before = shed_count(server, "ip_rate_limit")
+
+    async def scenario():
+        return [
+            await send_request(middleware, http_scope("POST", "/api/token", client=client))
+            for client in ("10.0.0.1", "10.0.0.1", "10.0.0.2")
+        ]
+
+    assert [status for status, _ in asyncio.run(scenario())] == [200, 429, 200]
+    assert shed_count(server, "ip_rate_limit") - before == 1
+
+
+def run_while_busy(server, busy_scopes, scope):
+    """Hold busy_scopes in flight, then send scope; returns its status, headers and the gauge."""
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if any(scope is busy for busy in busy_scopes):
+            await release.wait()
+        await ok_app(scope, receive, send)
+
+    middleware = server.AdmissionControlMiddleware(app)
+
+    async def scenario():
+        held = [asyncio.create_task(send_request(middleware, busy)) for busy in busy_scopes]
+        await asyncio.sleep(0.05)
+        gauge = server.metrics.snapshot()["gauges"]["admission_in_flight"]
+        result = await send_request(middleware, scope)
+        release.set()
+        assert [status for status, _ in await asyncio.gather(*held)] == [200] * len(busy_scopes)
+        return result, gauge
+
+    return asyncio.run(scenario())
+
+
+def test_full_route_class_gets_503_while_other_classes_pass(server, monkeypatch):
+    monkeypatch.setitem(server.ADMISSION_CONCURRENCY_LIMITS, "heavy", 1)
+    monkeypatch.setattr(server, "ADMISSION_MAX_IN_FLIGHT", 10)
+    export = http_scope("GET", "/api/groups/1/export")
+    before = shed_count(server, "heavy_concurrency")
+
+    (status, headers), gauge = run_while_busy(server, [export], http_scope("GET", "/api/groups/2/export", client="10.0.0.2"))
+    assert status == 503 and headers["retry-after"] == "1"
+    assert gauge["heavy"] == 1 and gauge["total"] == 1
+    assert shed_count(server, "heavy_concurrency") - before == 1
+
+    (status, _), _ = run_while_busy(server, [export], http_scope("GET", "/api/groups/", client="10.0.0.2"))
+    assert status == 200
+
+
+def test_global_cap_sheds_every_class_but_not_health(server, monkeypatch):
+    monkeypatch.setattr(server, "ADMISSION_MAX_IN_FLIGHT", 2)
+    busy = [http_scope("GET", "/api/groups/", client=f"10.0.1.{n}") for n in range(2)]
+    before = shed_count(server, "write_concurrency")
+
+    (status, _), gauge = run_while_busy(server, busy, http_scope("POST", "/api/groups/", client="10.0.0.9"))
+    assert status == 503
+    assert gauge["total"] == 2 and gauge["read"] == 2
+    assert shed_count(server, "write_concurrency") - before == 1
+
+    for path in sorted(server.ADMISSION_EXEMPT_PATHS):
+        (status, _), _ = run_while_busy(server, busy, http_scope("GET", path, client="10.0.0.9"))
+        assert status == 200, path
+
+
+def test_forwarded_address_is_only_taken_from_trusted_proxies(server, monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("172.28.0.10")])
+    forged = {"x-real-ip": "203.0.113.9", "x-forwarded-for": "203.0.113.9"}
+
+    assert server.client_address(http_scope("GET", "/api/groups/", client="198.51.100.7"), forged) == "198.51.100.7"
+    assert server.client_address(http_scope("GET", "/api/groups/", client="172.28.0.10"), forged) == "203.0.113.9"
+    # Without X-Real-IP the proxy's own (last) X-Forwarded-For entry wins over what the client sent
+    proxied = {"x-forwarded-for": "203.0.113.9, 198.51.100.7"}
+    assert server.client_address(http_scope("GET", "/api/groups/", client="172.28.0.10"), proxied) == "198.51.100.7"
@@ -0,0 +1,117 @@
+"""
+Archived cycles: once a closed cycle's rows are moved to the *_archive tables,
+the history endpoints (expense and settlement lists, splits, search, activity,
+sync and stats) still return them, and deleting the group counts them.
+"""
+import uuid
+
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+AMOUNTS = (30.0, 45.0)
+
+
+def run_archive_job(server, group_id, cycle):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        job_id = server.enqueue_job(cursor, 'archive_cycle', {"group_id": group_id, "settlement_cycle": cycle})
+        conn.commit()
+        cursor.execute("SELECT id, job_type, payload, progress, attempts, max_attempts FROM jobs WHERE id = %s", (job_id,))
+        server.run_job(conn, cursor.fetchone())
+        cursor.execute("SELECT status, result FROM jobs WHERE id = %s", (job_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def count_active_rows(server, group_id):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM expenses WHERE group_id = %s)
+                 + (SELECT COUNT(*) FROM settlements WHERE group_id = %s)
+        """, (group_id, group_id))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@pytest.fixture
+def archived_group(server, db_schema):
+    members = create_users(server, f"archive{uuid.uuid4().hex[:8]}", 3)
+    group_id = create_group(server, members)
+    expenses = [
+        call_endpoint(
+            server, server.create_expense,
+            server.ExpenseCreate(
+                description=f"Archivable dinner {n}", amount=amount, group_id=group_id,
+                paid_by_user_id=members[n].id, split_type="equal", splits={m.id: 0 for m in members}
+            ),
+            idempotency_key=None, current_user=members[n]
+        )
+        for n, amount in enumerate(AMOUNTS)
+    ]
+    settled = call_endpoint(
+        server, server.record_settlements_batch, group_id,
+        server.SettlementBatchCreate(apply_suggested=True), current_user=members[0]
+    )
+    assert settled["cycle_closed"]
+
+    job = run_archive_job(server, group_id, 1)
+    assert job["status"] == "succeeded", job
+    assert count_active_rows(server, group_id) == 0
+    return group_id, members, expenses, settled["settlements"]
+
+
+def test_group_lists_and_splits_include_archived_rows(server, archived_group):
+    group_id, members, expenses, settlements = archived_group
+    me = members[0]
+
+    listed = call_endpoint(server, server.get_group_expenses, group_id, current_user=me)
+    assert sorted(e.id for e in listed) == sorted(e.id for e in expenses)
+
+    listed_settlements = call_endpoint(server, server.get_group_settlements, group_id, current_user=me)
+    assert len(listed_settlements) == len(settlements)
+
+    everything = call_endpoint(server, server.get_all_expenses, current_user=me)
+    assert {e.id for e in expenses} <= {row["id"] for row in everything}
+
+    splits = call_endpoint(server, server.get_expense_splits, expenses[0].id, current_user=me)
+    assert len(splits["splits"]) == len(members)
+
+
+def test_feeds_search_and_stats_include_archived_rows(server, archived_group):
+    group_id, members, expenses, settlements = archived_group
+    me = members[0]
+
+    hits = call_endpoint(server, server.search_history, q="archivable", limit=20, cursor_token=None, current_user=me)
+    assert {e.id for e in expenses} <= {item["id"] for item in hits["items"] if item["type"] == "expense"}
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        page = server.fetch_activity_page(cursor, me.id, limit=50, offset=0)
+        assert page["total"] == len(expenses) + len(settlements)
+        participants = {item["id"]: item["participants"] for item in page["items"] if item["type"] == "expense"}
+        assert all(len(participants[e.id]) == len(members) for e in expenses)
+
+        days = sorted(e.expense_date.date() for e in expenses)
+        rows = server.query_spending_stats(cursor, 'group', group_id, days[0], days[-1])
+        assert server.summarize_spending(rows, [])["totals"]["paid"] == pytest.approx(sum(AMOUNTS))
+    finally:
+        cursor.close()
+        conn.close()
+
+    changes = call_endpoint(server, server.get_sync_changes, since=None, current_user=me)
+    assert {e.id for e in expenses} <= {row["id"] for row in changes["changes"]["expenses"]}
+
+
+def test_group_deletion_counts_archived_rows(server, archived_group):
+    group_id, members, expenses, settlements = archived_group
+    deleted = call_endpoint(server, server.delete_group, group_id, current_user=members[0])
+    assert deleted["deleted"] == {"expenses": len(expenses), "settlements": len(settlements), "members": len(members)}
@@ -0,0 +1,76 @@
+"""
+Degraded reads: the circuit breaker makes requests fail fast while the database
+is unreachable, and the snapshot store keeps the last good response per key.
+"""
+import threading
+import time
+
+import pytest
+
+
+def test_breaker_opens_after_threshold_and_probes_after_reset(server):
+    breaker = server.CircuitBreaker(failure_threshold=2, reset_seconds=0.2)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state() == "closed"
+
+    breaker.record_failure()
+    assert breaker.state() == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.allow()  # the probe
+    assert not breaker.allow()  # only one per reset period
+    breaker.record_success()
+    assert breaker.state() == "closed" and breaker.allow()
+
+
+def test_open_breaker_fails_fast_without_touching_the_pool(server, monkeypatch):
+    breaker = server.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    monkeypatch.setattr(server, "db_breaker", breaker)
+
+    dependency = server.get_db_connection()
+    with pytest.raises(server.HTTPException) as exc_info:
+        next(dependency)
+    assert exc_info.value.status_code == 503
+    assert int(exc_info.value.headers["Retry-After"]) > 0
+
+
+def test_snapshot_store_keeps_last_good_body(server, tmp_path):
+    store = server.SnapshotStore(str(tmp_path / "snapshots.sqlite3"), max_age_hours=1)
+    assert store.load("1 /api/groups/?") is None
+
+    store.save("1 /api/groups/?", b'[{"id": 1}]')
+    store.save("1 /api/groups/?", b'[{"id": 1}, {"id": 2}]')
+    body, saved_at = store.load("1 /api/groups/?")
+    assert body == b'[{"id": 1}, {"id": 2}]'
+    assert saved_at <= time.time()
+    assert store.load("2 /api/groups/?") is None
+
+
+def test_snapshot_store_counts_concurrent_writes_and_bounds_its_digests(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "SNAPSHOT_DIGEST_CACHE_SIZE", 50)
+    store = server.SnapshotStore(str(tmp_path / "snapshots.sqlite3"), max_age_hours=1)
+
+    def save_many(worker):
+        for n in range(40):
+            store.save(f"{worker} /api/groups/{n}/balances?", str(n).encode())
+
+    threads = [threading.Thread(target=save_many, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store._writes == 4 * 40
+    assert len(store._digests) <= 50
+
+
+def test_only_first_activity_page_is_snapshotted(server):
+    def scope(path, query=b""):
+        return {"path": path, "query_string": query}
+
+    assert server.snapshot_key(scope("/api/activity", b"limit=20"), "7") == "7 /api/activity?limit=20"
+    assert server.snapshot_key(scope("/api/activity", b"offset=0"), "7") is not None
+    assert server.snapshot_key(scope("/api/activity", b"offset=20"), "7") is None
+    assert server.snapshot_key(scope("/api/groups/12/balances"), "7") == "7 /api/groups/12/balances?"
+    assert server.snapshot_key(scope("/api/groups/12/expenses"), "7") is None
@@ -0,0 +1,167 @@
+"""
+Bulk expense import: invalid rows are reported without blocking the valid ones
+(unless all_or_nothing is set), CSV documents parse into the same rows, and
+splits are attached to the right expenses even when ids are not consecutive
+or other inserts interleave with a chunk's ids.
+"""
+import uuid
+
+import pytest
+
+from .conftest import create_group, create_users
+
+
+def import_rows(server, group_id, user, rows, all_or_nothing=False, session_sql=None):
+    conn = server.db_pool.get_connection()
+    try:
+        if session_sql:
+            cursor = conn.cursor()
+            cursor.execute(session_sql)
+            cursor.close()
+        return server.import_expenses_into_group(conn, group_id, user, rows, all_or_nothing)
+    finally:
+        if session_sql:
+            # Pooled connections keep their session, so restore the default
+            cursor = conn.cursor()
+            cursor.execute("SET SESSION auto_increment_increment = DEFAULT")
+            cursor.close()
+        conn.close()
+
+
+def splits_by_expense(server, expense_ids):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        placeholders = ",".join(["%s"] * len(expense_ids))
+        cursor.execute(f"""
+            SELECT e.id, e.amount, SUM(es.amount) as split_total, COUNT(es.id) as splits
+            FROM expenses e LEFT JOIN expense_splits es ON es.expense_id = e.id
+            WHERE e.id IN ({placeholders})
+            GROUP BY e.id, e.amount
+        """, expense_ids)
+        return {row["id"]: row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def expense_row(payer, members, amount, **fields):
+    return {"description": "Receipt", "amount": amount, "paid_by_user_id": payer.id,
+            "split_type": "equal", "splits": {m.id: 0 for m in members}, **fields}
+
+
+@pytest.fixture
+def import_group(server, db_schema):
+    members = create_users(server, f"import{uuid.uuid4().hex[:8]}", 3)
+    return create_group(server, members), members
+
+
+def test_invalid_rows_are_reported_and_valid_rows_imported(server, import_group):
+    group_id, members = import_group
+    me = members[0]
+    rows = [
+        expense_row(me, members, 30.0),
+        expense_row(me, members, -5.0),
+        expense_row(me, members, 12.0, split_type="exact", splits={members[0].id: 5, members[1].id: 5}),
+        "not a row",
+        expense_row(me, members, 9.0, split_type="percentage", splits={members[0].id: 50, members[1].id: 50}),
+    ]
+    result = import_rows(server, group_id, me, rows)
+    assert result["created"] == 2 and result["failed"] == 3
+    assert [error["row"] for error in result["errors"]] == [2, 3, 4]
+    assert [item["row"] for item in result["imported"]] == [1, 5]
+
+
+def test_all_or_nothing_rejects_the_whole_import(server, import_group):
+    group_id, members = import_group
+    me = members[0]
+    with pytest.raises(server.HTTPException) as exc_info:
+        import_rows(server, group_id, me, [expense_row(me, members, 10.0), expense_row(me, members, 0)],
+                    all_or_nothing=True)
+    assert exc_info.value.status_code == 422
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM expenses WHERE group_id = %s", (group_id,))
+        assert cursor.fetchone()[0] == 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_csv_rows_parse_like_json_rows(server):
+    rows = server.parse_expense_batch_csv(
+        "description,amount,paid_by_user_id,split_type,splits,category\n"
+        "Dinner,30,1,equal,1;2;3,Food\n"
+        "Taxi,12.5,2,exact,1:5;2:7.5,\n"
+    )
+    assert rows[0]["splits"] == {"1": 0, "2": 0, "3": 0} and rows[0]["category"] == "Food"
+    assert rows[1]["splits"] == {"1": "5", "2": "7.5"} and "category" not in rows[1]
+    item = server.ExpenseBatchItem(**rows[1])
+    assert item.splits == {1: 5.0, 2: 7.5}
+
+
+@pytest.mark.parametrize("increment", [1, 3])
+def test_splits_belong_to_their_expense_whatever_the_id_step(server, import_group, increment):
+    group_id, members = import_group
+    me = members[0]
+    rows = [expense_row(members[n % 3], members, 10.0 + n) for n in range(server.BATCH_INSERT_CHUNK_SIZE + 7)]
+    result = import_rows(server, group_id, me, rows,
+                         session_sql=f"SET SESSION auto_increment_increment = {increment}")
+    expense_ids = [item["expense_id"] for item in result["imported"]]
+    stored = splits_by_expense(server, expense_ids)
+    assert len(stored) == len(rows)
+    for expense_id in expense_ids:
+        assert stored[expense_id]["splits"] == len(members)
+        assert float(stored[expense_id]["split_total"]) == pytest.approx(float(stored[expense_id]["amount"]), abs=0.02)
+
+
+class InterleavingCursor:
+    """Stands in for a cursor on a server where another writer's ids land inside each chunk's id range."""
+
+    def __init__(self, connection_id=1, step=1):
+        self._connection = type("Connection", (), {"connection_id": connection_id})()
+        self.step = step
+        self.next_id = 100
+        self.owned = []
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        if sql.startswith("INSERT"):
+            rows = len(params) // 2
+            self.lastrowid = self.next_id
+            # Every other id goes to a concurrent insert into the same table
+            self.owned.extend(range(self.next_id, self.next_id + rows * 2, 2))
+            self.next_id += rows * 2
+        elif "auto_increment_increment" in sql:
+            self.result = [(self.step,)]
+        else:
+            self.result = [(row_id,) for row_id in self.owned if row_id >= params[1]]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_chunk_ids_are_read_back_when_other_inserts_interleave(server):
+    cursor = InterleavingCursor()
+    rows = [("x", n) for n in range(5)]
+    ids = server.insert_rows_chunked(cursor, "INSERT INTO expenses (description, group_id) VALUES ", "(%s, %s)", rows,
+                                     chunk_size=3, owner=("group_id", 7))
+    assert ids == [100, 102, 104, 106, 108]
+    assert not any("auto_increment_increment" in sql for sql in cursor.statements)
+
+    cursor.owned.append(cursor.next_id + 1)  # a row the group's lock should have kept out
+    with pytest.raises(RuntimeError):
+        server.insert_rows_chunked(cursor, "INSERT INTO expenses (description, group_id) VALUES ", "(%s, %s)", rows[:2],
+                                   owner=("group_id", 7))
+
+
+def test_id_step_is_read_once_per_connection(server):
+    cursor = InterleavingCursor(connection_id=f"step-{uuid.uuid4().hex}", step=3)
+    for _ in range(2):
+        server.insert_rows_chunked(cursor, "INSERT INTO users (name, email) VALUES ", "(%s, %s)", [("a", "b")] * 2)
+    assert sum("auto_increment_increment" in sql for sql in cursor.statements) == 1
@@ -0,0 +1,65 @@
+"""
+POST /api/groups/{id}/members:bulk: set-based add, remove and replace, with
+removed members reactivated (not duplicated) when they are added again.
+"""
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+
+def member_rows(server, group_id):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id, is_active FROM group_members WHERE group_id = %s", (group_id,))
+        return {user_id: bool(is_active) for user_id, is_active in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def bulk(server, group_id, user, action, users):
+    return call_endpoint(
+        server, server.bulk_update_group_members, group_id,
+        server.GroupMembersBulk(action=action, user_ids=[u.id for u in users]), current_user=user
+    )
+
+
+def test_add_remove_replace_report_the_diff(server, db_schema):
+    owner, first, *roster = create_users(server, "roster", 8)
+    group_id = create_group(server, [owner, first])
+
+    added = bulk(server, group_id, owner, "add", roster + [first])
+    assert added["added"] == sorted(u.id for u in roster)
+    assert added["reactivated"] == [] and added["removed"] == []
+    assert added["member_count"] == 8
+
+    removed = bulk(server, group_id, owner, "remove", roster[:3])
+    assert removed["removed"] == sorted(u.id for u in roster[:3])
+    assert removed["member_count"] == 5
+
+    replaced = bulk(server, group_id, owner, "replace", [first] + roster[:2])
+    assert replaced["added"] == []
+    assert replaced["reactivated"] == sorted(u.id for u in roster[:2])
+    assert replaced["removed"] == sorted(u.id for u in roster[3:])
+
+    rows = member_rows(server, group_id)
+    assert len(rows) == 8  # removed members keep their row
+    assert {user_id for user_id, active in rows.items() if active} == {owner.id, first.id, roster[0].id, roster[1].id}
+
+
+def test_unknown_users_and_removing_yourself_are_rejected(server, db_schema):
+    owner, other = create_users(server, "bulkcheck", 2)
+    group_id = create_group(server, [owner, other])
+
+    with pytest.raises(server.HTTPException) as exc_info:
+        call_endpoint(
+            server, server.bulk_update_group_members, group_id,
+            server.GroupMembersBulk(action="add", user_ids=[other.id, 10 ** 9]), current_user=owner
+        )
+    assert exc_info.value.status_code == 400
+
+    with pytest.raises(server.HTTPException) as exc_info:
+        bulk(server, group_id, owner, "remove", [owner])
+    assert exc_info.value.status_code == 400
+    assert member_rows(server, group_id) == {owner.id: True, other.id: True}
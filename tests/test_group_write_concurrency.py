@@ -0,0 +1,133 @@
+"""
+Concurrency stress test for group writes.
+
+Several threads add expenses to one group and settle it up at the same time,
+each on its own pooled connection. Writes to a group are serialized on the
+group row, so afterwards no write may be lost and every closed settlement
+cycle must net to zero.
+"""
+import random
+import threading
+
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+WORKERS = 6
+OPERATIONS_PER_WORKER = 25
+BALANCE_THRESHOLD = 0.05
+
+
+@pytest.fixture
+def race_group(server, db_schema):
+    members = create_users(server, "race", 4)
+    return create_group(server, members), members
+
+
+def test_concurrent_writes_lose_nothing_and_closed_cycles_net_to_zero(server, race_group):
+    group_id, members = race_group
+    outcomes = {"expenses": 0, "settlement_batches": 0, "settlements": 0, "rejected": 0}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(OPERATIONS_PER_WORKER):
+            user = rng.choice(members)
+            try:
+                if rng.random() < 0.7:
+                    call_endpoint(
+                        server, server.create_expense,
+                        server.ExpenseCreate(
+                            description="Race expense", amount=round(rng.uniform(1, 90), 2), group_id=group_id,
+                            paid_by_user_id=user.id, split_type="equal", splits={m.id: 0 for m in members}
+                        ),
+                        idempotency_key=None, current_user=user
+                    )
+                    with lock:
+                        outcomes["expenses"] += 1
+                else:
+                    result = call_endpoint(
+                        server, server.record_settlements_batch, group_id,
+                        server.SettlementBatchCreate(apply_suggested=True), current_user=user
+                    )
+                    with lock:
+                        outcomes["settlement_batches"] += 1
+                        outcomes["settlements"] += len(result["settlements"])
+            except server.HTTPException as exc:
+                # Nothing to settle, or the group stayed busy through every retry
+                assert exc.status_code in (400, 503), exc.detail
+                with lock:
+                    outcomes["rejected"] += 1
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT settlement_cycle, data_version FROM `groups` WHERE id = %s", (group_id,))
+        group_row = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) as count, MAX(settlement_cycle) as max_cycle FROM expenses WHERE group_id = %s", (group_id,))
+        expense_stats = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) as count, MAX(settlement_cycle) as max_cycle FROM settlements WHERE group_id = %s", (group_id,))
+        settlement_stats = cursor.fetchone()
+
+        # No lost updates: every successful write is stored and bumped the version exactly once
+        assert expense_stats["count"] == outcomes["expenses"]
+        assert settlement_stats["count"] == outcomes["settlements"]
+        assert group_row["data_version"] == outcomes["expenses"] + outcomes["settlement_batches"]
+
+        # Nothing was written into a cycle beyond the current one
+        current_cycle = group_row["settlement_cycle"]
+        assert (expense_stats["max_cycle"] or 1) <= current_cycle
+        assert (settlement_stats["max_cycle"] or 1) <= current_cycle
+
+        # Every closed cycle nets to zero for every member
+        for cycle in range(1, current_cycle):
+            balances = server.compute_cycle_balances(conn, group_id, cycle)
+            assert all(abs(b["balance"]) < BALANCE_THRESHOLD for b in balances.values()), (cycle, balances)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_writes_to_other_groups_are_not_blocked(server, db_schema):
+    members = create_users(server, "parallel", 2)
+    locked_group_id = create_group(server, members)
+    free_group_id = create_group(server, members)
+
+    # Hold the write lock on one group for the duration of the test
+    holder = server.db_pool.get_connection()
+    holder_cursor = holder.cursor(dictionary=True)
+    server.begin_group_write(holder)
+    server.lock_group_for_write(holder_cursor, locked_group_id)
+
+    results = []
+
+    def write_free_group():
+        results.append(call_endpoint(
+            server, server.create_expense,
+            server.ExpenseCreate(
+                description="Unrelated", amount=10.0, group_id=free_group_id, paid_by_user_id=members[0].id,
+                split_type="equal", splits={m.id: 0 for m in members}
+            ),
+            idempotency_key=None, current_user=members[0]
+        ))
+
+    try:
+        thread = threading.Thread(target=write_free_group)
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "write to an unrelated group waited on another group's lock"
+        assert results and results[0].group_id == free_group_id
+    finally:
+        holder.rollback()
+        holder_cursor.close()
+        holder.close()
@@ -0,0 +1,120 @@
+"""
+Idempotency-Key on expense and settlement creation: a retry replays the stored
+response, a different payload under the same key is rejected, and a concurrent
+duplicate waits for the first request and then replays (or does the work itself
+if the first one rolled back).
+"""
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+
+def expense_count(server, group_id):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM expenses WHERE group_id = %s", (group_id,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@pytest.fixture
+def group(server, db_schema):
+    members = create_users(server, f"idem{uuid.uuid4().hex[:8]}", 2)
+    return create_group(server, members), members
+
+
+def new_expense(server, group_id, members, amount=40.0):
+    return server.ExpenseCreate(
+        description="Idempotent dinner", amount=amount, group_id=group_id,
+        paid_by_user_id=members[0].id, split_type="equal", splits={m.id: 0 for m in members}
+    )
+
+
+def test_retry_replays_the_stored_response(server, group):
+    group_id, members = group
+    key = str(uuid.uuid4())
+    expense = new_expense(server, group_id, members)
+
+    created = call_endpoint(server, server.create_expense, expense, idempotency_key=key, current_user=members[0])
+    replay = call_endpoint(server, server.create_expense, expense, idempotency_key=key, current_user=members[0])
+
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert json.loads(replay.body)["id"] == created.id
+    assert expense_count(server, group_id) == 1
+
+    settlement = server.SettlementCreate(group_id=group_id, payer_id=members[1].id, payee_id=members[0].id, amount=20.0)
+    paid = call_endpoint(server, server.record_settlement, settlement, idempotency_key=key + "-s", current_user=members[1])
+    repaid = call_endpoint(server, server.record_settlement, settlement, idempotency_key=key + "-s", current_user=members[1])
+    assert repaid.headers["Idempotent-Replayed"] == "true"
+    assert json.loads(repaid.body)["id"] == paid.id
+
+
+def test_same_key_with_a_different_payload_is_rejected(server, group):
+    group_id, members = group
+    key = str(uuid.uuid4())
+    call_endpoint(server, server.create_expense, new_expense(server, group_id, members), idempotency_key=key,
+                  current_user=members[0])
+
+    with pytest.raises(server.HTTPException) as exc_info:
+        call_endpoint(server, server.create_expense, new_expense(server, group_id, members, amount=41.0),
+                      idempotency_key=key, current_user=members[0])
+    assert exc_info.value.status_code == 422
+    assert expense_count(server, group_id) == 1
+
+
+@pytest.mark.parametrize("first_commits", [True, False])
+def test_concurrent_duplicate_waits_for_the_first_request(server, group, first_commits):
+    group_id, members = group
+    key = str(uuid.uuid4())
+    expense = new_expense(server, group_id, members)
+
+    # The first request claims the key and is still working on it
+    first = server.db_pool.get_connection()
+    first_cursor = first.cursor(dictionary=True)
+    first.start_transaction()
+    assert server.begin_idempotent_request(first_cursor, members[0].id, key, 'create_expense', expense) is None
+
+    outcome = {}
+
+    def duplicate():
+        outcome["result"] = call_endpoint(
+            server, server.create_expense, expense, idempotency_key=key, current_user=members[0]
+        )
+
+    thread = threading.Thread(target=duplicate)
+    thread.start()
+    time.sleep(0.5)
+    assert thread.is_alive(), "the duplicate should block on the claimed key"
+
+    try:
+        if first_commits:
+            server.complete_idempotent_request(
+                first_cursor, members[0].id, key, 201, {"id": 424242, "description": "from the first request"}
+            )
+            first.commit()
+        else:
+            first.rollback()
+    finally:
+        first_cursor.close()
+        first.close()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+
+    result = outcome["result"]
+    if first_commits:
+        assert result.headers["Idempotent-Replayed"] == "true"
+        assert json.loads(result.body)["id"] == 424242
+        assert expense_count(server, group_id) == 0
+    else:
+        # The claim was rolled back, so the duplicate did the work itself
+        assert result.description == "Idempotent dinner"
+        assert expense_count(server, group_id) == 1
@@ -0,0 +1,153 @@
+"""
+Job runner: leases and their reclaim after expiry, retries with backoff until
+max_attempts, and the group purge resuming from its saved checkpoint.
+"""
+import json
+
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+
+def run_sql(server, sql, params=()):
+    """Run one statement on a pooled connection and return its rows, if any."""
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.with_rows else None
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def job_row(server, job_id):
+    return run_sql(server, """
+        SELECT status, attempts, progress, result, last_error, locked_by,
+               TIMESTAMPDIFF(SECOND, NOW(), run_after) as due_in,
+               TIMESTAMPDIFF(SECOND, NOW(), locked_until) as lease_left
+        FROM jobs WHERE id = %s
+    """, (job_id,))[0]
+
+
+def queue_job(server, job_type, payload, **kwargs):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        job_id = server.enqueue_job(cursor, job_type, payload, **kwargs)
+        conn.commit()
+        return job_id
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def claim(server):
+    conn = server.db_pool.get_connection()
+    try:
+        return server.claim_next_job(conn)
+    finally:
+        conn.close()
+
+
+def run(server, job):
+    conn = server.db_pool.get_connection()
+    try:
+        server.run_job(conn, job)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def idle_queue(server, db_schema):
+    """No runnable jobs left over from other tests, so claims see only this test's jobs."""
+    run_sql(server, "DELETE FROM jobs WHERE status IN ('queued', 'running')")
+
+
+@pytest.fixture
+def failing_job_type(server, monkeypatch):
+    def always_fails(ctx):
+        raise RuntimeError("boom")
+    monkeypatch.setitem(server.JOB_HANDLERS, 'test_always_fails', always_fails)
+    return 'test_always_fails'
+
+
+def test_claim_leases_the_job_until_the_lease_expires(server, idle_queue, failing_job_type):
+    job_id = queue_job(server, failing_job_type, {})
+
+    job = claim(server)
+    assert job["id"] == job_id and job["attempts"] == 1
+    row = job_row(server, job_id)
+    assert row["status"] == "running" and row["locked_by"] == server.JOB_WORKER_ID
+    assert row["lease_left"] > 0
+    assert claim(server) is None  # leased to the first worker
+
+    # The worker died without finishing: once the lease runs out another worker takes it
+    run_sql(server, "UPDATE jobs SET locked_until = NOW() - INTERVAL 1 SECOND WHERE id = %s", (job_id,))
+    reclaimed = claim(server)
+    assert reclaimed["id"] == job_id and reclaimed["attempts"] == 2
+
+
+def test_failures_back_off_then_fail_after_max_attempts(server, idle_queue, failing_job_type):
+    job_id = queue_job(server, failing_job_type, {}, max_attempts=2)
+
+    run(server, claim(server))
+    row = job_row(server, job_id)
+    assert row["status"] == "queued" and row["last_error"] == "boom"
+    assert row["locked_by"] is None
+    assert 0 < row["due_in"] <= 5  # 5s backoff after the first attempt
+    assert claim(server) is None  # not due yet
+
+    run_sql(server, "UPDATE jobs SET run_after = NOW() WHERE id = %s", (job_id,))
+    job = claim(server)
+    assert job["attempts"] == 2
+    run(server, job)
+    row = job_row(server, job_id)
+    assert row["status"] == "failed" and row["attempts"] == 2 and row["last_error"] == "boom"
+    assert claim(server) is None
+
+
+def test_group_purge_resumes_from_its_checkpoint(server, idle_queue, monkeypatch):
+    members = create_users(server, "purge", 3)
+    group_id = create_group(server, members)
+    for n in range(3):
+        call_endpoint(
+            server, server.create_expense,
+            server.ExpenseCreate(
+                description=f"Purged expense {n}", amount=12.0, group_id=group_id,
+                paid_by_user_id=members[0].id, split_type="equal", splits={m.id: 0 for m in members}
+            ),
+            idempotency_key=None, current_user=members[0]
+        )
+    deleted = call_endpoint(server, server.delete_group, group_id, current_user=members[0])
+    job_id = deleted["job_id"]
+
+    # Crash right after the first batch is committed
+    monkeypatch.setattr(server, "GROUP_PURGE_BATCH_SIZE", 1)
+    checkpoint = server.JobContext.checkpoint
+
+    def crash_after_first_batch(ctx, progress):
+        checkpoint(ctx, progress)
+        raise RuntimeError("worker crashed")
+
+    monkeypatch.setattr(server.JobContext, "checkpoint", crash_after_first_batch)
+    run(server, claim(server))
+    row = job_row(server, job_id)
+    assert row["status"] == "queued"
+    saved = json.loads(row["progress"])
+    assert saved["expenses"] == 1 and saved["expense_splits"] == 3
+
+    monkeypatch.setattr(server.JobContext, "checkpoint", checkpoint)
+    run_sql(server, "UPDATE jobs SET run_after = NOW() WHERE id = %s", (job_id,))
+    job = claim(server)
+    assert job["id"] == job_id
+    run(server, job)
+
+    row = job_row(server, job_id)
+    assert row["status"] == "succeeded"
+    # Counts carry on from the checkpoint instead of starting over
+    assert json.loads(row["result"])["deleted"] == {"expense_splits": 9, "expenses": 3, "settlements": 0, "members": 3}
+    assert run_sql(server, "SELECT id FROM `groups` WHERE id = %s", (group_id,)) == []
+    assert run_sql(server, "SELECT id FROM expenses WHERE group_id = %s", (group_id,)) == []
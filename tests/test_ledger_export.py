@@ -0,0 +1,57 @@
+"""
+Ledger exports: the connection is checked out before the response starts, so an
+unavailable database is a 503 rather than a truncated 200, and a stream the
+client abandons drops its session instead of reading the rest of the result.
+"""
+import pytest
+
+
+def test_export_fails_before_streaming_when_the_database_is_unavailable(server, monkeypatch):
+    breaker = server.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    monkeypatch.setattr(server, "db_breaker", breaker)
+    user = server.User(id=1, email="seed0@example.com", name="Seed User 0")
+
+    with pytest.raises(server.HTTPException) as exc_info:
+        server.export_group_ledger(1, export_format="csv", cycle_from=None, cycle_to=None, current_user=user)
+    assert exc_info.value.status_code == 503
+
+
+def discarded_count(server):
+    return server.metrics.snapshot()["counters"].get("db_connections_discarded", 0)
+
+
+def test_abandoned_stream_drops_its_session(server, seeded_db, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_FETCH_SIZE", 10)
+    group = seeded_db["groups"][0]
+    before = discarded_count(server)
+
+    connection = server.db_pool.get_connection()
+    connection_id = connection.connection_id
+    rows = server.LedgerRows(connection, None, "= %s", (group["id"],), None, None)
+    stream = iter(rows)
+    assert [next(stream) for _ in range(5)]
+    rows.close()  # what the response's background task does after a disconnect
+    stream.close()
+    assert discarded_count(server) - before == 1
+
+    # The pool hands out working connections again, on a new session
+    checks = [server.db_pool.get_connection() for _ in range(server.db_pool.pool_size)]
+    try:
+        for check in checks:
+            cursor = check.cursor()
+            cursor.execute("SELECT CONNECTION_ID()")
+            assert cursor.fetchone()[0] != connection_id
+            cursor.close()
+    finally:
+        for check in checks:
+            check.close()
+
+
+def test_finished_stream_returns_its_connection(server, seeded_db):
+    group = seeded_db["groups"][0]
+    before = discarded_count(server)
+    rows = server.LedgerRows(server.db_pool.get_connection(), None, "= %s", (group["id"],), 1, 1)
+    assert sum(1 for _ in rows) > 0
+    rows.close()  # the background task after iteration already closed it
+    assert discarded_count(server) == before
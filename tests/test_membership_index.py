@@ -0,0 +1,90 @@
+"""
+Membership index: removals on this worker deny access at once, additions made
+elsewhere are allowed on the next miss, and a load that raced with an
+invalidation is not cached.
+"""
+import pytest
+
+from .conftest import call_endpoint, create_group, create_users
+
+
+def is_member(server, user, group_id):
+    conn = server.db_pool.get_connection()
+    try:
+        return server.membership_index.is_member(conn, user.id, group_id)
+    finally:
+        conn.close()
+
+
+def test_removed_member_is_denied_right_away(server, db_schema):
+    owner, member = create_users(server, "memberremove", 2)
+    group_id = create_group(server, [owner, member])
+    assert is_member(server, member, group_id)  # now cached
+
+    call_endpoint(
+        server, server.bulk_update_group_members, group_id,
+        server.GroupMembersBulk(action="remove", user_ids=[member.id]), current_user=owner
+    )
+    assert not is_member(server, member, group_id)
+    with pytest.raises(server.HTTPException) as exc_info:
+        call_endpoint(server, server.get_group_expenses, group_id, current_user=member)
+    assert exc_info.value.status_code == 403
+
+
+def test_member_added_elsewhere_is_allowed_on_a_miss(server, db_schema):
+    owner, newcomer = create_users(server, "memberadd", 2)
+    group_id = create_group(server, [owner])
+    assert not is_member(server, newcomer, group_id)  # caches a set without the group
+
+    # Added by another worker: nothing invalidates this worker's entry
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)", (group_id, newcomer.id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    assert is_member(server, newcomer, group_id)
+
+
+class RacingStatements:
+    """Stands in for prepared_statements: the membership changes while the load's read is in flight."""
+
+    def __init__(self, group_ids, on_read):
+        self.group_ids = group_ids
+        self.on_read = on_read
+
+    def execute(self, db_conn, name, params):
+        rows = [{"group_id": group_id} for group_id in self.group_ids]
+        self.on_read()
+        return rows
+
+
+@pytest.mark.parametrize("invalidation", ["user", "group"])
+def test_load_racing_an_invalidation_is_not_cached(server, monkeypatch, invalidation):
+    index = server.MembershipIndex(ttl_seconds=60, max_users=10)
+
+    def removed_meanwhile():
+        if invalidation == "user":
+            index.invalidate([7])
+        else:
+            index.invalidate_group(5)
+
+    monkeypatch.setattr(server, "prepared_statements", RacingStatements([5], removed_meanwhile))
+    assert index.is_member(None, 7, 5)  # the request that raced the removal still sees the old read
+    assert index._cached(7) is None  # but the pre-removal set was not stored
+
+    monkeypatch.setattr(server, "prepared_statements", RacingStatements([], lambda: None))
+    assert not index.is_member(None, 7, 5)
+    assert index._cached(7) == frozenset()
+
+
+def test_prime_skips_users_invalidated_during_warm_up(server):
+    index = server.MembershipIndex(ttl_seconds=60, max_users=10)
+    generation = index.generation()
+    index.invalidate([1])
+    index.prime({1: {5}, 2: {6}}, generation)
+    assert index._cached(1) is None
+    assert index._cached(2) == frozenset({6})
@@ -0,0 +1,187 @@
+"""
+Query-plan regression suite.
+
+Every endpoint below is run against the seeded database through a connection
+wrapper that EXPLAINs each SELECT before executing it. A test fails if any plan
+reads one of the history tables with a full table or full index scan.
+"""
+import re
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# Tables that grow with history and must always be reached through an index
+HISTORY_TABLES = {"expenses", "expense_splits", "settlements", "group_members", "expense_rollups"}
+FULL_SCAN_TYPES = {"ALL", "index"}
+
+TABLE_ALIAS_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+`?(\w+)`?"
+    r"(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|INNER|LEFT|RIGHT|JOIN|GROUP|ORDER|LIMIT|UNION)\b)(\w+))?",
+    re.IGNORECASE
+)
+
+
+class PlanRecorder:
+    def __init__(self, connection):
+        self.connection = connection
+        self.explained = []
+        self.violations = []
+
+    def check(self, sql, params):
+        aliases = {}
+        for table, alias in TABLE_ALIAS_RE.findall(sql):
+            aliases[table] = table.lower()
+            if alias:
+                aliases[alias] = table.lower()
+
+        cursor = self.connection.cursor(dictionary=True, buffered=True)
+        try:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        statement = " ".join(sql.split())
+        self.explained.append(statement)
+        for row in plan:
+            table = aliases.get(row["table"], row["table"])
+            if table in HISTORY_TABLES and row["type"] in FULL_SCAN_TYPES:
+                self.violations.append(f"{row['type']} scan of {table} in: {statement[:300]}")
+
+
+class ExplainingCursor:
+    def __init__(self, cursor, recorder):
+        self._cursor = cursor
+        self._recorder = recorder
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        if operation.lstrip().upper().startswith("SELECT"):
+            self._recorder.check(operation, params)
+        return self._cursor.execute(operation, params, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ExplainingConnection:
+    def __init__(self, connection, recorder):
+        self._connection = connection
+        self._recorder = recorder
+
+    def cursor(self, *args, **kwargs):
+        return ExplainingCursor(self._connection.cursor(*args, **kwargs), self._recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def endpoint_calls(server, data):
+    group = data["groups"][0]
+    group_id = group["id"]
+    user_id = group["members"][0]
+    user_index = data["user_ids"].index(user_id)
+    user = server.User(id=user_id, email=f"seed{user_index}@example.com", name=f"Seed User {user_index}")
+
+    def first_expense_id(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM expenses WHERE group_id = %s LIMIT 1", (group_id,))
+        expense_id = cursor.fetchone()[0]
+        cursor.close()
+        return expense_id
+
+    return {
+        "user_by_email": lambda conn: server.get_user_by_email(conn, user.email),
+        "friends": lambda conn: server.get_friends(current_user=user, db_conn=conn),
+        "friend_balances": lambda conn: server.get_friend_balances(current_user=user, db_conn=conn),
+        "user_groups": lambda conn: server.get_user_groups(current_user=user, db_conn=conn),
+        "group": lambda conn: server.get_group(group_id, current_user=user, db_conn=conn),
+        "group_expenses": lambda conn: server.get_group_expenses(group_id, current_user=user, db_conn=conn),
+        "group_balances": lambda conn: server.get_group_balances(group_id, current_user=user, db_conn=conn),
+        "pairwise_balances": lambda conn: server.get_pairwise_balances(group_id, current_user=user, db_conn=conn),
+        "group_settlements": lambda conn: server.get_group_settlements(group_id, current_user=user, db_conn=conn),
+        "group_cycles": lambda conn: server.get_group_cycles(group_id, current_user=user, db_conn=conn),
+        "expense_splits": lambda conn: server.get_expense_splits(first_expense_id(conn), current_user=user, db_conn=conn),
+        "all_expenses": lambda conn: server.get_all_expenses(current_user=user, db_conn=conn),
+        "activity": lambda conn: server.get_activity(limit=20, offset=0, current_user=user, db_conn=conn),
+        "bootstrap": lambda conn: server.get_bootstrap(activity_limit=20, current_user=user, db_conn=conn),
+        "search": lambda conn: server.search_history(
+            q="seed", limit=20, cursor_token=None, current_user=user, db_conn=conn
+        ),
+        "sync_changes": lambda conn: server.get_sync_changes(
+            since=(datetime.utcnow() - timedelta(minutes=5)).isoformat(), current_user=user, db_conn=conn
+        ),
+        "group_stats": lambda conn: server.get_group_stats(
+            group_id, start=date(2025, 1, 10), end=date(2025, 6, 20), group_by="month,member",
+            current_user=user, db_conn=conn
+        ),
+        "user_stats": lambda conn: server.get_user_stats(
+            start=date(2025, 1, 10), end=date(2025, 6, 20), group_by="month,group", current_user=user, db_conn=conn
+        ),
+        "create_expense": lambda conn: server.create_expense(
+            server.ExpenseCreate(
+                description="Plan check", amount=30.0, group_id=group_id, paid_by_user_id=user_id,
+                split_type="equal", splits={member: 0 for member in group["members"][:3]}
+            ),
+            idempotency_key=None, current_user=user, db_conn=conn
+        ),
+        "record_settlement": lambda conn: server.record_settlement(
+            server.SettlementCreate(
+                group_id=group_id, payer_id=group["members"][1], payee_id=user_id, amount=1.0
+            ),
+            idempotency_key=None, current_user=user, db_conn=conn
+        ),
+    }
+
+
+ENDPOINTS = [
+    "user_by_email", "friends", "friend_balances", "user_groups", "group", "group_expenses", "group_balances",
+    "pairwise_balances", "group_settlements", "group_cycles", "expense_splits", "all_expenses", "activity", "bootstrap",
+    "search", "sync_changes", "group_stats", "user_stats", "create_expense", "record_settlement",
+]
+
+
+@pytest.fixture(autouse=True)
+def cold_caches(server, monkeypatch):
+    """Start each test with empty caches so every query is issued and explained."""
+    server.membership_index.clear()
+    # Run hot statements as text so the EXPLAINing cursor sees them too
+    monkeypatch.setattr(server.prepared_statements, "enabled", False)
+    monkeypatch.setattr(server, "result_cache", server.InProcessResultCache(server.RESULT_CACHE_MAX_BYTES))
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_endpoint_queries_use_indexes(server, seeded_db, endpoint):
+    call = endpoint_calls(server, seeded_db)[endpoint]
+    connection = server.db_pool.get_connection()
+    recorder = PlanRecorder(connection)
+    try:
+        call(ExplainingConnection(connection, recorder))
+    finally:
+        connection.close()
+
+    assert recorder.explained, f"{endpoint} issued no SELECT statements"
+    assert not recorder.violations, "\n".join(recorder.violations)
+
+
+@pytest.mark.parametrize("scope", ["group", "user"])
+def test_ledger_export_query_uses_indexes(server, seeded_db, scope):
+    group = seeded_db["groups"][0]
+    connection = server.db_pool.get_connection()
+    recorder = PlanRecorder(connection)
+    # LedgerRows returns the connection to the pool once it is exhausted
+    explaining = ExplainingConnection(connection, recorder)
+
+    if scope == "group":
+        rows = server.LedgerRows(explaining, None, "= %s", (group["id"],), 2, 3)
+    else:
+        rows = server.LedgerRows(
+            explaining, None,
+            "IN (SELECT group_id FROM group_members WHERE user_id = %s AND is_active = TRUE)",
+            (group["members"][0],), None, None
+        )
+    try:
+        assert sum(1 for _ in rows) > 0
+    finally:
+        rows.close()
+
+    assert not recorder.violations, "\n".join(recorder.violations)
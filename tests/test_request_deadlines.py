@@ -0,0 +1,126 @@
+"""
+Request deadlines: the remaining time is applied to the pooled connection as a
+session statement timeout, cleared before reuse, and a running statement can be
+killed from outside so the connection is released promptly.
+"""
+import asyncio
+import threading
+import time
+
+
+def session_timeout(server, conn, scope):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT @@{scope}.{server._session_timeout_variable}, @@{scope}.innodb_lock_wait_timeout")
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def test_session_deadline_is_applied_and_cleared(server):
+    conn = server.db_pool.get_connection()
+    try:
+        deadline = server.RequestDeadline(2.0)
+        server.apply_session_deadline(conn, deadline)
+        assert deadline.connection_id == conn.connection_id
+        statement_timeout, lock_wait_timeout = session_timeout(server, conn, "SESSION")
+        # milliseconds on MySQL, seconds on MariaDB
+        assert 0 < float(statement_timeout) <= (2.0 if server._session_timeout_variable == "max_statement_time" else 2000)
+        assert lock_wait_timeout == 2
+
+        server.clear_session_deadline(conn, deadline)
+        assert deadline.connection_id is None
+        assert session_timeout(server, conn, "SESSION") == session_timeout(server, conn, "GLOBAL")
+    finally:
+        conn.close()
+
+
+def test_running_statement_is_killed(server):
+    conn = server.db_pool.get_connection()
+    deadline = server.RequestDeadline(30.0)
+    server.apply_session_deadline(conn, deadline)
+    elapsed = []
+
+    def sleep():
+        cursor = conn.cursor()
+        started = time.monotonic()
+        try:
+            cursor.execute("SELECT SLEEP(10)")
+            cursor.fetchall()
+        except server.mysql.connector.Error:
+            pass  # MariaDB reports the interruption as an error, MySQL returns early
+        finally:
+            elapsed.append(time.monotonic() - started)
+            cursor.close()
+
+    try:
+        thread = threading.Thread(target=sleep)
+        thread.start()
+        time.sleep(0.5)
+        server.kill_running_statement(deadline)
+        thread.join(timeout=10)
+        assert elapsed and elapsed[0] < 5
+    finally:
+        server.clear_session_deadline(conn, deadline)
+        conn.close()
+
+
+def test_timeouts_map_to_504_and_other_errors_to_400(server):
+    timeout = server.db_http_error(server.mysql.connector.Error(msg="timed out", errno=server.ER_QUERY_TIMEOUT))
+    assert timeout.status_code == 504
+    other = server.db_http_error(server.mysql.connector.Error(msg="duplicate", errno=1062))
+    assert other.status_code == 400
+
+
+def run_middleware(server, app, receive, headers=()):
+    scope = {"type": "http", "method": "GET", "path": "/api/groups/", "query_string": b"", "headers": list(headers)}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(server.RequestDeadlineMiddleware(app)(scope, receive, send))
+    return sent
+
+
+def test_client_disconnect_during_a_read_cancels_the_request(server):
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["deadline"] = server.current_deadline.get()
+        seen["first_message"] = (await receive())["type"]
+        await asyncio.sleep(0.5)
+        seen["cancelled"] = seen["deadline"].cancelled
+        seen["next_message"] = (await receive())["type"]
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(0.2)
+        return {"type": "http.disconnect"}
+
+    run_middleware(server, app, receive)
+    assert seen["first_message"] == "http.request"
+    assert seen["cancelled"] == "client_disconnect"
+    assert seen["next_message"] == "http.disconnect"
+
+
+def test_deadline_cancels_a_read_whose_client_stays_connected(server):
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["deadline"] = server.current_deadline.get()
+        await asyncio.sleep(0.4)
+        seen["cancelled"] = seen["deadline"].cancelled
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()  # never disconnects
+
+    run_middleware(server, app, receive, headers=[(b"x-request-timeout", b"0.1")])
+    assert seen["cancelled"] == "deadline"
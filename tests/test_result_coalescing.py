@@ -0,0 +1,77 @@
+"""
+Single-flight coalescing: concurrent cache misses for the same result key run the
+computation once and share its result.
+"""
+import threading
+import time
+import uuid
+
+
+def coalesced_count(server):
+    return server.metrics.snapshot()["counters"].get("single_flight.coalesced", 0)
+
+
+def test_concurrent_misses_share_one_computation(server):
+    key = server.result_cache_key("balances", 1, 1, uuid.uuid4().int)
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"group_id": 1, "balances": []}
+
+    before = coalesced_count(server)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(server.cached_result(key, compute)))
+    leader.start()
+    started.wait(timeout=5)
+    followers = [
+        threading.Thread(target=lambda: results.append(server.cached_result(key, compute)))
+        for _ in range(5)
+    ]
+    for thread in followers:
+        thread.start()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"group_id": 1, "balances": []}] * 6
+    assert coalesced_count(server) - before == 5
+
+
+def test_a_failed_leader_is_not_shared_and_a_waiter_takes_over(server):
+    flights = server.SingleFlight()
+    started = threading.Event()
+    calls = []
+    outcomes = []
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            # The leader runs out of time, e.g. its client sent a short X-Request-Timeout
+            started.set()
+            time.sleep(0.1)
+            raise server.deadline_exceeded_error(None)
+        time.sleep(0.1)
+        return "computed"
+
+    def call():
+        try:
+            outcomes.append(flights.do("key", compute))
+        except server.HTTPException as exc:
+            outcomes.append(exc.status_code)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(timeout=5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert sorted(outcomes, key=str) == [504, "computed", "computed", "computed"]
+    assert len(calls) == 2  # one follower recomputed, the others shared its result
+    assert flights.do("key", lambda: "fresh") == "fresh"
@@ -0,0 +1,53 @@
+"""
+GET /api/search: keyset pages over hits with tied relevance scores return every
+hit exactly once.
+"""
+import uuid
+
+from .conftest import call_endpoint, create_group, create_users
+
+
+def test_pages_through_tied_scores_without_gaps_or_repeats(server, db_schema):
+    members = create_users(server, f"search{uuid.uuid4().hex[:8]}", 2)
+    group_id = create_group(server, members)
+    word = f"zq{uuid.uuid4().hex[:8]}"
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        # Identical text, so every expense (and every settlement) ties on score
+        expense_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO expenses (description, amount, paid_by, group_id) VALUES ",
+            "(%s, %s, %s, %s)",
+            [(f"Electricity {word}", 10.0 + n, members[0].id, group_id) for n in range(23)]
+        )
+        settlement_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO settlements (group_id, payer_id, payee_id, amount, notes) VALUES ",
+            "(%s, %s, %s, %s, %s)",
+            [(group_id, members[1].id, members[0].id, 5.0, f"Electricity {word}") for _ in range(4)]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    seen = []
+    scores = []
+    cursor_token = None
+    while True:
+        page = call_endpoint(
+            server, server.search_history, q=word, limit=5, cursor_token=cursor_token, current_user=members[0]
+        )
+        seen.extend((item["type"], item["id"]) for item in page["items"])
+        scores.extend(item["score"] for item in page["items"])
+        cursor_token = page["next_cursor"]
+        if cursor_token is None:
+            break
+
+    expected = [("expense", expense_id) for expense_id in expense_ids] + \
+        [("settlement", settlement_id) for settlement_id in settlement_ids]
+    assert len(seen) == len(set(seen))
+    assert sorted(seen) == sorted(expected)
+    assert scores == sorted(scores, reverse=True)
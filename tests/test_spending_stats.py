@@ -0,0 +1,113 @@
+"""
+Spending stats: rows read from expense_rollups for full months plus detail rows
+for the partial months at the edges of the range add up to the same totals as
+aggregating expenses/expense_splits directly.
+"""
+import random
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from .conftest import create_group, create_users
+
+GROUP_BY = ['month', 'category', 'member']
+
+
+@pytest.fixture(scope="module")
+def spending_group(server, db_schema):
+    """A group with expenses spread over January to April 2025, rollups rebuilt."""
+    rng = random.Random(7)
+    members = create_users(server, f"stats{uuid.uuid4().hex[:8]}", 4)
+    group_id = create_group(server, members)
+    member_ids = [member.id for member in members]
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        expense_rows = [
+            (
+                "Stats expense", round(rng.uniform(5, 200), 2), rng.choice(member_ids), group_id,
+                datetime(2025, 1, 1, 12) + timedelta(days=day), rng.choice(["Food", "Travel", None])
+            )
+            for day in range(0, 120, 3)
+        ]
+        expense_ids = server.insert_rows_chunked(
+            cursor,
+            "INSERT INTO expenses (description, amount, paid_by, group_id, expense_date, category) VALUES ",
+            "(%s, %s, %s, %s, %s, %s)",
+            expense_rows
+        )
+        split_rows = []
+        for expense_id, row in zip(expense_ids, expense_rows):
+            # The first member shares every expense, so the user-scoped ranges are never empty
+            participants = member_ids[:1] + rng.sample(member_ids[1:], rng.randint(1, len(member_ids) - 1))
+            split_rows.extend((expense_id, user_id, round(row[1] / len(participants), 2)) for user_id in participants)
+        server.insert_rows_chunked(
+            cursor, "INSERT INTO expense_splits (expense_id, user_id, amount) VALUES ", "(%s, %s, %s)", split_rows
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+    try:
+        server.rebuild_expense_rollups(conn, group_id)
+    finally:
+        conn.close()
+    return group_id, member_ids
+
+
+def direct_aggregate(cursor, scope, scope_id, start, end):
+    """The same stats aggregated straight from expenses/expense_splits, in summarize_spending's shape."""
+    paid_filter = "e.group_id = %s" if scope == 'group' else "e.paid_by = %s"
+    share_filter = "e.group_id = %s" if scope == 'group' else "es.user_id = %s"
+    params = (scope_id, start, end + timedelta(days=1))
+    cursor.execute(f"""
+        SELECT LEFT(e.expense_date, 7) as month, COALESCE(e.category, '') as category,
+               e.paid_by as user_id, SUM(e.amount) as paid, 0 as share, COUNT(*) as expenses
+        FROM expenses e
+        WHERE {paid_filter} AND e.expense_date >= %s AND e.expense_date < %s
+        GROUP BY LEFT(e.expense_date, 7), COALESCE(e.category, ''), e.paid_by
+        UNION ALL
+        SELECT LEFT(e.expense_date, 7) as month, COALESCE(e.category, '') as category,
+               es.user_id, 0 as paid, SUM(es.amount) as share, 0 as expenses
+        FROM expense_splits es
+        INNER JOIN expenses e ON es.expense_id = e.id
+        WHERE {share_filter} AND e.expense_date >= %s AND e.expense_date < %s
+        GROUP BY LEFT(e.expense_date, 7), COALESCE(e.category, ''), es.user_id
+    """, params * 2)
+    buckets = {}
+    for row in cursor.fetchall():
+        bucket = buckets.setdefault((row['month'], row['category'] or None, row['user_id']), [0.0, 0.0, 0])
+        bucket[0] += float(row['paid'])
+        bucket[1] += float(row['share'])
+        bucket[2] += int(row['expenses'])
+    return {key: (round(paid, 2), round(share, 2), expenses) for key, (paid, share, expenses) in buckets.items()}
+
+
+@pytest.mark.parametrize("scope", ['group', 'user'])
+@pytest.mark.parametrize("start, end", [
+    (date(2025, 1, 15), date(2025, 3, 31)),  # partial first month, then full months
+    (date(2025, 1, 15), date(2025, 4, 10)),  # partial months at both edges
+    (date(2025, 2, 10), date(2025, 2, 20)),  # a single partial month
+    (date(2025, 2, 1), date(2025, 3, 31)),  # full months only, all from rollups
+])
+def test_stats_match_a_direct_aggregate(server, spending_group, scope, start, end):
+    group_id, member_ids = spending_group
+    scope_id = group_id if scope == 'group' else member_ids[0]
+
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        rows = server.query_spending_stats(cursor, scope, scope_id, start, end)
+        expected = direct_aggregate(cursor, scope, scope_id, start, end)
+    finally:
+        cursor.close()
+        conn.close()
+
+    summary = server.summarize_spending(rows, GROUP_BY)
+    actual = {
+        (row['month'], row['category'], row['user_id']): (row['paid'], row['share'], row['expenses'])
+        for row in summary['rows']
+    }
+    assert expected  # every range above has some spending in it
+    assert actual == expected
@@ -0,0 +1,102 @@
+"""
+POST /api/sync/push: offline mutations are applied group by group, rejected
+ones do not affect the rest, and re-uploading a batch applies nothing twice.
+"""
+from .conftest import call_endpoint, create_group, create_users
+
+
+def expense(group_id, payer, members, amount):
+    return {
+        "description": "Offline expense", "amount": amount, "group_id": group_id,
+        "paid_by_user_id": payer.id, "split_type": "equal", "splits": {str(m.id): 0 for m in members},
+    }
+
+
+def count_rows(server, table, group_ids):
+    conn = server.db_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ",".join(["%s"] * len(group_ids))
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE group_id IN ({placeholders})", group_ids)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_push_applies_per_group_and_replays_duplicates(server, db_schema):
+    members = create_users(server, "offline", 3)
+    home, trip = create_group(server, members), create_group(server, members[:2])
+    other = create_group(server, create_users(server, "stranger", 2))
+    me = members[0]
+
+    push = server.SyncPush(mutations=[
+        server.SyncMutation(client_id="m1", type="create_expense", data=expense(home, me, members, 30.0)),
+        server.SyncMutation(client_id="m2", type="create_expense", data=expense(trip, me, members[:2], 10.0)),
+        server.SyncMutation(client_id="m3", type="record_settlement", data={
+            "group_id": trip, "payer_id": members[1].id, "payee_id": me.id, "amount": 5.0,
+        }),
+        server.SyncMutation(client_id="m4", type="create_expense", data=expense(home, me, members, -1.0) | {"split_type": "bogus"}),
+        server.SyncMutation(client_id="m5", type="create_expense", data=expense(other, me, members, 10.0)),
+        server.SyncMutation(client_id="m6", type="delete_everything", data={}),
+    ])
+
+    first = call_endpoint(server, server.push_sync_mutations, push, current_user=me)
+    statuses = {result["client_id"]: (result["status"], result["status_code"]) for result in first["results"]}
+    assert [result["client_id"] for result in first["results"]] == ["m1", "m2", "m3", "m4", "m5", "m6"]
+    assert statuses["m1"] == statuses["m2"] == statuses["m3"] == ("applied", 201)
+    assert statuses["m4"] == ("rejected", 400)
+    assert statuses["m5"] == ("rejected", 403)
+    assert statuses["m6"] == ("rejected", 400)
+    assert first["server_time"]
+
+    # The trip settled up, so its cycle closed
+    assert count_rows(server, "cycle_snapshots", [trip]) == 1
+
+    second = call_endpoint(server, server.push_sync_mutations, push, current_user=me)
+    assert [result["status"] for result in second["results"][:3]] == ["duplicate"] * 3
+    assert second["results"][0]["result"]["id"] == first["results"][0]["result"].id
+    assert count_rows(server, "expenses", [home, trip]) == 2
+    assert count_rows(server, "settlements", [home, trip]) == 1
+
+
+def test_rejected_mutation_does_not_leave_its_method_lock_behind(server, db_schema, monkeypatch):
+    members = create_users(server, "offlinelock", 3)
+    group_id = create_group(server, members)
+    me, other = members[0], members[1]
+    call_endpoint(server, server.create_expense, server.ExpenseCreate(**expense(group_id, me, members, 30.0)),
+                  idempotency_key=None, current_user=me)
+
+    # The first settlement locks the group to 'detailed', then fails late and is rolled back
+    close_cycle = server.close_cycle_if_settled
+    failures = [server.mysql.connector.Error(msg="Data too long", errno=1406)]
+
+    def failing_close(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return close_cycle(*args, **kwargs)
+
+    monkeypatch.setattr(server, "close_cycle_if_settled", failing_close)
+
+    settlement = {"group_id": group_id, "payer_id": other.id, "payee_id": me.id, "amount": 5.0}
+    push = server.SyncPush(mutations=[
+        server.SyncMutation(client_id="lock1", type="record_settlement", data=settlement | {"settlement_type": "detailed"}),
+        server.SyncMutation(client_id="lock2", type="record_settlement", data=settlement | {"settlement_type": "simplified"}),
+    ])
+    result = call_endpoint(server, server.push_sync_mutations, push, current_user=me)
+    assert [r["status"] for r in result["results"]] == ["rejected", "applied"]
+
+
+def test_sync_ids_and_header_keys_do_not_collide(server, db_schema):
+    members = create_users(server, "offlinekeys", 2)
+    group_id = create_group(server, members)
+    me = members[0]
+
+    call_endpoint(server, server.create_expense, server.ExpenseCreate(**expense(group_id, me, members, 12.0)),
+                  idempotency_key="sync:k1", current_user=me)
+    push = server.SyncPush(mutations=[
+        server.SyncMutation(client_id="k1", type="create_expense", data=expense(group_id, me, members, 12.0)),
+    ])
+    result = call_endpoint(server, server.push_sync_mutations, push, current_user=me)
+    assert result["results"][0]["status"] == "applied"
+    assert count_rows(server, "expenses", [group_id]) == 2